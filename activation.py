@@ -0,0 +1,285 @@
+"""
+Activation phrase detection for Jarvis
+
+Compiles every activation phrase into a single regex over normalized tokens
+(punctuation, filler words and common ASR misspellings smoothed out), so a
+batch is scanned in one pass. A short per-session tail of recent tokens is
+kept between scans, so a phrase split across segments or batches
+("Hey..." | "Jarvis, what's the weather") is still caught.
+
+The tails live in process memory. With a single app process (gunicorn's
+default of one worker, any number of threads) every webhook for a session
+sees the previous one's tail. With several workers, consecutive webhooks
+for a session can land on different workers: a phrase split across those
+payloads is missed, and a worker may prepend a tail older than the
+session's previous payload. Phrases inside one payload are caught either
+way.
+"""
+
+import os
+import re
+import bisect
+import threading
+from collections import OrderedDict, namedtuple
+
+# Activation phrases (case-insensitive, punctuation is ignored)
+ACTIVATION_PHRASES = [
+    "hey jarvis",
+    "hey, jarvis",
+    "hi jarvis",
+    "hi, jarvis",
+    "hello jarvis",
+    "hello, jarvis",
+    "okay jarvis",
+    "okay, jarvis",
+    "ok jarvis",
+    "ok, jarvis",
+]
+
+# Common ASR misspellings, mapped to the canonical token
+ASR_VARIANTS = {
+    'jervis': 'jarvis',
+    'jarvus': 'jarvis',
+    'jarvas': 'jarvis',
+    'jarves': 'jarvis',
+    'javis': 'jarvis',
+    'jarbis': 'jarvis',
+    'garvis': 'jarvis',
+    'charvis': 'jarvis',
+    'jarviss': 'jarvis',
+    'hay': 'hey',
+    'hei': 'hey',
+    'heya': 'hey',
+    'hiya': 'hi',
+    'helo': 'hello',
+    'hullo': 'hello',
+    'okey': 'okay',
+    'okie': 'okay',
+}
+
+# ASR sometimes splits the wake word into two tokens
+SPLIT_VARIANTS = {
+    ('jar', 'vis'): 'jarvis',
+    ('jar', 'viss'): 'jarvis',
+    ('o', 'k'): 'ok',
+}
+
+# Hesitations dropped before matching ("hey, uh, Jarvis")
+FILLER_WORDS = {'uh', 'uhh', 'um', 'umm', 'uhm', 'er', 'erm', 'ah', 'hmm', 'mm', 'mhm'}
+
+# Optional speaker filter, cuts false activations (each one costs an LLM call)
+USER_ONLY = os.getenv('ACTIVATION_USER_ONLY', 'false').lower() == 'true'
+SPEAKERS = [s.strip() for s in os.getenv('ACTIVATION_SPEAKERS', '').split(',') if s.strip()]
+MAX_TRACKED_SESSIONS = 1024
+
+# Characters kept from the end of a session's previous batch to catch split phrases
+TAIL_CHARS = 64
+
+_WORD = "a-z0-9'"
+_TOKEN_RE = re.compile(rf"[{_WORD}]+")
+
+ActivationMatch = namedtuple('ActivationMatch', ['phrase', 'segment_index'])
+
+def normalize_tokens(text):
+    """
+    Normalize text into matching tokens
+
+    Args:
+        text (str): Raw transcript text
+
+    Returns:
+        list: Lowercase tokens with punctuation, filler words and ASR variants normalized
+    """
+    tokens = []
+    for raw in _TOKEN_RE.findall(text.lower()):
+        token = raw.strip("'")
+        if not token or token in FILLER_WORDS:
+            continue
+        token = ASR_VARIANTS.get(token, token)
+        if tokens and (tokens[-1], token) in SPLIT_VARIANTS:
+            tokens[-1] = SPLIT_VARIANTS[(tokens[-1], token)]
+            continue
+        tokens.append(token)
+    return tokens
+
+def _token_pattern(token):
+    """Regex for one canonical token plus its ASR spellings and splits"""
+    spellings = {re.escape(token)}
+    spellings.update(re.escape(v) for v, canonical in ASR_VARIANTS.items() if canonical == token)
+    spellings.update(
+        rf"{re.escape(first)}[^{_WORD}]*{re.escape(second)}"
+        for (first, second), canonical in SPLIT_VARIANTS.items() if canonical == token
+    )
+    return '(?:' + '|'.join(sorted(spellings, key=len, reverse=True)) + ')'
+
+def compile_phrases(phrases):
+    """
+    Compile activation phrases into one regex over raw lowercase text
+
+    Token normalization is built into the pattern: words may be separated by
+    any punctuation or whitespace plus filler words, and each word accepts its
+    ASR variants. The whole batch is then scanned in a single regex pass.
+
+    Args:
+        phrases (list): Activation phrases
+
+    Returns:
+        tuple: (compiled pattern, sorted list of canonical phrases)
+    """
+    canonical = {' '.join(normalize_tokens(p)) for p in phrases}
+    canonical.discard('')
+    if not canonical:
+        raise ValueError("At least one activation phrase is required")
+
+    fillers = '|'.join(sorted(FILLER_WORDS, key=len, reverse=True))
+    separator = rf"[^{_WORD}]+(?:(?:{fillers})[^{_WORD}]+)*"
+
+    alternatives = [
+        separator.join(_token_pattern(token) for token in phrase.split())
+        for phrase in sorted(canonical, key=len, reverse=True)
+    ]
+    pattern = re.compile(rf"(?<![{_WORD}])(?:{'|'.join(alternatives)})(?![{_WORD}])")
+    return pattern, sorted(canonical)
+
+class ActivationMatcher:
+    """
+    Single-pass, multi-phrase activation matcher with per-session tail buffers
+
+    Thread-safe; tails are kept for the most recently seen MAX_TRACKED_SESSIONS
+    sessions, in this process only (cross-batch matching assumes one app
+    process, see the module docstring).
+    """
+
+    def __init__(self, phrases=ACTIVATION_PHRASES, user_only=USER_ONLY, speakers=SPEAKERS,
+                 max_sessions=MAX_TRACKED_SESSIONS):
+        self._pattern, self.phrases = compile_phrases(phrases)
+
+        self.user_only = user_only
+        self.speakers = set(speakers or [])
+        self.max_sessions = max_sessions
+
+        self._tails = OrderedDict()  # session_id -> trailing text of the previous batch
+        self._lock = threading.Lock()
+
+    def _accepts(self, segment):
+        """Apply the optional is_user / speaker filter"""
+        if self.user_only and not segment.get('is_user'):
+            return False
+        if self.speakers and segment.get('speaker') not in self.speakers:
+            return False
+        return True
+
+    def _remember_tail(self, session_id, text):
+        """Keep the end of this batch's text, cut at a word boundary"""
+        tail = text[-TAIL_CHARS:]
+        if len(text) > TAIL_CHARS:
+            boundary = re.search(rf"[^{_WORD}]", tail)
+            tail = tail[boundary.end():] if boundary else ''
+        with self._lock:
+            self._tails[session_id] = tail
+            self._tails.move_to_end(session_id)
+            while len(self._tails) > self.max_sessions:
+                self._tails.popitem(last=False)
+
+    def scan(self, segments, session_id=None):
+        """
+        Find every activation in a batch of segments
+
+        Segments must be passed in order; with a session_id, the tail of the
+        previous scan for that session is prepended so phrases spanning
+        batches are caught.
+
+        Args:
+            segments (list): Transcript dicts with 'text' (and optionally 'is_user', 'speaker')
+            session_id (str, optional): Session to keep cross-batch state for
+
+        Returns:
+            list: ActivationMatch tuples, one per detected phrase
+        """
+        tail = ''
+        if session_id is not None:
+            with self._lock:
+                tail = self._tails.get(session_id, '')
+
+        parts = [tail]
+        starts = []   # offset of each accepted segment in the joined text
+        indexes = []  # original index of each accepted segment
+        position = len(tail) + 1
+        filtered = self.user_only or self.speakers
+        for index, segment in enumerate(segments):
+            if filtered and not self._accepts(segment):
+                continue
+            text = segment.get('text') or ''
+            parts.append(text)
+            starts.append(position)
+            indexes.append(index)
+            position += len(text) + 1
+
+        text = '\n'.join(parts).lower()
+
+        if session_id is not None:
+            self._remember_tail(session_id, text)
+
+        if not starts:
+            return []
+
+        matches = []
+        for match in self._pattern.finditer(text):
+            owner = bisect.bisect_right(starts, match.end() - 1) - 1
+            if owner < 0:
+                continue  # Entirely inside the previous batch's tail, already reported
+            phrase = ' '.join(normalize_tokens(match.group(0)))
+            matches.append(ActivationMatch(phrase, indexes[owner]))
+
+        return matches
+
+    def detect(self, segments, session_id=None):
+        """
+        Find the first activation in a batch of segments
+
+        Args:
+            segments (list): Transcript dicts, oldest first
+            session_id (str, optional): Session to keep cross-batch state for
+
+        Returns:
+            ActivationMatch: First detected phrase, or None
+        """
+        matches = self.scan(segments, session_id)
+        return matches[0] if matches else None
+
+    def reset(self, session_id):
+        """Forget the cross-batch tail for a session"""
+        with self._lock:
+            self._tails.pop(session_id, None)
+
+_default_matcher = None
+_default_matcher_lock = threading.Lock()
+
+def get_matcher():
+    """Get the shared activation matcher, creating it on first use"""
+    global _default_matcher
+    if _default_matcher is None:
+        with _default_matcher_lock:
+            if _default_matcher is None:
+                _default_matcher = ActivationMatcher()
+    return _default_matcher
+
+def flag_activations(segments, session_id):
+    """
+    Flag incoming segments that complete an activation phrase
+
+    Called on the ingest path so the processor only has to look at sessions
+    with a pending activation. Sets segment['activation'] on every segment.
+
+    Args:
+        segments (list): Segment dicts from one webhook payload, in order
+        session_id (str): Omi session ID the segments belong to
+
+    Returns:
+        list: ActivationMatch tuples that were found
+    """
+    matches = get_matcher().scan(segments, session_id)
+    activated = {m.segment_index for m in matches}
+    for index, segment in enumerate(segments):
+        segment['activation'] = index in activated
+    return matches
@@ -1,11 +1,48 @@
 """
 Jarvis AI Agent using OpenAI Agents SDK
 Handles tool execution, conversation management, and web search automatically
+
+Agent runs execute on one long-lived asyncio event loop in a background
+thread, which owns a single pooled HTTP client for the model API. Many runs
+can be in flight at once (up to AGENT_CONCURRENCY); sync callers hand work to
+the loop with submit() and wait on the returned future.
+
+With streaming, the response text is handed out in SMS-sized chunks as the
+model writes it: the first complete sentence goes out right away. Once a
+model turn starts a tool call, the rest of its text is not part of the
+answer and is dropped; whatever was already texted is reported through
+on_chunk, so callers can save what the user actually got.
 """
 
-from agents import Agent, Runner, WebSearchTool
+import os
+import re
+import time
+import atexit
+import asyncio
+import threading
+import concurrent.futures
+import httpx
+from openai import AsyncOpenAI
+from agents import Agent, Runner, WebSearchTool, set_default_openai_client
 from tools import send_text_message
+import log
+import metrics
+import tracing
 import sessions
+import outbox
+import turns
+
+# Configuration
+AGENT_CONCURRENCY = int(os.getenv('AGENT_CONCURRENCY', '8'))  # agent runs in flight at once
+AGENT_TIMEOUT = float(os.getenv('AGENT_TIMEOUT', '120'))  # seconds a sync caller waits for a run
+OPENAI_MAX_CONNECTIONS = int(os.getenv('OPENAI_MAX_CONNECTIONS', '20'))
+OPENAI_CONNECT_TIMEOUT = float(os.getenv('OPENAI_CONNECT_TIMEOUT', '10'))  # seconds
+OPENAI_READ_TIMEOUT = float(os.getenv('OPENAI_READ_TIMEOUT', '90'))  # seconds, web search can be slow
+STREAM_RESPONSES = os.getenv('STREAM_RESPONSES', 'false').lower() == 'true'  # text the first sentence early
+SMS_SEGMENT_CHARS = int(os.getenv('SMS_SEGMENT_CHARS', '320'))  # max characters per streamed text
+FIRST_CHUNK_MIN_CHARS = int(os.getenv('FIRST_CHUNK_MIN_CHARS', '20'))  # don't text a lone "Sure."
+
+logger = log.get_logger('ai_handler')
 
 # Jarvis agent definition
 jarvis_agent = Agent(
@@ -53,71 +90,482 @@ RESPONSE FORMAT:
 # Note: Session management is now handled by sessions.py module
 # Uses OpenAI Conversations API with PostgreSQL persistence
 
-def send_to_jarvis(transcript_text: str, omi_session_id: str):
+# Agent runtime state, owned by the event loop thread
+_loop = None
+_loop_thread = None
+_http_client = None
+_semaphore = None
+_runtime_lock = threading.Lock()
+_stats_lock = threading.Lock()
+_stats = {
+    'submitted': 0,
+    'completed': 0,
+    'failed': 0,
+    'timed_out': 0,
+    'in_flight': 0,
+    'max_in_flight': 0,
+    'latency_total_ms': 0.0,
+    'latency_max_ms': 0.0,
+    'streamed': 0,
+    'chunks_sent': 0,
+    'first_text_total_ms': 0.0,
+    'first_text_max_ms': 0.0,
+}
+
+# Output items that make the runner run a tool and ask the model again
+_LOCAL_TOOL_CALLS = {'function_call', 'computer_call'}
+
+# End of a sentence: terminal punctuation (plus closing quotes/brackets) then whitespace
+_SENTENCE_END = re.compile(r"[.!?…]+[\"')\]]*\s+|\n+")
+
+class ResponseChunker:
+    """
+    Split streamed response text into SMS-sized chunks
+    
+    The first chunk is released as soon as a complete sentence of at least
+    first_min_chars is available. Later chunks are held until max_chars of
+    text has built up, then cut at the last sentence end (or word break)
+    that fits. flush() returns whatever is left at the end of the run.
+    """
+    
+    def __init__(self, max_chars=SMS_SEGMENT_CHARS, first_min_chars=FIRST_CHUNK_MIN_CHARS):
+        self.max_chars = max_chars
+        self.first_min_chars = first_min_chars
+        self.chunks_emitted = 0
+        self._buffer = ''
+    
+    def _cut(self, limit):
+        """Position to cut the buffer at: last sentence end in the back half of limit, else last space"""
+        window = self._buffer[:limit + 1]
+        cut = None
+        for match in _SENTENCE_END.finditer(window):
+            if match.end() >= limit // 2:
+                cut = match.end()
+        if cut is None:
+            space = window.rfind(' ', 0, limit + 1)
+            cut = space + 1 if space > 0 else limit
+        return cut
+    
+    def _take(self, cut):
+        chunk = self._buffer[:cut].strip()
+        self._buffer = self._buffer[cut:].lstrip()
+        if chunk:
+            self.chunks_emitted += 1
+        return chunk
+    
+    def feed(self, text):
+        """
+        Add streamed text
+        
+        Args:
+            text (str): Next text delta from the model
+            
+        Returns:
+            list: Chunks ready to send now (often empty)
+        """
+        self._buffer += text
+        ready = []
+        
+        if self.chunks_emitted == 0:
+            for match in _SENTENCE_END.finditer(self._buffer):
+                if match.end() > self.max_chars:
+                    break
+                if len(self._buffer[:match.end()].strip()) >= self.first_min_chars:
+                    ready.append(self._take(match.end()))
+                    break
+        
+        while len(self._buffer) > self.max_chars:
+            chunk = self._take(self._cut(self.max_chars))
+            if chunk:
+                ready.append(chunk)
+        
+        return [chunk for chunk in ready if chunk]
+    
+    def discard(self):
+        """
+        Drop text that hasn't been released yet
+        
+        Returns:
+            int: Characters dropped
+        """
+        dropped = len(self._buffer.strip())
+        self._buffer = ''
+        return dropped
+    
+    def flush(self):
+        """
+        Release the remaining text at the end of the run
+        
+        Returns:
+            list: Remaining chunks, each at most max_chars
+        """
+        ready = []
+        while self._buffer.strip():
+            limit = len(self._buffer) if len(self._buffer) <= self.max_chars else self._cut(self.max_chars)
+            chunk = self._take(limit)
+            if chunk:
+                ready.append(chunk)
+        self._buffer = ''
+        return ready
+
+async def _init_runtime():
+    """Create the shared HTTP client and concurrency limit inside the event loop"""
+    global _http_client, _semaphore
+    
+    _http_client = httpx.AsyncClient(
+        limits=httpx.Limits(
+            max_connections=OPENAI_MAX_CONNECTIONS,
+            max_keepalive_connections=OPENAI_MAX_CONNECTIONS
+        ),
+        timeout=httpx.Timeout(OPENAI_READ_TIMEOUT, connect=OPENAI_CONNECT_TIMEOUT)
+    )
+    # Used by the agent runner and by OpenAIConversationsSession
+    set_default_openai_client(AsyncOpenAI(http_client=_http_client))
+    _semaphore = asyncio.Semaphore(AGENT_CONCURRENCY)
+
+def _run_loop(loop):
+    """Event loop thread entry point"""
+    asyncio.set_event_loop(loop)
+    loop.run_forever()
+
+def start_runtime():
+    """
+    Start the agent event loop thread (idempotent)
+    
+    Returns:
+        asyncio.AbstractEventLoop: The running agent loop
+    """
+    global _loop, _loop_thread
+    
+    with _runtime_lock:
+        if _loop is not None and _loop.is_running():
+            return _loop
+        
+        loop = asyncio.new_event_loop()
+        thread = threading.Thread(target=_run_loop, args=(loop,), name='agent-loop', daemon=True)
+        thread.start()
+        asyncio.run_coroutine_threadsafe(_init_runtime(), loop).result()
+        
+        _loop, _loop_thread = loop, thread
+        logger.info('agent.runtime_started', concurrency=AGENT_CONCURRENCY,
+                    max_connections=OPENAI_MAX_CONNECTIONS)
+        return _loop
+
+def stop_runtime(timeout=5):
+    """
+    Close the shared HTTP client and stop the agent event loop
+    
+    Args:
+        timeout (float): Seconds to wait for the client to close
+    """
+    global _loop, _loop_thread, _http_client
+    
+    with _runtime_lock:
+        if _loop is None:
+            return
+        
+        loop, thread = _loop, _loop_thread
+        _loop, _loop_thread = None, None
+        
+        try:
+            if _http_client is not None:
+                asyncio.run_coroutine_threadsafe(_http_client.aclose(), loop).result(timeout)
+        except Exception as e:
+            logger.error('agent.client_close_failed', str(e))
+        _http_client = None
+        
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join(timeout)
+        if not thread.is_alive():
+            loop.close()
+
+def _record_run(elapsed_ms, ok):
+    """Update run counters once an agent run settles"""
+    metrics.AGENT_RUN_SECONDS.observe(elapsed_ms / 1000, outcome='completed' if ok else 'failed')
+    with _stats_lock:
+        _stats['in_flight'] -= 1
+        if ok:
+            _stats['completed'] += 1
+            _stats['latency_total_ms'] += elapsed_ms
+            _stats['latency_max_ms'] = max(_stats['latency_max_ms'], elapsed_ms)
+        else:
+            _stats['failed'] += 1
+
+def _trace_run(result):
+    """Record the finished run's model, token usage and web searches on the current trace"""
+    trace = tracing.current_trace.get()
+    if trace is None:
+        return
+    try:
+        usage = result.context_wrapper.usage
+        web_searches = sum(
+            1 for item in result.new_items
+            if getattr(getattr(item, 'raw_item', None), 'type', None) == 'web_search_call'
+        )
+        trace.set(
+            model=str(jarvis_agent.model),
+            usage={
+                'input_tokens': usage.input_tokens,
+                'output_tokens': usage.output_tokens,
+                'total_tokens': usage.total_tokens,
+                'requests': usage.requests,
+            },
+            web_searches=web_searches,
+        )
+    except Exception as e:
+        logger.warning('agent.trace_usage_failed', str(e))
+
+async def _run_streamed(session, transcript_text, on_chunk, started):
+    """
+    Run the agent with streamed output, passing SMS-sized chunks to on_chunk
+    
+    Text deltas are chunked as they arrive, so the first sentence is texted
+    while the model is still writing. When a turn starts a call to a local
+    tool (send_text_message), the next model turn holds the answer: the
+    turn's text not yet handed out is dropped and later deltas of that turn
+    are ignored. Chunks already handed out stay sent.
+    
+    on_chunk is blocking (it sends a text), so each call runs in a worker
+    thread; calls are chained so chunks are delivered in order without
+    holding up consumption of the stream. If the run is cancelled (the
+    caller timed out), chunks not yet handed to on_chunk are dropped.
+    
+    Returns:
+        RunResultStreaming: The finished run
+    """
+    chunker = ResponseChunker()
+    delivery = None
+    
+    async def deliver(previous, chunk):
+        if previous is not None:
+            await previous
+        try:
+            await asyncio.to_thread(on_chunk, chunk)
+        except Exception:
+            logger.exception('agent.chunk_delivery_failed')
+    
+    def dispatch(chunks):
+        nonlocal delivery
+        for chunk in chunks:
+            if delivery is None:
+                elapsed_ms = (time.monotonic() - started) * 1000
+                logger.info('agent.first_chunk', elapsed_ms=round(elapsed_ms))
+                tracing.add_stage('first_text', elapsed_ms)
+                with _stats_lock:
+                    _stats['first_text_total_ms'] += elapsed_ms
+                    _stats['first_text_max_ms'] = max(_stats['first_text_max_ms'], elapsed_ms)
+            with _stats_lock:
+                _stats['chunks_sent'] += 1
+            delivery = asyncio.ensure_future(deliver(delivery, chunk))
+    
+    result = Runner.run_streamed(
+        jarvis_agent,
+        transcript_text,
+        session=session
+    )
+    
+    searches = {}  # web search item id -> start time, for the trace's web_search stage
+    tool_turn = False  # the current model turn calls a local tool, so its text isn't the answer
+    
+    try:
+        async for event in result.stream_events():
+            if event.type != "raw_response_event":
+                continue
+            data_type = getattr(event.data, 'type', None)
+            if data_type == "response.created":
+                tool_turn = False
+            elif data_type == "response.output_text.delta":
+                if not tool_turn:
+                    dispatch(chunker.feed(event.data.delta))
+            elif data_type == "response.output_item.added":
+                if not tool_turn and getattr(event.data.item, 'type', None) in _LOCAL_TOOL_CALLS:
+                    tool_turn = True
+                    dropped = chunker.discard()
+                    logger.debug('agent.turn_not_final', "Calls a tool, dropping its unsent text", dropped_chars=dropped)
+            elif data_type == "response.completed":
+                if not tool_turn:
+                    # The turn that ends the run: text the rest without waiting for the wrap-up
+                    dispatch(chunker.flush())
+            elif data_type == "response.web_search_call.in_progress":
+                searches[event.data.item_id] = time.monotonic()
+            elif data_type == "response.web_search_call.completed":
+                search_started = searches.pop(event.data.item_id, None)
+                if search_started is not None:
+                    tracing.add_stage('web_search', (time.monotonic() - search_started) * 1000)
+        dispatch(chunker.flush())
+    except asyncio.CancelledError:
+        # The caller gave up on the run and may already be retrying the batch
+        if delivery is not None:
+            delivery.cancel()
+            delivery = None
+        raise
+    finally:
+        # Text that was already handed out still gets delivered if the run fails
+        if delivery is not None:
+            await delivery
+    
+    with _stats_lock:
+        _stats['streamed'] += 1
+    return result
+
+async def send_to_jarvis_async(transcript_text: str, omi_session_id: str, on_chunk=None, sent_texts=None, trace=None):
     """
     Send transcript to Jarvis agent with persistent conversation history
     
+    Must run on the agent event loop (see submit()). At most
+    AGENT_CONCURRENCY runs proceed at once; the rest wait their turn.
+    
     Args:
         transcript_text: The formatted transcript
         omi_session_id: Session ID from Omi device
+        on_chunk (callable, optional): Streams the response; called from a worker
+            thread with each SMS-sized chunk, in order, as the model writes it.
+            A turn that goes on to call a tool may already have handed out its
+            first chunks, so the chunks are what was texted, which can differ
+            from the returned final output
+        sent_texts (list, optional): Collects a TextHandle for every text the
+            send_text_message tool dispatches during the run
+        trace (tracing.Trace, optional): Trace to record stage timings and
+            token usage on (tools and worker threads pick it up from context)
         
     Returns:
         str: Jarvis's response text, or None if error
     """
-    import asyncio
+    # Scoped to this run's task, so concurrent runs don't see each other's texts
+    outbox.current_run_texts.set(sent_texts)
+    if trace is not None:
+        tracing.current_trace.set(trace)
     
-    try:
-        # Get or create OpenAI Conversation session (with database persistence)
-        session = sessions.get_or_create_session(omi_session_id)
+    queued = time.monotonic()
+    async with _semaphore:
+        with _stats_lock:
+            _stats['in_flight'] += 1
+            _stats['max_in_flight'] = max(_stats['max_in_flight'], _stats['in_flight'])
+        started = time.monotonic()
+        tracing.add_stage('agent_queue', (started - queued) * 1000)
+        ok = False
         
-        print("\n" + "="*60)
-        print("SENDING TO JARVIS (with Agents SDK):")
-        print("-"*60)
-        print(transcript_text)
-        print("="*60 + "\n")
-        
-        # Check if we're in a background thread
-        # If so, we need to create a new event loop
         try:
-            loop = asyncio.get_event_loop()
-            if loop.is_closed():
-                loop = asyncio.new_event_loop()
-                asyncio.set_event_loop(loop)
-        except RuntimeError:
-            # No event loop in this thread, create one
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-        
-        # Run the agent - SDK handles everything!
-        # Tools are executed automatically
-        # Conversation history is maintained by OpenAI Conversations API
-        result = Runner.run_sync(
-            jarvis_agent,
-            transcript_text,
-            session=session
-        )
-        
-        # Save OpenAI conversation ID to database after first use
-        sessions.save_conversation_id_for_session(omi_session_id, session)
+            # Session lookups hit Postgres, keep them off the event loop
+            with tracing.stage('session_lookup'):
+                session = await asyncio.to_thread(sessions.get_or_create_session, omi_session_id)
+            
+            logger.info('agent.run_started', omi_session_id=omi_session_id,
+                        prompt_chars=len(transcript_text), streaming=on_chunk is not None)
+            logger.dump('agent.prompt', transcript_text, omi_session_id=omi_session_id)
+            
+            # Run the agent - SDK handles everything!
+            # Tools are executed automatically
+            # Conversation history is maintained by OpenAI Conversations API
+            with tracing.stage('agent'):
+                if on_chunk is None:
+                    result = await Runner.run(
+                        jarvis_agent,
+                        transcript_text,
+                        session=session
+                    )
+                else:
+                    result = await _run_streamed(session, transcript_text, on_chunk, started)
+            _trace_run(result)
+            
+            # Save OpenAI conversation ID to database after first use
+            with tracing.stage('session_save'):
+                await asyncio.to_thread(sessions.save_conversation_id_for_session, omi_session_id, session)
+            
+            logger.info('agent.run_completed', omi_session_id=omi_session_id,
+                        elapsed_ms=round((time.monotonic() - started) * 1000),
+                        response_chars=len(result.final_output or ''))
+            logger.dump('agent.response', result.final_output, omi_session_id=omi_session_id)
+            
+            ok = True
+            return result.final_output
+            
+        except Exception:
+            logger.exception('agent.run_failed', omi_session_id=omi_session_id)
+            return None
         
-        print("\n" + "="*60)
-        print("JARVIS RESPONSE:")
-        print("-"*60)
-        print(result.final_output)
-        print("="*60 + "\n")
+        finally:
+            _record_run((time.monotonic() - started) * 1000, ok)
+
+def submit(transcript_text: str, omi_session_id: str, on_chunk=None, sent_texts=None) -> concurrent.futures.Future:
+    """
+    Hand an agent run to the event loop from any thread
+    
+    Args:
+        transcript_text: The formatted transcript
+        omi_session_id: Session ID from Omi device
+        on_chunk (callable, optional): Receives streamed response chunks (see send_to_jarvis_async)
+        sent_texts (list, optional): Collects texts dispatched by tools (see send_to_jarvis_async)
         
-        return result.final_output
+    Returns:
+        concurrent.futures.Future: Resolves to Jarvis's response text, or None if error
+    """
+    loop = start_runtime()
+    with _stats_lock:
+        _stats['submitted'] += 1
+    # The caller's trace (if any) follows the run onto the event loop
+    coro = send_to_jarvis_async(transcript_text, omi_session_id, on_chunk, sent_texts, tracing.current_trace.get())
+    return asyncio.run_coroutine_threadsafe(coro, loop)
+
+def send_to_jarvis(transcript_text: str, omi_session_id: str, timeout=None, on_chunk=None, sent_texts=None):
+    """
+    Send transcript to Jarvis and wait for the response (sync wrapper)
+    
+    Args:
+        transcript_text: The formatted transcript
+        omi_session_id: Session ID from Omi device
+        on_chunk (callable, optional): Receives streamed response chunks (see send_to_jarvis_async)
+        sent_texts (list, optional): Collects texts dispatched by tools (see send_to_jarvis_async)
+        timeout (float, optional): Seconds to wait, defaults to AGENT_TIMEOUT
         
+    Returns:
+        str: Jarvis's response text, or None if error or timeout
+    """
+    future = submit(transcript_text, omi_session_id, on_chunk, sent_texts)
+    
+    try:
+        return future.result(timeout=AGENT_TIMEOUT if timeout is None else timeout)
+    except concurrent.futures.TimeoutError:
+        future.cancel()
+        with _stats_lock:
+            _stats['timed_out'] += 1
+        logger.error('agent.timeout', omi_session_id=omi_session_id, timeout=AGENT_TIMEOUT if timeout is None else timeout)
+        return None
     except Exception as e:
-        print(f"ERROR calling Jarvis: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.error('agent.run_failed', str(e), omi_session_id=omi_session_id)
         return None
 
+def get_runtime_stats():
+    """
+    Get agent runtime statistics
+    
+    Returns:
+        dict: Run counts, concurrency, latency and time to first streamed text
+    """
+    with _stats_lock:
+        stats = dict(_stats)
+    
+    stats['running'] = _loop is not None and _loop.is_running()
+    stats['concurrency'] = AGENT_CONCURRENCY
+    stats['latency_avg_ms'] = round(stats['latency_total_ms'] / stats['completed'], 2) if stats['completed'] else 0.0
+    stats['latency_max_ms'] = round(stats['latency_max_ms'], 2)
+    stats['first_text_avg_ms'] = round(stats['first_text_total_ms'] / stats['streamed'], 2) if stats['streamed'] else 0.0
+    stats['first_text_max_ms'] = round(stats['first_text_max_ms'], 2)
+    stats['streaming'] = STREAM_RESPONSES
+    del stats['latency_total_ms']
+    del stats['first_text_total_ms']
+    
+    return stats
+
+# Close pooled connections on interpreter / worker shutdown
+atexit.register(stop_runtime)
+
 # Legacy function for compatibility
 def format_transcripts_for_ai(transcripts):
     """
     Format transcript segments into a conversational message
+    Overlapping fragments are collapsed and consecutive segments of a
+    speaker merged into one turn (see turns.py)
     
     Args:
         transcripts (list): List of transcript dictionaries
@@ -131,7 +579,7 @@ def format_transcripts_for_ai(transcripts):
     # Group by speaker and create a natural conversation format
     formatted_lines = []
     
-    for transcript in transcripts:
+    for transcript in turns.assemble(None, transcripts):
         speaker = transcript.get('speaker', 'UNKNOWN')
         text = transcript.get('text', '').strip()
         
@@ -1,25 +1,47 @@
 import os
-from flask import Flask, request, jsonify
+import logging
+from flask import Flask, Response, request, jsonify, stream_with_context
 from datetime import datetime
 from dotenv import load_dotenv
-import db
+import log
+import storage
+import ingest
+import seen_segments
+import ai_handler
+import sessions
+import sms
+import outbox
+import activation
+import metrics
+import tracing
 import transcript_processor
+import context_builder
+import turns
 
 # Load environment variables
 load_dotenv()
 
+logger = log.get_logger('app')
+
 app = Flask(__name__)
 
 # Initialize database on startup
 try:
-    db.init_db()
-    print("Database initialized successfully")
+    storage.get().init_db()
 except Exception as e:
-    print(f"Warning: Could not initialize database: {e}")
+    logger.warning('db.init_failed', str(e))
 
 # Start transcript processor thread
 transcript_processor.start_processor()
 
+# Start SMS outbox delivery thread
+if outbox.SMS_OUTBOX_ENABLED:
+    outbox.start_worker()
+
+# Start ingest writer thread (async ingest mode only)
+if ingest.is_enabled():
+    ingest.start_writer()
+
 @app.route('/', methods=['GET', 'POST'])
 def health_check():
     """Health check endpoint for Railway - also handles webhook if posted to root"""
@@ -34,15 +56,90 @@ def health_check():
         'timestamp': datetime.now().isoformat()
     })
 
+# /conversation pagination limits
+CONVERSATION_DEFAULT_LIMIT = 100
+CONVERSATION_MAX_LIMIT = 1000
+
+def encode_cursor(message):
+    """Encode a message's (timestamp, id) position as an opaque cursor string"""
+    return f"{message['timestamp'].isoformat()}_{message['id']}"
+
+def parse_cursor(value):
+    """
+    Parse a cursor produced by encode_cursor
+    
+    Returns:
+        tuple: (timestamp, id), or None if value is empty
+        
+    Raises:
+        ValueError: If the cursor is malformed
+    """
+    if not value:
+        return None
+    timestamp, _, message_id = value.rpartition('_')
+    return datetime.fromisoformat(timestamp), int(message_id)
+
 @app.route('/conversation', methods=['GET'])
 def get_conversation():
-    """Get conversation history"""
+    """
+    Get conversation history
+    
+    Query parameters:
+        limit: Page size (default 100, max 1000)
+        before / after: Cursors from a previous page's prev_cursor / next_cursor
+        session_id: Only return messages from this Omi session
+        format: 'ndjson' to stream every matching message, one JSON object per line
+    """
     try:
-        messages = db.get_all_messages()
+        try:
+            before = parse_cursor(request.args.get('before'))
+            after = parse_cursor(request.args.get('after'))
+        except ValueError:
+            return jsonify({'status': 'error', 'message': 'Invalid cursor'}), 400
+        
+        try:
+            limit = int(request.args['limit']) if request.args.get('limit') else None
+        except ValueError:
+            return jsonify({'status': 'error', 'message': 'limit must be an integer'}), 400
+        
+        session_id = request.args.get('session_id') or None
+        
+        if limit is not None and limit <= 0:
+            return jsonify({'status': 'error', 'message': 'limit must be positive'}), 400
+        
+        streaming = (request.args.get('format') == 'ndjson'
+                     or request.accept_mimetypes.best == 'application/x-ndjson')
+        
+        if streaming:
+            # Server-side cursor: memory stays flat regardless of history size
+            def generate():
+                try:
+                    for message in storage.get().iter_messages(before, after, session_id, limit):
+                        yield app.json.dumps(message) + "\n"
+                except Exception:
+                    logger.exception('conversation.stream_failed')
+            
+            return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+        
+        limit = min(limit or CONVERSATION_DEFAULT_LIMIT, CONVERSATION_MAX_LIMIT)
+        messages = storage.get().get_messages_page(limit, before, after, session_id)
+        
+        if messages is None:
+            return jsonify({'status': 'error', 'message': 'Failed to load messages'}), 500
+        
+        # Pass next_cursor as 'after' for the following page and prev_cursor as
+        # 'before' for the preceding one; None when there's nothing more that way
+        full_page = len(messages) == limit
+        paging_backwards = before is not None and after is None
+        more_before = full_page if paging_backwards else after is not None
+        more_after = True if paging_backwards else full_page
+        
         return jsonify({
             'status': 'success',
             'count': len(messages),
-            'messages': messages
+            'messages': messages,
+            'prev_cursor': encode_cursor(messages[0]) if messages and more_before else None,
+            'next_cursor': encode_cursor(messages[-1]) if messages and more_after else None
         }), 200
     except Exception as e:
         return jsonify({
@@ -50,7 +147,83 @@ def get_conversation():
             'message': str(e)
         }), 500
 
+@app.route('/stats', methods=['GET'])
+def get_stats():
+    """Get runtime statistics (database connection pool, ingest queue, seen-segment filter, transcript backlog, prompt context, turn assembly, agent runs, session cache, SMS, SMS outbox, logging)"""
+    return jsonify({
+        'status': 'success',
+        'db_backend': storage.get().__name__,
+        'db_pool': storage.get().get_pool_stats(),
+        'ingest': ingest.get_stats(),
+        'seen_segments': seen_segments.get_stats(),
+        'transcripts': storage.get().get_transcript_queue_stats(),
+        'context': context_builder.get_stats(),
+        'turns': turns.get_stats(),
+        'agent': ai_handler.get_runtime_stats(),
+        'sessions': sessions.get_cache_stats(),
+        'sms': sms.get_stats(),
+        'sms_outbox': outbox.get_stats(),
+        'logging': log.get_stats(),
+        'timestamp': datetime.now().isoformat()
+    }), 200
+
+# /traces/stats window limits (seconds)
+TRACE_STATS_DEFAULT_WINDOW = 3600
+TRACE_STATS_MAX_WINDOW = 30 * 24 * 3600
+
+@app.route('/traces/stats', methods=['GET'])
+def get_trace_stats():
+    """
+    Get p50/p95/p99 per processing stage
+    
+    Query parameters:
+        window: Look-back window in seconds (default 3600, max 30 days)
+    """
+    window = request.args.get('window', TRACE_STATS_DEFAULT_WINDOW, type=int)
+    if window <= 0:
+        return jsonify({'status': 'error', 'message': 'window must be positive'}), 400
+    window = min(window, TRACE_STATS_MAX_WINDOW)
+    
+    stats = storage.get().get_trace_stage_percentiles(window)
+    if stats is None:
+        return jsonify({'status': 'error', 'message': 'Failed to load traces'}), 500
+    
+    return jsonify(dict(stats, status='success', window_seconds=window)), 200
+
+@app.route('/traces/<trace_id>', methods=['GET'])
+def get_trace(trace_id):
+    """Get a trace's processing attempts and the texts it produced"""
+    trace = storage.get().get_trace(trace_id)
+    if trace is None:
+        return jsonify({'status': 'error', 'message': 'Failed to load trace'}), 500
+    if not trace['attempts'] and not trace['texts']:
+        return jsonify({'status': 'error', 'message': 'Trace not found'}), 404
+    
+    return jsonify(dict(trace, status='success', trace_id=trace_id)), 200
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Prometheus metrics in the text exposition format"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@metrics.register_collector
+def _collect_backlog():
+    """Refresh backlog gauges at scrape time (one query per scrape)"""
+    stats = storage.get().get_transcript_queue_stats()
+    for state in ('pending', 'claimed', 'pending_activations', 'dead_lettered'):
+        if stats.get(state) is not None:
+            metrics.TRANSCRIPT_BACKLOG.set(stats[state], state=state)
+    metrics.TRANSCRIPT_BACKLOG_AGE.set(stats.get('oldest_pending_age_seconds') or 0)
+
+@app.after_request
+def _count_webhook_status(response):
+    """Count webhook responses by status (the root URL also accepts webhooks)"""
+    if request.method == 'POST' and request.endpoint in ('webhook', 'health_check'):
+        metrics.WEBHOOK_REQUESTS.inc(status=response.status_code)
+    return response
+
 @app.route('/webhook', methods=['POST'])
+@metrics.timed(metrics.WEBHOOK_SECONDS)
 def webhook():
     """Receive and process Omi device webhooks"""
     try:
@@ -58,85 +231,112 @@ def webhook():
         data = request.get_json()
         
         if not data:
-            print("Warning: Received empty webhook data")
+            logger.warning('webhook.empty')
             return jsonify({'status': 'error', 'message': 'No data received'}), 400
         
-        # Print the full webhook data for debugging
-        print("\n" + "="*60)
-        print(f"NEW WEBHOOK RECEIVED - {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
-        print("="*60)
-        
         # Check for segments (can be 'transcript_segments' or 'segments')
         segments = data.get('transcript_segments') or data.get('segments', [])
+        session_id = data.get('session_id', 'unknown')
+        # Follows these segments through processing to the texts they trigger (see tracing.py)
+        trace_id = tracing.new_id()
+        result = None
+        queued = False
+        filtered = []
+        
+        if not isinstance(segments, list) or not all(isinstance(s, dict) for s in segments):
+            logger.warning('webhook.malformed_segments', session_id=session_id)
+            return jsonify({'status': 'error', 'message': 'Malformed transcript segments'}), 400
+        
+        logger.info('webhook.received', session_id=session_id, segments=len(segments), trace_id=trace_id)
+        metrics.SEGMENTS_RECEIVED.inc(len(segments))
+        
+        # Resent / overlapping segments this process already stored cost no database work
+        segments, filtered = seen_segments.drop_seen(segments)
+        if filtered:
+            metrics.SEGMENTS_FILTERED.inc(len(filtered))
+            logger.debug('webhook.filtered', session_id=session_id, segments=len(filtered))
         
         if segments:
-            print(f"\nTranscript Segments: {len(segments)} segment(s)")
-            print("-"*60)
-            
-            # Save each segment to database
-            session_id = data.get('session_id', 'unknown')
+            # Per-segment detail is debug-only; skip the loop entirely otherwise
+            log_segments = logger.enabled(logging.DEBUG)
             
             for i, segment in enumerate(segments, 1):
-                speaker_id = segment.get('speaker_id', 'Unknown')
-                text = segment.get('text', '')
-                start_time = segment.get('start', 0)
-                end_time = segment.get('end', 0)
-                
-                print(f"\nSegment {i}:")
-                print(f"  Speaker: {speaker_id}")
-                print(f"  Time: {start_time:.2f}s - {end_time:.2f}s")
-                print(f"  Text: {text}")
+                if log_segments:
+                    logger.debug(
+                        'webhook.segment', segment.get('text', ''),
+                        index=i, speaker=segment.get('speaker_id', 'Unknown'),
+                        start=segment.get('start', 0), end=segment.get('end', 0)
+                    )
                 
-                # Add session_id to segment data
+                # Add session_id and trace_id to segment data
                 segment['session_id'] = session_id
-                
-                # Save to database
-                db.save_transcript_segment(segment)
-        
-        # Check for session information
-        if 'session_id' in data:
-            print(f"\nSession ID: {data['session_id']}")
+                segment['trace_id'] = trace_id
+            
+            # Flag activation phrases now so the processor only wakes for activated sessions
+            for match in activation.flag_activations(segments, session_id):
+                metrics.ACTIVATIONS.inc()
+                logger.info('webhook.activation', session_id=session_id, trace_id=trace_id,
+                            phrase=match.phrase, segment=match.segment_index + 1)
+            
+            if ingest.is_enabled():
+                # Hand off to the writer thread and ack right away
+                if not ingest.submit(segments):
+                    logger.warning('webhook.ingest_queue_full', session_id=session_id)
+                    response = jsonify({
+                        'status': 'error',
+                        'message': 'Ingest queue full, retry later'
+                    })
+                    response.headers['Retry-After'] = str(ingest.RETRY_AFTER)
+                    return response, 503
+                queued = True
+            else:
+                # Save the whole payload in one transaction
+                result = storage.get().save_transcript_segments(segments, session_id)
+                if result is not None:
+                    seen_segments.remember(result)
+                    metrics.SEGMENTS_INSERTED.inc(len(result['inserted']))
+                    metrics.SEGMENTS_DUPLICATE.inc(len(result['duplicates']))
+            
+            if not queued and result is None:
+                return jsonify({
+                    'status': 'error',
+                    'message': 'Failed to save transcript segments'
+                }), 500
+        elif filtered:
+            # Every segment was a known duplicate
+            result = {'inserted': [], 'duplicates': []}
         
         # Check for structured data (memory/conversation)
         if 'structured' in data:
             structured = data['structured']
-            print("\nStructured Data:")
-            if 'title' in structured:
-                print(f"  Title: {structured['title']}")
-            if 'overview' in structured:
-                print(f"  Overview: {structured['overview']}")
-            if 'category' in structured:
-                print(f"  Category: {structured['category']}")
-            if 'action_items' in structured:
-                action_items = structured['action_items']
-                if action_items:
-                    print(f"  Action Items: {len(action_items)}")
-                    for item in action_items:
-                        print(f"    - {item.get('description', 'No description')}")
-        
-        # Print any other interesting fields
-        for key in ['language', 'source', 'created_at', 'started_at', 'finished_at']:
-            if key in data:
-                print(f"\n{key.replace('_', ' ').title()}: {data[key]}")
-        
-        print("\n" + "="*60)
-        print("Raw JSON Data:")
-        print("-"*60)
-        import json
-        print(json.dumps(data, indent=2))
-        print("="*60 + "\n")
+            logger.info(
+                'webhook.structured', structured.get('title'),
+                session_id=session_id, category=structured.get('category'),
+                action_items=len(structured.get('action_items') or [])
+            )
+        
+        # Full payload for debugging (sampled, see LOG_DUMP_SAMPLE_RATE / LOG_DEBUG_DUMPS)
+        logger.dump('webhook.raw_payload', data, session_id=session_id)
         
         # Return success response
-        return jsonify({
+        response = {
             'status': 'success',
             'message': 'Webhook received and processed',
+            'trace_id': trace_id,
             'timestamp': datetime.now().isoformat()
-        }), 200
+        }
+        if queued:
+            response['message'] = 'Webhook received, segments queued'
+            response['segments_queued'] = len(segments)
+        elif result is not None:
+            response['segments_saved'] = len(result['inserted'])
+            response['segments_duplicate'] = len(result['duplicates']) + len(filtered)
+        if filtered:
+            response['segments_filtered'] = len(filtered)
+        return jsonify(response), 200
         
     except Exception as e:
-        print(f"\nERROR processing webhook: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception('webhook.failed')
         return jsonify({
             'status': 'error',
             'message': str(e)
@@ -149,15 +349,10 @@ if __name__ == '__main__':
     # Check if running locally (no PORT env var = local)
     is_local = 'PORT' not in os.environ
     
-    print("\n" + "="*60)
-    print("OMI WEBHOOK RECEIVER STARTING")
-    print("="*60)
-    print(f"Server running on port {port}")
-    print(f"Webhook endpoint: http://localhost:{port}/webhook")
-    print(f"Health check: http://localhost:{port}/")
-    if is_local:
-        print(f"Auto-reload: ENABLED (debug mode)")
-    print("="*60 + "\n")
+    logger.info(
+        'server.starting', f"Webhook endpoint: http://localhost:{port}/webhook",
+        port=port, auto_reload=is_local
+    )
     
     # Enable debug mode for local development (auto-reloads on file changes)
     # Disabled on Railway to avoid issues in production
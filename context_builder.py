@@ -0,0 +1,393 @@
+"""
+Prompt context builder for activated transcript batches
+
+Instead of sending the whole claimed batch to the agent, only a window
+around each activation is sent verbatim: CONTEXT_BEFORE_SECONDS of speech
+before the activation and everything after it up to the end of the
+utterance (the first pause longer than CONTEXT_UTTERANCE_GAP seconds,
+capped at CONTEXT_AFTER_SECONDS). Older ambient speech is folded into a
+per-session rolling summary kept in memory and updated incrementally with
+each batch, so a long meeting or a backlog after an outage costs a bounded
+prompt (CONTEXT_MAX_CHARS of transcript plus CONTEXT_SUMMARY_MAX_CHARS of
+summary) instead of thousands of lines.
+
+Segments are first assembled into speaker turns (see turns.py), so
+windows, summaries and prompts work on deduplicated turns rather than on
+overlapping Omi fragments.
+
+The summary is extractive: condensed lines are scored by how many distinct
+content words they carry, scores decay as newer speech arrives, and the
+lowest scoring lines are evicted once the summary is over budget. No model
+call is made to build it.
+"""
+
+import os
+import re
+import threading
+from collections import OrderedDict
+import turns
+
+# Configuration
+CONTEXT_WINDOWING = os.getenv('CONTEXT_WINDOWING', 'true').lower() == 'true'  # false sends whole batches
+CONTEXT_BEFORE_SECONDS = float(os.getenv('CONTEXT_BEFORE_SECONDS', '60'))  # speech kept verbatim before an activation
+CONTEXT_AFTER_SECONDS = float(os.getenv('CONTEXT_AFTER_SECONDS', '60'))  # longest utterance kept after an activation
+CONTEXT_UTTERANCE_GAP = float(os.getenv('CONTEXT_UTTERANCE_GAP', '3'))  # seconds of silence that end the utterance
+CONTEXT_MAX_CHARS = int(os.getenv('CONTEXT_MAX_CHARS', '4000'))  # verbatim transcript per prompt
+CONTEXT_SUMMARY_MAX_CHARS = int(os.getenv('CONTEXT_SUMMARY_MAX_CHARS', '1500'))  # rolling summary per session
+CONTEXT_MAX_SESSIONS = int(os.getenv('CONTEXT_MAX_SESSIONS', '1024'))  # sessions with a cached summary
+
+# Segments kept around an activation when the batch has no start/end times
+FALLBACK_SEGMENTS = 5
+
+# Longest condensed line kept in a summary
+SUMMARY_LINE_CHARS = 200
+
+# Existing summary scores are multiplied by this for every batch folded in,
+# so newer speech wins over equally informative older speech
+SUMMARY_DECAY = 0.8
+
+# Row ids remembered per summary to skip retried batches; ids commit out of
+# order, so this is a set of recent ids rather than a high-water mark
+SUMMARY_SEEN_IDS = 2048
+
+GAP_MARKER = "[...]"
+
+# Words that don't make a line worth keeping in the summary
+_STOP_WORDS = {
+    'about', 'actually', 'after', 'again', 'also', 'because', 'been', 'before', 'being', 'could',
+    'didn', 'does', 'doesn', 'doing', 'don', 'from', 'going', 'gonna', 'have', 'just', 'know',
+    'like', 'mean', 'much', 'okay', 'really', 'right', 'should', 'some', 'that', 'them', 'then',
+    'there', 'they', 'thing', 'think', 'this', 'want', 'well', 'were', 'what', 'when', 'where',
+    'which', 'will', 'with', 'would', 'yeah', 'your',
+}
+_WORD_RE = re.compile(r"[a-z0-9']+")
+_SPACE_RE = re.compile(r"\s+")
+
+class _Summary:
+    """Rolling extractive summary of one session's older speech"""
+
+    def __init__(self):
+        self.lines = []  # [score, sequence, text], in speech order
+        self.chars = 0
+        self.sequence = 0
+        self.seen = OrderedDict()  # row ids folded in, oldest first, so retried batches aren't added twice
+
+    def absorb(self, transcripts, max_chars):
+        """Fold new transcripts into the summary, evicting the least salient lines beyond max_chars"""
+        fresh = [t for t in transcripts if not _ids(t) or any(i not in self.seen for i in _ids(t))]
+        if not fresh:
+            return 0
+
+        for line in self.lines:
+            line[0] *= SUMMARY_DECAY
+
+        added = 0
+        for speaker, text in _merge_speakers(fresh):
+            score = _salience(text)
+            if score == 0:
+                continue  # "yeah", "okay, uh" and the like
+            line = _clip(f"{speaker}: {text}", SUMMARY_LINE_CHARS)
+            self.sequence += 1
+            self.lines.append([score, self.sequence, line])
+            self.chars += len(line) + 1
+            added += 1
+
+        if self.chars > max_chars:
+            # Evict the least salient lines (oldest first on ties) until the summary fits
+            evicted = set()
+            for line in sorted(self.lines, key=lambda line: (line[0], line[1])):
+                if self.chars <= max_chars:
+                    break
+                self.chars -= len(line[2]) + 1
+                evicted.add(line[1])
+            self.lines = [line for line in self.lines if line[1] not in evicted]
+
+        for transcript in fresh:
+            for i in _ids(transcript):
+                self.seen[i] = None
+        while len(self.seen) > SUMMARY_SEEN_IDS:
+            self.seen.popitem(last=False)
+        return added
+
+    def render(self):
+        return "\n".join(line[2] for line in self.lines)
+
+_summaries = OrderedDict()  # session_id -> _Summary, least recently used first
+_summaries_lock = threading.Lock()
+_stats_lock = threading.Lock()
+_stats = {
+    'prompts': 0,
+    'segments_in': 0,
+    'segments_verbatim': 0,
+    'segments_summarized': 0,
+    'batch_chars': 0,
+    'prompt_chars': 0,
+    'truncated_prompts': 0,
+}
+
+def _ids(transcript):
+    """Row ids behind a transcript or assembled turn (empty if it has none, so it always counts as new)"""
+    if 'ids' in transcript:
+        return transcript['ids']
+    return [transcript['id']] if transcript.get('id') is not None else []
+
+def _clip(text, limit):
+    """Shorten text to limit characters, marking the cut"""
+    return text if len(text) <= limit else text[:max(limit - 1, 0)].rstrip() + "…"
+
+def _salience(text):
+    """Number of distinct content words in a line"""
+    return len({w for w in _WORD_RE.findall(text.lower()) if len(w) > 3 and w not in _STOP_WORDS})
+
+def _text(transcript):
+    return _SPACE_RE.sub(' ', transcript.get('text') or '').strip()
+
+def _merge_speakers(transcripts):
+    """Join consecutive segments of the same speaker into (speaker, text) pairs"""
+    merged = []
+    for transcript in transcripts:
+        text = _text(transcript)
+        if not text:
+            continue
+        speaker = transcript.get('speaker') or 'UNKNOWN'
+        if merged and merged[-1][0] == speaker:
+            merged[-1] = (speaker, f"{merged[-1][1]} {text}")
+        else:
+            merged.append((speaker, text))
+    return merged
+
+def format_lines(transcripts):
+    """
+    Format transcripts or assembled turns as "SPEAKER: text" lines, one each
+
+    Args:
+        transcripts (list): Transcript or turn dicts, oldest first
+
+    Returns:
+        list: Formatted lines (segments without text are skipped)
+    """
+    lines = []
+    for transcript in transcripts:
+        text = (transcript.get('text') or '').strip()
+        if text:
+            lines.append(f"{transcript.get('speaker', 'UNKNOWN')}: {text}")
+    return lines
+
+def _window(transcripts, index):
+    """
+    Index range [start, end) of the speech around the activation at index
+
+    Returns:
+        tuple: (start, end)
+    """
+    anchor = transcripts[index]
+    anchor_start = anchor.get('start_time')
+
+    if anchor_start is None:
+        return max(index - FALLBACK_SEGMENTS, 0), min(index + FALLBACK_SEGMENTS + 1, len(transcripts))
+
+    start = index
+    while start > 0:
+        previous = transcripts[start - 1]
+        previous_start = previous.get('start_time')
+        previous_end = previous.get('end_time', previous_start)
+        if previous_start is None or previous_start > anchor_start:
+            break  # no timing, or a different timeline (Omi restarted the clock)
+        if (previous_end if previous_end is not None else previous_start) < anchor_start - CONTEXT_BEFORE_SECONDS:
+            break
+        start -= 1
+
+    end = index + 1
+    last_end = anchor.get('end_time') if anchor.get('end_time') is not None else anchor_start
+    while end < len(transcripts):
+        following = transcripts[end]
+        following_start = following.get('start_time')
+        if following_start is None or following_start < anchor_start:
+            break
+        if following_start - last_end > CONTEXT_UTTERANCE_GAP or following_start > anchor_start + CONTEXT_AFTER_SECONDS:
+            break
+        following_end = following.get('end_time')
+        last_end = max(last_end, following_end if following_end is not None else following_start)
+        end += 1
+
+    return start, end
+
+def activation_windows(transcripts):
+    """
+    Merged index ranges of the speech around every activation in a batch
+
+    Args:
+        transcripts (list): A session's batch, oldest first, flagged with 'activation'
+
+    Returns:
+        list: Non-overlapping (start, end) index ranges in order
+    """
+    windows = []
+    for index, transcript in enumerate(transcripts):
+        if not transcript.get('activation'):
+            continue
+        start, end = _window(transcripts, index)
+        if windows and start <= windows[-1][1]:
+            windows[-1] = (windows[-1][0], max(windows[-1][1], end))
+        else:
+            windows.append((start, end))
+    return windows
+
+def _fit(transcripts, windows):
+    """
+    Shrink windows until their text fits CONTEXT_MAX_CHARS
+
+    Drops whole windows oldest first (the latest activation is the one
+    being answered), then the oldest lines before the latest activation,
+    then lines after it.
+
+    Returns:
+        list: (start, end) ranges that fit
+    """
+    # Formatted length of each line, so shrinking is a running total rather than re-formatting
+    lengths = [sum(len(line) + 1 for line in format_lines([t])) for t in transcripts]
+
+    def size(ranges):
+        return sum(sum(lengths[start:end]) for start, end in ranges)
+
+    windows = list(windows)
+    total = size(windows)
+    while len(windows) > 1 and total > CONTEXT_MAX_CHARS:
+        total -= size([windows.pop(0)])
+
+    start, end = windows[-1]
+    anchor = max(i for i in range(start, end) if transcripts[i].get('activation'))
+    while start < anchor and total > CONTEXT_MAX_CHARS:
+        total -= lengths[start]
+        start += 1
+    while end > anchor + 1 and total > CONTEXT_MAX_CHARS:
+        end -= 1
+        total -= lengths[end]
+    windows[-1] = (start, end)
+    return windows
+
+def _get_summary(session_id, create=True):
+    """Get a session's summary, creating it (and evicting the least recently used) if needed"""
+    with _summaries_lock:
+        summary = _summaries.get(session_id)
+        if summary is not None:
+            _summaries.move_to_end(session_id)
+        elif create:
+            summary = _summaries[session_id] = _Summary()
+            while len(_summaries) > CONTEXT_MAX_SESSIONS:
+                _summaries.popitem(last=False)
+        return summary
+
+def _absorb(session_id, units):
+    """Fold assembled turns into a session's rolling summary"""
+    if not units or CONTEXT_SUMMARY_MAX_CHARS <= 0:
+        return 0
+    summary = _get_summary(session_id)
+    with _summaries_lock:
+        added = summary.absorb(units, CONTEXT_SUMMARY_MAX_CHARS)
+    with _stats_lock:
+        _stats['segments_summarized'] += sum(u['segments'] for u in units)
+    return added
+
+def absorb(session_id, transcripts):
+    """
+    Fold ambient transcripts into a session's rolling summary
+
+    Called with the rows the processor sweeps (speech that never got an
+    activation), so the summary also covers speech between activations.
+
+    Args:
+        session_id (str): Omi session ID
+        transcripts (list): Transcript dicts from one swept or claimed batch
+
+    Returns:
+        int: Summary lines added
+    """
+    # Assembled even when unused for a prompt, so the session's turns stay continuous
+    return _absorb(session_id, turns.assemble(session_id, transcripts))
+
+def build_prompt(session_id, transcripts):
+    """
+    Build the agent prompt for an activated batch
+
+    The batch is assembled into speaker turns first. The turns around each
+    activation are kept verbatim; older speech in the batch is folded into
+    the session's rolling summary, which is prepended. Speech after the
+    last window is folded in afterwards, so it shows up in the next
+    prompt's summary. Without activations (or with CONTEXT_WINDOWING=false)
+    the whole batch is formatted as is.
+
+    Args:
+        session_id (str): Omi session ID the transcripts belong to
+        transcripts (list): The session's claimed transcripts, oldest first
+
+    Returns:
+        str: Prompt text, empty if the batch has no text
+    """
+    units = turns.assemble(session_id, transcripts)
+    windows = activation_windows(units) if CONTEXT_WINDOWING else []
+    if not windows:
+        return "\n".join(format_lines(units))
+
+    fitted = _fit(units, windows)
+    truncated = fitted != windows
+
+    verbatim = set()
+    for start, end in fitted:
+        verbatim.update(range(start, end))
+    last_end = fitted[-1][1]
+    earlier = [u for i, u in enumerate(units) if i not in verbatim and i < last_end]
+    later = units[last_end:]
+
+    _absorb(session_id, earlier)
+    summary = _get_summary(session_id, create=False)
+    with _summaries_lock:
+        summary_text = summary.render() if summary is not None else ''
+
+    parts = []
+    for start, end in fitted:
+        if parts or start > 0:
+            parts.append(GAP_MARKER)
+        parts.extend(format_lines(units[start:end]))
+    transcript_text = "\n".join(parts)
+
+    # A single segment can still be longer than the whole budget
+    if len(transcript_text) > CONTEXT_MAX_CHARS:
+        transcript_text = "…" + transcript_text[-(CONTEXT_MAX_CHARS - 1):].lstrip()
+        truncated = True
+
+    if summary_text:
+        prompt = f"Earlier in this conversation (condensed):\n{summary_text}\n\nRecent transcript:\n{transcript_text}"
+    else:
+        prompt = transcript_text
+
+    _absorb(session_id, later)
+
+    with _stats_lock:
+        _stats['prompts'] += 1
+        _stats['segments_in'] += len(transcripts)
+        _stats['segments_verbatim'] += sum(units[i]['segments'] for i in verbatim)
+        _stats['batch_chars'] += sum(len(line) + 1 for line in format_lines(transcripts))
+        _stats['prompt_chars'] += len(prompt)
+        _stats['truncated_prompts'] += truncated
+
+    return prompt
+
+def get_stats():
+    """
+    Get context builder statistics
+
+    Returns:
+        dict: Prompts built, segments kept verbatim vs summarized, and how
+              much smaller prompts are than the batches they came from
+    """
+    with _stats_lock:
+        stats = dict(_stats)
+    with _summaries_lock:
+        stats['cached_sessions'] = len(_summaries)
+
+    stats['windowing'] = CONTEXT_WINDOWING
+    stats['avg_prompt_chars'] = round(stats['prompt_chars'] / stats['prompts'], 1) if stats['prompts'] else 0.0
+    stats['char_reduction'] = round(1 - stats['prompt_chars'] / stats['batch_chars'], 4) if stats['batch_chars'] else 0.0
+
+    return stats
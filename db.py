@@ -1,39 +1,354 @@
+"""
+PostgreSQL storage backend (postgres:// and postgresql:// DATABASE_URLs)
+
+Implements the operations listed in storage.OPERATIONS on a pooled psycopg2
+connection; callers reach it through storage.get().
+"""
+
 import os
+import time
+import uuid
+import json
+import select
+import threading
+from collections import deque, OrderedDict
+from contextlib import contextmanager
 import psycopg2
-from psycopg2.extras import RealDictCursor
+from psycopg2 import extensions, sql
+from psycopg2.extras import RealDictCursor, execute_values
 from datetime import datetime
 from dotenv import load_dotenv
+import log
+from storage import timed_query, segment_rows
 
 load_dotenv()
 
+logger = log.get_logger('db')
+
+# Connection pool configuration
+POOL_MIN_SIZE = int(os.getenv('DB_POOL_MIN_SIZE', '1'))
+POOL_MAX_SIZE = int(os.getenv('DB_POOL_MAX_SIZE', '10'))
+POOL_CHECKOUT_TIMEOUT = float(os.getenv('DB_POOL_CHECKOUT_TIMEOUT', '10'))  # seconds
+POOL_HEALTHCHECK_INTERVAL = float(os.getenv('DB_POOL_HEALTHCHECK_INTERVAL', '30'))  # seconds
+
+# Channel signalled by the transcripts insert trigger (see schema.sql)
+NOTIFY_CHANNEL = 'new_transcripts'
+
 def get_connection():
-    """Get a database connection"""
+    """Get a new, unpooled database connection"""
     database_url = os.getenv('DATABASE_URL')
     if not database_url:
         raise ValueError("DATABASE_URL environment variable not set")
     return psycopg2.connect(database_url)
 
-def init_db():
-    """Initialize database tables from schema.sql"""
-    try:
+class PoolTimeout(Exception):
+    """Raised when no pooled connection becomes available in time"""
+
+class ConnectionPool:
+    """
+    Thread-safe PostgreSQL connection pool
+
+    Opens min_size connections up front and grows on demand up to max_size.
+    Connections are shared by the Flask request threads and the transcript
+    processor thread. Connections idle for longer than healthcheck_interval
+    seconds are pinged on checkout; with an interval of 0, every checkout
+    pings the connection. Broken ones are replaced transparently.
+    """
+
+    def __init__(self, min_size=POOL_MIN_SIZE, max_size=POOL_MAX_SIZE,
+                 checkout_timeout=POOL_CHECKOUT_TIMEOUT,
+                 healthcheck_interval=POOL_HEALTHCHECK_INTERVAL):
+        self.min_size = max(0, min_size)
+        self.max_size = max(1, max_size, self.min_size)
+        self.checkout_timeout = checkout_timeout
+        self.healthcheck_interval = healthcheck_interval
+
+        self._cond = threading.Condition()
+        self._idle = deque()  # (connection, last_used monotonic time)
+        self._in_use = 0
+        self._closed = False
+
+        # Stats
+        self._checkouts = 0
+        self._waits = 0
+        self._wait_time_total = 0.0
+        self._wait_time_max = 0.0
+        self._timeouts = 0
+        self._created = 0
+        self._discarded = 0
+
+        for _ in range(self.min_size):
+            self._idle.append((self._connect(), time.monotonic()))
+
+    def _connect(self):
         conn = get_connection()
-        cursor = conn.cursor()
+        with self._cond:
+            self._created += 1
+        return conn
+
+    def _is_healthy(self, conn, last_used):
+        """Check a connection before handing it out"""
+        if conn.closed:
+            return False
+        if time.monotonic() - last_used < self.healthcheck_interval:
+            return True
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1")
+            cursor.close()
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _close_quietly(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def getconn(self):
+        """
+        Check out a connection, waiting up to checkout_timeout if the pool is exhausted
+
+        Returns:
+            connection: A healthy psycopg2 connection
+        """
+        start = time.monotonic()
+        deadline = start + self.checkout_timeout
+        waited = False
+
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise PoolTimeout("Connection pool is closed")
+                if self._idle:
+                    conn, last_used = self._idle.pop()
+                    break
+                if self._in_use + len(self._idle) < self.max_size:
+                    conn, last_used = None, None
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._timeouts += 1
+                    raise PoolTimeout(
+                        f"No database connection available after {self.checkout_timeout}s"
+                    )
+                waited = True
+                self._cond.wait(remaining)
+            self._in_use += 1
+
+        # Connect / health-check outside the lock so other threads aren't blocked
+        try:
+            if conn is not None and not self._is_healthy(conn, last_used):
+                self._close_quietly(conn)
+                with self._cond:
+                    self._discarded += 1
+                conn = None
+            if conn is None:
+                conn = self._connect()
+        except Exception:
+            with self._cond:
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+
+        wait_time = time.monotonic() - start
+        with self._cond:
+            self._checkouts += 1
+            if waited:
+                self._waits += 1
+            self._wait_time_total += wait_time
+            self._wait_time_max = max(self._wait_time_max, wait_time)
+        return conn
+
+    def putconn(self, conn, discard=False):
+        """
+        Return a connection to the pool
+
+        Args:
+            conn: Connection previously returned by getconn()
+            discard (bool): Close the connection instead of reusing it
+        """
+        if not discard and not conn.closed:
+            try:
+                # Never hand out a connection with an open transaction
+                if conn.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except psycopg2.Error:
+                discard = True
+
+        with self._cond:
+            self._in_use -= 1
+            if discard or conn.closed or self._closed:
+                self._discarded += 1
+                self._close_quietly(conn)
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    def closeall(self):
+        """Close all idle connections and refuse further checkouts"""
+        with self._cond:
+            self._closed = True
+            while self._idle:
+                conn, _ = self._idle.pop()
+                self._discarded += 1
+                self._close_quietly(conn)
+            self._cond.notify_all()
+
+    def stats(self):
+        """
+        Get pool statistics
+
+        Returns:
+            dict: Pool size, usage and checkout wait times
+        """
+        with self._cond:
+            return {
+                'min_size': self.min_size,
+                'max_size': self.max_size,
+                'in_use': self._in_use,
+                'idle': len(self._idle),
+                'checkouts': self._checkouts,
+                'waits': self._waits,
+                'timeouts': self._timeouts,
+                'wait_time_total_ms': round(self._wait_time_total * 1000, 2),
+                'wait_time_avg_ms': round(self._wait_time_total * 1000 / self._checkouts, 3) if self._checkouts else 0.0,
+                'wait_time_max_ms': round(self._wait_time_max * 1000, 2),
+                'connections_created': self._created,
+                'connections_discarded': self._discarded,
+            }
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    """Get the shared connection pool, creating it on first use"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool()
+    return _pool
+
+@contextmanager
+def connection():
+    """
+    Check out a pooled connection for the duration of a with-block
+
+    Uncommitted work is rolled back when the block exits, and connections
+    that failed at the network level are discarded rather than reused.
+    """
+    pool = get_pool()
+    conn = pool.getconn()
+    discard = False
+    try:
+        yield conn
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        discard = True
+        raise
+    finally:
+        pool.putconn(conn, discard=discard)
+
+def get_pool_stats():
+    """
+    Get connection pool statistics
+
+    Returns:
+        dict: Pool stats, or an empty dict if the pool hasn't been created yet
+    """
+    if _pool is None:
+        return {}
+    return _pool.stats()
+
+
+def listen(channel=NOTIFY_CHANNEL):
+    """
+    Open a dedicated connection that LISTENs on a notification channel
+    
+    The connection is not pooled: it stays open for the listener's lifetime
+    and must be closed by the caller.
+    
+    Args:
+        channel (str): Channel name to listen on
         
-        # Read and execute schema.sql
-        with open('schema.sql', 'r') as f:
-            schema = f.read()
+    Returns:
+        connection: Autocommit psycopg2 connection subscribed to the channel
+    """
+    conn = get_connection()
+    conn.set_isolation_level(extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+    
+    cursor = conn.cursor()
+    cursor.execute(sql.SQL("LISTEN {}").format(sql.Identifier(channel)))
+    cursor.close()
+    
+    return conn
+
+def wait_for_notify(conn, timeout):
+    """
+    Block until a notification arrives on a listening connection
+    
+    Args:
+        conn: Connection returned by listen()
+        timeout (float): Maximum seconds to wait
         
-        cursor.execute(schema)
-        conn.commit()
-        cursor.close()
-        conn.close()
+    Returns:
+        list: Payloads of all pending notifications (empty on timeout)
+    """
+    if conn.notifies:
+        ready = True
+    else:
+        ready = select.select([conn], [], [], timeout) != ([], [], [])
+    
+    if not ready:
+        return []
+    
+    conn.poll()
+    payloads = [n.payload for n in conn.notifies]
+    conn.notifies.clear()
+    return payloads
+
+def init_db():
+    """Initialize database tables from schema.sql"""
+    try:
+        with connection() as conn:
+            cursor = conn.cursor()
+            
+            # Read and execute schema.sql
+            with open('schema.sql', 'r') as f:
+                schema = f.read()
+            
+            cursor.execute(schema)
+            conn.commit()
+            cursor.close()
         
-        print("Database initialized successfully")
+        logger.info('db.initialized')
         return True
     except Exception as e:
-        print(f"ERROR initializing database: {str(e)}")
+        logger.error('db.init_failed', str(e))
         return False
 
+# Insert transcript rows, skipping segment ids that were seen before
+# The partitioned transcripts table can't hold a global UNIQUE (segment_id), so
+# ids are registered in transcript_segment_ids and only new ones are inserted
+INSERT_SEGMENTS_QUERY = """
+    WITH incoming (segment_id, text, speaker, speaker_id, is_user, start_time, end_time, session_id, activation, trace_id) AS (
+        VALUES %s
+    ), registered AS (
+        INSERT INTO transcript_segment_ids (segment_id)
+        SELECT segment_id FROM incoming
+        ON CONFLICT (segment_id) DO NOTHING
+        RETURNING segment_id
+    )
+    INSERT INTO transcripts AS t
+    (segment_id, text, speaker, speaker_id, is_user, start_time, end_time, session_id, activation, trace_id)
+    SELECT i.* FROM incoming i JOIN registered r ON r.segment_id = i.segment_id
+    RETURNING t.segment_id
+"""
+SEGMENT_ROW_TEMPLATE = "(%s, %s, %s, %s::integer, %s::boolean, %s::float, %s::float, %s, %s::boolean, %s)"
+
+@timed_query
 def save_transcript_segment(segment_data):
     """
     Save a transcript segment to the database
@@ -45,47 +360,101 @@ def save_transcript_segment(segment_data):
         int: ID of saved transcript, or None if error
     """
     try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        
-        query = """
-            INSERT INTO transcripts 
-            (segment_id, text, speaker, speaker_id, is_user, start_time, end_time, session_id)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-            ON CONFLICT (segment_id) DO NOTHING
-            RETURNING id
-        """
+        with connection() as conn:
+            cursor = conn.cursor()
+            
+            query = """
+                WITH registered AS (
+                    INSERT INTO transcript_segment_ids (segment_id) VALUES (%s)
+                    ON CONFLICT (segment_id) DO NOTHING
+                    RETURNING segment_id
+                )
+                INSERT INTO transcripts 
+                (segment_id, text, speaker, speaker_id, is_user, start_time, end_time, session_id, activation, trace_id)
+                SELECT segment_id, %s, %s, %s, %s, %s, %s, %s, %s, %s FROM registered
+                RETURNING id
+            """
+            
+            cursor.execute(query, (
+                segment_data.get('id'),
+                segment_data.get('text', ''),
+                segment_data.get('speaker', 'UNKNOWN'),
+                segment_data.get('speaker_id', 0),
+                segment_data.get('is_user', False),
+                segment_data.get('start', 0.0),
+                segment_data.get('end', 0.0),
+                segment_data.get('session_id'),
+                bool(segment_data.get('activation', False)),
+                segment_data.get('trace_id')
+            ))
+            
+            result = cursor.fetchone()
+            conn.commit()
+            
+            transcript_id = result[0] if result else None
+            
+            cursor.close()
         
-        cursor.execute(query, (
-            segment_data.get('id'),
-            segment_data.get('text', ''),
-            segment_data.get('speaker', 'UNKNOWN'),
-            segment_data.get('speaker_id', 0),
-            segment_data.get('is_user', False),
-            segment_data.get('start', 0.0),
-            segment_data.get('end', 0.0),
-            segment_data.get('session_id')
-        ))
+        if transcript_id:
+            logger.debug('transcripts.saved', segment_id=segment_data.get('id'))
+        else:
+            logger.debug('transcripts.duplicate', segment_id=segment_data.get('id'))
         
-        result = cursor.fetchone()
-        conn.commit()
+        return transcript_id
         
-        transcript_id = result[0] if result else None
+    except Exception as e:
+        logger.error('transcripts.save_failed', str(e))
+        return None
+
+@timed_query
+def save_transcript_segments(segments, session_id=None):
+    """
+    Save a whole webhook payload of transcript segments in one transaction
+    
+    Uses a single multi-row insert that registers segment ids with
+    ON CONFLICT (segment_id) DO NOTHING and only stores the new ones, so the
+    batch costs one round trip and one commit regardless of its size.
+    
+    Args:
+        segments (list): Segment dicts from Omi webhook (flagged with 'activation' at ingest)
+        session_id (str, optional): Session ID applied to segments that don't carry one
         
-        cursor.close()
-        conn.close()
+    Returns:
+        dict: {'inserted': [segment ids], 'duplicates': [segment ids]}, or None if error
+    """
+    try:
+        rows = segment_rows(segments, session_id)
         
-        if transcript_id:
-            print(f"Saved transcript segment {segment_data.get('id')} to database")
-        else:
-            print(f"Transcript segment {segment_data.get('id')} already exists")
+        if not rows:
+            return {'inserted': [], 'duplicates': []}
         
-        return transcript_id
+        with connection() as conn:
+            cursor = conn.cursor()
+            
+            # page_size covers the whole batch so it goes out as a single statement
+            inserted_rows = execute_values(
+                cursor, INSERT_SEGMENTS_QUERY, rows,
+                template=SEGMENT_ROW_TEMPLATE, page_size=len(rows), fetch=True
+            )
+            conn.commit()
+            
+            cursor.close()
+        
+        inserted = {r[0] for r in inserted_rows}
+        result = {
+            'inserted': [r[0] for r in rows if r[0] in inserted],
+            'duplicates': [r[0] for r in rows if r[0] not in inserted],
+        }
+        
+        logger.debug('transcripts.saved', inserted=len(result['inserted']), duplicates=len(result['duplicates']))
+        
+        return result
         
     except Exception as e:
-        print(f"ERROR saving transcript segment: {str(e)}")
+        logger.error('transcripts.save_failed', str(e))
         return None
 
+@timed_query
 def get_unprocessed_transcripts():
     """
     Get all unprocessed transcripts
@@ -94,27 +463,27 @@ def get_unprocessed_transcripts():
         list: List of unprocessed transcript dictionaries
     """
     try:
-        conn = get_connection()
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
-        
-        query = """
-            SELECT * FROM transcripts 
-            WHERE processed = FALSE 
-            ORDER BY received_at ASC
-        """
-        
-        cursor.execute(query)
-        transcripts = cursor.fetchall()
-        
-        cursor.close()
-        conn.close()
+        with connection() as conn:
+            cursor = conn.cursor(cursor_factory=RealDictCursor)
+            
+            query = """
+                SELECT * FROM transcripts 
+                WHERE processed = FALSE 
+                ORDER BY received_at ASC
+            """
+            
+            cursor.execute(query)
+            transcripts = cursor.fetchall()
+            
+            cursor.close()
         
         return [dict(t) for t in transcripts]
         
     except Exception as e:
-        print(f"ERROR getting unprocessed transcripts: {str(e)}")
+        logger.error('transcripts.fetch_failed', str(e))
         return []
 
+@timed_query
 def mark_transcripts_processed(transcript_ids, message_id):
     """
     Mark transcripts as processed and link them to a message
@@ -127,31 +496,961 @@ def mark_transcripts_processed(transcript_ids, message_id):
         bool: True if successful, False otherwise
     """
     try:
-        conn = get_connection()
-        cursor = conn.cursor()
+        with connection() as conn:
+            cursor = conn.cursor()
+            
+            query = """
+                UPDATE transcripts 
+                SET processed = TRUE, message_id = %s 
+                WHERE id = ANY(%s)
+            """
+            
+            cursor.execute(query, (message_id, transcript_ids))
+            conn.commit()
+            
+            rows_updated = cursor.rowcount
+            
+            cursor.close()
         
-        query = """
-            UPDATE transcripts 
-            SET processed = TRUE, message_id = %s 
-            WHERE id = ANY(%s)
-        """
+        logger.debug('transcripts.processed', count=rows_updated)
+        return True
+        
+    except Exception as e:
+        logger.error('transcripts.mark_failed', str(e))
+        return False
+
+@timed_query
+def claim_transcript_batches(worker_id, max_sessions, lease_seconds, max_attempts):
+    """
+    Claim unprocessed transcripts for up to max_sessions sessions
+    
+    A session is claimable when it has a pending activation and none of its
+    unprocessed rows are leased or waiting out a retry delay, so each session is only ever worked on by one
+    processor at a time and its rows are handled in order. Claimed rows are
+    locked with FOR UPDATE SKIP LOCKED and leased to worker_id for
+    lease_seconds; rows whose lease expired after max_attempts claims are
+    dead-lettered first. Safe to call from many processes or hosts.
+    
+    Args:
+        worker_id (str): Unique identifier of the claiming processor
+        max_sessions (int): Maximum number of sessions to claim
+        lease_seconds (int): How long the claim is valid before another processor may take over
+        max_attempts (int): Claims allowed per row before it is dead-lettered
+        
+    Returns:
+        OrderedDict: session_id -> list of claimed transcript dicts (oldest first)
+    """
+    claimed = OrderedDict()
+    if max_sessions <= 0:
+        return claimed
+    
+    try:
+        with connection() as conn:
+            cursor = conn.cursor(cursor_factory=RealDictCursor)
+            
+            # Dead-letter rows whose processor died on their final attempt
+            cursor.execute("""
+                UPDATE transcripts
+                SET processed = TRUE, dead_lettered_at = NOW(),
+                    claimed_by = NULL, lease_expires_at = NULL,
+                    last_error = COALESCE(last_error, 'lease expired')
+                WHERE processed = FALSE
+                  AND lease_expires_at < NOW()
+                  AND attempts >= %s
+            """, (max_attempts,))
+            
+            # Sessions with a pending activation and no live lease or pending retry, oldest first
+            # (ambient rows without an activation are left to sweep_inactive_transcripts)
+            cursor.execute("""
+                SELECT COALESCE(session_id, 'unknown') AS session_key,
+                       MIN(received_at) AS oldest
+                FROM transcripts
+                WHERE processed = FALSE
+                GROUP BY 1
+                HAVING BOOL_OR(activation)
+                   AND BOOL_AND(lease_expires_at IS NULL OR lease_expires_at < NOW())
+                   AND BOOL_AND(next_attempt_at IS NULL OR next_attempt_at <= NOW())
+                ORDER BY oldest
+                LIMIT %s
+            """, (max_sessions,))
+            candidates = [row['session_key'] for row in cursor.fetchall()]
+            
+            for session_key in candidates:
+                # Serialize concurrent claimers on the same session for this transaction
+                cursor.execute(
+                    "SELECT pg_try_advisory_xact_lock(hashtext(%s)) AS locked",
+                    (f"transcripts:{session_key}",)
+                )
+                if not cursor.fetchone()['locked']:
+                    continue
+                
+                cursor.execute("""
+                    UPDATE transcripts t
+                    SET claimed_by = %s,
+                        lease_expires_at = NOW() + make_interval(secs => %s),
+                        attempts = t.attempts + 1
+                    WHERE t.id IN (
+                        SELECT id FROM transcripts
+                        WHERE processed = FALSE
+                          AND COALESCE(session_id, 'unknown') = %s
+                          AND (next_attempt_at IS NULL OR next_attempt_at <= NOW())
+                          AND (lease_expires_at IS NULL OR lease_expires_at < NOW())
+                        FOR UPDATE SKIP LOCKED
+                    )
+                    AND NOT EXISTS (
+                        -- Re-check: another processor may have claimed the session since we looked
+                        SELECT 1 FROM transcripts l
+                        WHERE l.processed = FALSE
+                          AND COALESCE(l.session_id, 'unknown') = %s
+                          AND l.lease_expires_at >= NOW()
+                    )
+                    RETURNING t.*
+                """, (worker_id, lease_seconds, session_key, session_key))
+                
+                rows = [dict(r) for r in cursor.fetchall()]
+                if rows:
+                    rows.sort(key=lambda r: (r['received_at'], r['id']))
+                    claimed[session_key] = rows
+            
+            conn.commit()
+            cursor.close()
+        
+        return claimed
+        
+    except Exception as e:
+        logger.error('transcripts.claim_failed', str(e))
+        return OrderedDict()
+
+@timed_query
+def complete_transcripts(transcript_ids, worker_id, message_id=None):
+    """
+    Mark claimed transcripts as processed and release their lease
+    
+    Only rows still leased to worker_id are updated, so a processor whose
+    lease expired can't overwrite the work of the one that took over.
+    
+    Args:
+        transcript_ids (list): IDs of the claimed transcripts
+        worker_id (str): Processor that holds the claim
+        message_id (int, optional): ID of the message these transcripts belong to
+        
+    Returns:
+        bool: True if successful, False otherwise
+    """
+    try:
+        with connection() as conn:
+            cursor = conn.cursor()
+            
+            query = """
+                UPDATE transcripts
+                SET processed = TRUE, message_id = %s,
+                    claimed_by = NULL, lease_expires_at = NULL, last_error = NULL
+                WHERE id = ANY(%s) AND claimed_by = %s
+            """
+            
+            cursor.execute(query, (message_id, transcript_ids, worker_id))
+            conn.commit()
+            
+            rows_updated = cursor.rowcount
+            
+            cursor.close()
+        
+        if rows_updated < len(transcript_ids):
+            logger.warning('transcripts.lease_lost', count=len(transcript_ids) - rows_updated, worker_id=worker_id)
+        logger.debug('transcripts.processed', count=rows_updated)
+        return True
+        
+    except Exception as e:
+        logger.error('transcripts.complete_failed', str(e))
+        return False
+
+@timed_query
+def release_transcripts(transcript_ids, worker_id, error, max_attempts, retry_base_delay, retry_max_delay):
+    """
+    Release claimed transcripts after a failure, scheduling a retry or dead-lettering them
+    
+    The retry delay grows exponentially with the attempt count
+    (retry_base_delay * 2^(attempts-1), capped at retry_max_delay). Rows that
+    have used up max_attempts are marked processed with dead_lettered_at set.
+    
+    Args:
+        transcript_ids (list): IDs of the claimed transcripts
+        worker_id (str): Processor that holds the claim
+        error (str): Failure reason, stored in last_error
+        max_attempts (int): Claims allowed per row before it is dead-lettered
+        retry_base_delay (float): Delay in seconds before the first retry
+        retry_max_delay (float): Upper bound on the retry delay in seconds
+        
+    Returns:
+        dict: {'retrying': count, 'dead_lettered': count}, or None if error
+    """
+    try:
+        with connection() as conn:
+            cursor = conn.cursor()
+            
+            query = """
+                UPDATE transcripts
+                SET claimed_by = NULL, lease_expires_at = NULL, last_error = %s,
+                    next_attempt_at = NOW() + make_interval(
+                        secs => LEAST(%s * POWER(2, GREATEST(attempts - 1, 0)), %s)
+                    ),
+                    processed = (attempts >= %s),
+                    dead_lettered_at = CASE WHEN attempts >= %s THEN NOW() END
+                WHERE id = ANY(%s) AND claimed_by = %s
+                RETURNING dead_lettered_at IS NOT NULL
+            """
+            
+            cursor.execute(query, (
+                error, retry_base_delay, retry_max_delay,
+                max_attempts, max_attempts, transcript_ids, worker_id
+            ))
+            dead_flags = [r[0] for r in cursor.fetchall()]
+            conn.commit()
+            
+            cursor.close()
+        
+        result = {
+            'retrying': dead_flags.count(False),
+            'dead_lettered': dead_flags.count(True),
+        }
+        logger.info('transcripts.released', retrying=result['retrying'], dead_lettered=result['dead_lettered'])
+        return result
+        
+    except Exception as e:
+        logger.error('transcripts.release_failed', str(e))
+        return None
+
+@timed_query
+def sweep_inactive_transcripts(grace_seconds, limit=5000):
+    """
+    Bulk-mark ambient transcripts that will never be sent to AI as processed
+    
+    Rows without an activation are kept for grace_seconds so they can serve
+    as context if an activation arrives in the same session, then swept in a
+    single UPDATE. Sessions with a pending activation are left alone. The
+    swept rows are returned so the processor can fold them into the
+    session's rolling summary.
+    
+    Args:
+        grace_seconds (int): Minimum age of a row before it is swept
+        limit (int): Maximum rows swept per call
+        
+    Returns:
+        OrderedDict: session_id -> list of swept transcript dicts (oldest first),
+                     empty if error
+    """
+    swept = OrderedDict()
+    
+    try:
+        with connection() as conn:
+            cursor = conn.cursor(cursor_factory=RealDictCursor)
+            
+            query = """
+                UPDATE transcripts
+                SET processed = TRUE
+                WHERE id IN (
+                    SELECT s.id FROM transcripts s
+                    WHERE s.processed = FALSE
+                      AND s.activation = FALSE
+                      AND s.received_at < NOW() - make_interval(secs => %s)
+                      AND (s.lease_expires_at IS NULL OR s.lease_expires_at < NOW())
+                      AND NOT EXISTS (
+                          SELECT 1 FROM transcripts a
+                          WHERE a.processed = FALSE
+                            AND a.activation
+                            AND COALESCE(a.session_id, 'unknown') = COALESCE(s.session_id, 'unknown')
+                      )
+                    LIMIT %s
+                    FOR UPDATE SKIP LOCKED
+                )
+                RETURNING id, segment_id, text, speaker, start_time, end_time,
+                          COALESCE(session_id, 'unknown') AS session_key, received_at
+            """
+            
+            cursor.execute(query, (grace_seconds, limit))
+            rows = [dict(r) for r in cursor.fetchall()]
+            conn.commit()
+            
+            cursor.close()
+        
+        rows.sort(key=lambda r: (r['session_key'], r['received_at'], r['id']))
+        for row in rows:
+            swept.setdefault(row['session_key'], []).append(row)
+        
+        if rows:
+            logger.info('transcripts.swept', count=len(rows), sessions=len(swept))
+        return swept
+        
+    except Exception as e:
+        logger.error('transcripts.sweep_failed', str(e))
+        return OrderedDict()
+
+@timed_query
+def ensure_transcript_partitions(months_ahead=3):
+    """
+    Make sure monthly transcripts partitions exist for the coming months
+    
+    Inserts never depend on this having run: rows for a month without a
+    partition go to transcripts_default and are moved into the month's
+    partition when it is created.
+    
+    Args:
+        months_ahead (int): Number of future months to create partitions for
+        
+    Returns:
+        int: Number of partitions created, or None if error
+    """
+    try:
+        with connection() as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute("SELECT ensure_transcript_partitions(CURRENT_DATE, %s)", (months_ahead,))
+            created = cursor.fetchone()[0]
+            conn.commit()
+            
+            cursor.close()
+        
+        if created:
+            logger.info('transcripts.partitions_created', count=created)
+        return created
+        
+    except Exception as e:
+        logger.error('transcripts.partitions_failed', str(e))
+        return None
+
+@timed_query
+def drop_old_transcript_partitions(retention_months, dedup_retention_days=30, batch_size=10000):
+    """
+    Drop transcripts partitions older than the retention period
+    
+    Each expired month is detached and dropped, which is O(1) no matter how
+    many rows it holds. Expired rows left in transcripts_default (months that
+    never got a partition) are deleted in batches. Segment ids older than
+    dedup_retention_days are also
+    pruned from transcript_segment_ids (a narrow table, deleted in batches);
+    Omi only re-sends recent segments, so old ids are not needed for dedup.
+    
+    Args:
+        retention_months (int): Number of whole months to keep besides the current one
+        dedup_retention_days (int): Days of segment ids to keep for dedup
+        batch_size (int): Maximum segment ids deleted per statement
+        
+    Returns:
+        list: Names of dropped partitions, or None if error
+    """
+    try:
+        with connection() as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute(
+                "SELECT (date_trunc('month', CURRENT_DATE) - make_interval(months => %s))::date",
+                (retention_months,)
+            )
+            cutoff = cursor.fetchone()[0]
+            
+            cursor.execute("""
+                SELECT c.relname
+                FROM pg_inherits i
+                JOIN pg_class c ON c.oid = i.inhrelid
+                WHERE i.inhparent = 'transcripts'::regclass
+                ORDER BY c.relname
+            """)
+            partitions = [r[0] for r in cursor.fetchall()]
+            
+            dropped = []
+            for name in partitions:
+                # Partition names are transcripts_pYYYY_MM (see ensure_transcript_partitions)
+                try:
+                    month = datetime.strptime(name, 'transcripts_p%Y_%m').date()
+                except ValueError:
+                    continue
+                if month >= cutoff:
+                    continue
+                
+                cursor.execute(sql.SQL("ALTER TABLE transcripts DETACH PARTITION {}").format(sql.Identifier(name)))
+                cursor.execute(sql.SQL("DROP TABLE {}").format(sql.Identifier(name)))
+                dropped.append(name)
+            
+            conn.commit()
+            
+            while True:
+                cursor.execute("""
+                    DELETE FROM transcripts_default
+                    WHERE ctid IN (
+                        SELECT ctid FROM transcripts_default
+                        WHERE received_at < %s
+                        LIMIT %s
+                    )
+                """, (cutoff, batch_size))
+                deleted = cursor.rowcount
+                conn.commit()
+                if deleted < batch_size:
+                    break
+            
+            while True:
+                cursor.execute("""
+                    DELETE FROM transcript_segment_ids
+                    WHERE segment_id IN (
+                        SELECT segment_id FROM transcript_segment_ids
+                        WHERE received_at < NOW() - make_interval(days => %s)
+                        LIMIT %s
+                    )
+                """, (dedup_retention_days, batch_size))
+                deleted = cursor.rowcount
+                conn.commit()
+                if deleted < batch_size:
+                    break
+            
+            cursor.close()
+        
+        if dropped:
+            logger.info('transcripts.partitions_dropped', partitions=','.join(dropped))
+        return dropped
+        
+    except Exception as e:
+        logger.error('transcripts.retention_failed', str(e))
+        return None
+
+@timed_query
+def get_transcript_queue_stats():
+    """
+    Get counts of transcripts by processing state
+    
+    Returns:
+        dict: pending, claimed, pending-activation and dead-lettered counts plus age of the oldest pending row
+    """
+    try:
+        with connection() as conn:
+            cursor = conn.cursor(cursor_factory=RealDictCursor)
+            
+            query = """
+                SELECT
+                    COUNT(*) FILTER (WHERE processed = FALSE
+                                     AND (lease_expires_at IS NULL OR lease_expires_at < NOW())) AS pending,
+                    COUNT(*) FILTER (WHERE processed = FALSE AND lease_expires_at >= NOW()) AS claimed,
+                    COUNT(*) FILTER (WHERE processed = FALSE AND activation) AS pending_activations,
+                    EXTRACT(EPOCH FROM NOW() - MIN(received_at) FILTER (WHERE processed = FALSE)) AS oldest_pending_age_seconds,
+                    (SELECT COUNT(*) FROM transcripts WHERE dead_lettered_at IS NOT NULL) AS dead_lettered
+                FROM transcripts
+                WHERE processed = FALSE
+            """
+            
+            cursor.execute(query)
+            stats = dict(cursor.fetchone())
+            
+            cursor.close()
+        
+        if stats['oldest_pending_age_seconds'] is not None:
+            stats['oldest_pending_age_seconds'] = float(stats['oldest_pending_age_seconds'])
+        return stats
+        
+    except Exception as e:
+        logger.error('transcripts.stats_failed', str(e))
+        return {}
+
+@timed_query
+def enqueue_sms(phone_number, message, source=None, trace_id=None, immediate=False):
+    """
+    Add a text to the SMS outbox
+    
+    Args:
+        phone_number (str): Recipient
+        message (str): The message to send
+        source (str, optional): Producer, e.g. 'response' or 'tool'
+        trace_id (str, optional): Trace of the batch that produced the text
+        immediate (bool): Claimable without waiting out the coalescing window
+        
+    Returns:
+        int: ID of the outbox row, or None if error
+    """
+    try:
+        with connection() as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute("""
+                INSERT INTO sms_outbox (phone_number, message, source, trace_id, immediate)
+                VALUES (%s, %s, %s, %s, %s)
+                RETURNING id
+            """, (phone_number, message, source, trace_id, immediate))
+            outbox_id = cursor.fetchone()[0]
+            
+            conn.commit()
+            cursor.close()
+        
+        return outbox_id
+        
+    except Exception as e:
+        logger.error('sms_outbox.enqueue_failed', str(e))
+        return None
+
+@timed_query
+def claim_sms_batches(worker_id, coalesce_window, lease_seconds, max_numbers=10):
+    """
+    Claim pending outbox texts, grouped by recipient
+    
+    A recipient's texts become claimable once its oldest pending text is at
+    least coalesce_window seconds old, so a burst of texts to the same number
+    is claimed (and can be sent) together. A pending immediate text (the
+    first part of a response) makes them claimable right away. A recipient
+    with a text in flight or waiting out a retry delay is skipped, which
+    keeps texts in order. Texts whose sender died mid-send (expired lease)
+    are put back to pending first. Safe to call from many processes or hosts.
+    
+    Args:
+        worker_id (str): Unique identifier of the claiming worker
+        coalesce_window (float): Seconds to let texts to the same number accumulate
+        lease_seconds (int): How long the claim is valid before another worker may take over
+        max_numbers (int): Maximum number of recipients to claim
+        
+    Returns:
+        OrderedDict: phone_number -> list of claimed outbox dicts (oldest first)
+    """
+    claimed = OrderedDict()
+    
+    try:
+        with connection() as conn:
+            cursor = conn.cursor(cursor_factory=RealDictCursor)
+            
+            cursor.execute("""
+                UPDATE sms_outbox
+                SET status = 'pending', claimed_by = NULL, lease_expires_at = NULL,
+                    last_error = COALESCE(last_error, 'lease expired')
+                WHERE status = 'sending' AND lease_expires_at < NOW()
+            """)
+            
+            cursor.execute("""
+                UPDATE sms_outbox o
+                SET status = 'sending', claimed_by = %s,
+                    lease_expires_at = NOW() + make_interval(secs => %s),
+                    attempts = o.attempts + 1
+                WHERE o.id IN (
+                    SELECT id FROM sms_outbox
+                    WHERE status = 'pending'
+                      AND next_attempt_at <= NOW()
+                      AND phone_number IN (
+                          SELECT phone_number FROM sms_outbox
+                          WHERE status IN ('pending', 'sending')
+                          GROUP BY phone_number
+                          HAVING BOOL_AND(status = 'pending')
+                             AND BOOL_AND(next_attempt_at <= NOW())
+                             AND (MIN(created_at) <= NOW() - make_interval(secs => %s) OR BOOL_OR(immediate))
+                          ORDER BY MIN(created_at)
+                          LIMIT %s
+                      )
+                    FOR UPDATE SKIP LOCKED
+                )
+                RETURNING o.*
+            """, (worker_id, lease_seconds, coalesce_window, max_numbers))
+            
+            rows = sorted((dict(r) for r in cursor.fetchall()), key=lambda r: r['id'])
+            for row in rows:
+                claimed.setdefault(row['phone_number'], []).append(row)
+            
+            conn.commit()
+            cursor.close()
+        
+        return claimed
+        
+    except Exception as e:
+        logger.error('sms_outbox.claim_failed', str(e))
+        return OrderedDict()
+
+@timed_query
+def extend_sms_lease(outbox_ids, worker_id, lease_seconds):
+    """
+    Renew the lease on claimed outbox texts before the next send
+    
+    Args:
+        outbox_ids (list): IDs of the claimed texts
+        worker_id (str): Worker that holds the claim
+        lease_seconds (float): New lease length, counted from now
+        
+    Returns:
+        int: Number of texts still leased to worker_id, or None if error
+    """
+    try:
+        with connection() as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute("""
+                UPDATE sms_outbox
+                SET lease_expires_at = NOW() + make_interval(secs => %s)
+                WHERE id = ANY(%s) AND claimed_by = %s AND status = 'sending'
+            """, (lease_seconds, outbox_ids, worker_id))
+            held = cursor.rowcount
+            conn.commit()
+            
+            cursor.close()
+        
+        return held
+        
+    except Exception as e:
+        logger.error('sms_outbox.extend_lease_failed', str(e))
+        return None
+
+@timed_query
+def get_recently_sent_sms(phone_number, trace_ids, within_seconds):
+    """
+    Find the texts already sent to a number for the given traces
+    
+    A retried batch keeps its trace, so this finds the texts an earlier
+    attempt already delivered.
+    
+    Args:
+        phone_number (str): Recipient
+        trace_ids (list): Traces to check
+        within_seconds (float): How far back to look
+        
+    Returns:
+        dict: (trace ID, message body) -> outbox ID it was sent as
+    """
+    try:
+        with connection() as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute("""
+                SELECT DISTINCT ON (trace_id, message) trace_id, message, id
+                FROM sms_outbox
+                WHERE phone_number = %s
+                  AND status IN ('sent', 'coalesced')
+                  AND sent_at >= NOW() - make_interval(secs => %s)
+                  AND trace_id = ANY(%s)
+                ORDER BY trace_id, message, sent_at DESC
+            """, (phone_number, within_seconds, trace_ids))
+            sent = {(row[0], row[1]): row[2] for row in cursor.fetchall()}
+            
+            cursor.close()
+        
+        return sent
+        
+    except Exception as e:
+        logger.error('sms_outbox.dedupe_failed', str(e))
+        return {}
+
+@timed_query
+def complete_sms(outbox_ids, worker_id, status, text_id=None, delivered_with=None, send_latency_ms=None):
+    """
+    Settle claimed outbox texts
+    
+    Args:
+        outbox_ids (list): IDs of the claimed texts
+        worker_id (str): Worker that holds the claim
+        status (str): 'sent', 'coalesced' or 'duplicate'
+        text_id (str, optional): Textbelt textId of the text that carried them
+        delivered_with (int, optional): Outbox ID of the text they were folded into
+        send_latency_ms (float, optional): Time the Textbelt call took
+        
+    Returns:
+        bool: True if successful, False otherwise
+    """
+    try:
+        with connection() as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute("""
+                UPDATE sms_outbox
+                SET status = %s, text_id = %s, delivered_with = %s, send_latency_ms = %s,
+                    sent_at = CASE WHEN %s = 'duplicate' THEN sent_at ELSE NOW() END,
+                    claimed_by = NULL, lease_expires_at = NULL, last_error = NULL
+                WHERE id = ANY(%s) AND claimed_by = %s
+            """, (status, text_id, delivered_with, send_latency_ms, status, outbox_ids, worker_id))
+            conn.commit()
+            
+            cursor.close()
+        
+        return True
+        
+    except Exception as e:
+        logger.error('sms_outbox.complete_failed', str(e))
+        return False
+
+@timed_query
+def release_sms(outbox_ids, worker_id, error, max_attempts, retry_base_delay, retry_max_delay):
+    """
+    Release claimed outbox texts after a failed send, scheduling a retry or failing them
+    
+    Same backoff as release_transcripts: retry_base_delay * 2^(attempts-1),
+    capped at retry_max_delay. Texts that used up max_attempts are marked failed.
+    
+    Args:
+        outbox_ids (list): IDs of the claimed texts
+        worker_id (str): Worker that holds the claim
+        error (str): Failure reason, stored in last_error
+        max_attempts (int): Send attempts allowed per text
+        retry_base_delay (float): Delay in seconds before the first retry
+        retry_max_delay (float): Upper bound on the retry delay in seconds
         
-        cursor.execute(query, (message_id, transcript_ids))
-        conn.commit()
+    Returns:
+        dict: {'retrying': count, 'failed': count}, or None if error
+    """
+    try:
+        with connection() as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute("""
+                UPDATE sms_outbox
+                SET claimed_by = NULL, lease_expires_at = NULL, last_error = %s,
+                    next_attempt_at = NOW() + make_interval(
+                        secs => LEAST(%s * POWER(2, GREATEST(attempts - 1, 0)), %s)
+                    ),
+                    status = CASE WHEN attempts >= %s THEN 'failed' ELSE 'pending' END
+                WHERE id = ANY(%s) AND claimed_by = %s
+                RETURNING status
+            """, (error, retry_base_delay, retry_max_delay, max_attempts, outbox_ids, worker_id))
+            statuses = [r[0] for r in cursor.fetchall()]
+            conn.commit()
+            
+            cursor.close()
         
-        rows_updated = cursor.rowcount
+        return {
+            'retrying': statuses.count('pending'),
+            'failed': statuses.count('failed'),
+        }
+        
+    except Exception as e:
+        logger.error('sms_outbox.release_failed', str(e))
+        return None
+
+@timed_query
+def attach_sms_to_message(outbox_ids, message_id):
+    """
+    Link outbox texts to the message they were sent for
+    
+    Delivery status keeps being updated on the outbox rows by the worker, so
+    it can be read back with the message (see get_messages_page).
+    
+    Args:
+        outbox_ids (list): IDs of the outbox texts
+        message_id (int): ID of the message
         
-        cursor.close()
-        conn.close()
+    Returns:
+        bool: True if successful, False otherwise
+    """
+    try:
+        with connection() as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute(
+                "UPDATE sms_outbox SET message_id = %s WHERE id = ANY(%s)",
+                (message_id, outbox_ids)
+            )
+            conn.commit()
+            
+            cursor.close()
         
-        print(f"Marked {rows_updated} transcripts as processed")
         return True
         
     except Exception as e:
-        print(f"ERROR marking transcripts as processed: {str(e)}")
+        logger.error('sms_outbox.attach_failed', str(e), message_id=message_id)
         return False
 
-def save_message(message_type, message_text, tool_executions=None):
+@timed_query
+def get_sms_outbox_stats():
+    """
+    Get counts of outbox texts by status
+    
+    Returns:
+        dict: Count per status plus age of the oldest pending text
+    """
+    try:
+        with connection() as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute("SELECT status, COUNT(*) FROM sms_outbox GROUP BY status")
+            stats = {status: count for status, count in cursor.fetchall()}
+            
+            cursor.execute("""
+                SELECT EXTRACT(EPOCH FROM NOW() - MIN(created_at))
+                FROM sms_outbox WHERE status = 'pending'
+            """)
+            oldest = cursor.fetchone()[0]
+            
+            cursor.close()
+        
+        stats['oldest_pending_age_seconds'] = float(oldest) if oldest is not None else None
+        return stats
+        
+    except Exception as e:
+        logger.error('sms_outbox.stats_failed', str(e))
+        return {}
+
+@timed_query
+def save_trace(trace_id, session_id, outcome, stages, elapsed_ms, message_id=None, model=None, usage=None,
+               web_searches=None, received_at=None):
+    """
+    Store one processed batch's trace
+    
+    Args:
+        trace_id (str): Trace ID (shared by retries of the same batch)
+        session_id (str): Omi session ID
+        outcome (str): Batch outcome, e.g. 'responded' or 'retry'
+        stages (dict): Stage name -> milliseconds
+        elapsed_ms (float): Processing time so far, used to derive started_at on the database clock
+        message_id (int, optional): ID of the AI message the batch produced
+        model (str, optional): Model that ran the agent
+        usage (dict, optional): input_tokens, output_tokens, total_tokens, requests
+        web_searches (int, optional): Web searches the agent ran
+        received_at (datetime, optional): When the activating segment arrived
+        
+    Returns:
+        int: ID of the traces row, or None if error
+    """
+    usage = usage or {}
+    try:
+        with connection() as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute("""
+                INSERT INTO traces (trace_id, session_id, message_id, outcome, model,
+                                    input_tokens, output_tokens, total_tokens, llm_requests, web_searches,
+                                    stages, received_at, started_at)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s::jsonb, %s,
+                        NOW() - make_interval(secs => %s))
+                RETURNING id
+            """, (
+                trace_id, session_id, message_id, outcome, model,
+                usage.get('input_tokens'), usage.get('output_tokens'),
+                usage.get('total_tokens'), usage.get('requests'), web_searches,
+                json.dumps(stages), received_at, elapsed_ms / 1000
+            ))
+            row_id = cursor.fetchone()[0]
+            
+            conn.commit()
+            cursor.close()
+        
+        return row_id
+        
+    except Exception as e:
+        logger.error('traces.save_failed', str(e))
+        return None
+
+# Stage timings over a window: the in-process stages stored with each trace,
+# plus SMS delivery stages derived from the trace's outbox rows
+TRACE_STAGE_TIMES_QUERY = """
+    WITH recent AS (
+        SELECT trace_id, stages, received_at, started_at
+        FROM traces
+        WHERE created_at >= NOW() - make_interval(secs => %(window)s)
+    ), texts AS (
+        SELECT o.trace_id, o.created_at, o.sent_at, o.send_latency_ms, o.status
+        FROM sms_outbox o
+        WHERE o.trace_id IN (SELECT trace_id FROM recent)
+          AND o.sent_at IS NOT NULL
+          AND o.status IN ('sent', 'coalesced')
+    ), stage_times (stage, ms) AS (
+        SELECT s.key, s.value::float
+        FROM recent, jsonb_each_text(recent.stages) s
+        UNION ALL
+        -- Activating segment received -> processor picked the batch up (includes retry backoff)
+        SELECT 'queue_wait', EXTRACT(EPOCH FROM started_at - received_at) * 1000
+        FROM recent WHERE received_at IS NOT NULL
+        UNION ALL
+        -- Queued until handed to Textbelt: coalescing window, worker wake-up, retries
+        SELECT 'sms_delivery', EXTRACT(EPOCH FROM sent_at - created_at) * 1000 FROM texts
+        UNION ALL
+        SELECT 'sms_send', send_latency_ms FROM texts WHERE status = 'sent' AND send_latency_ms IS NOT NULL
+        UNION ALL
+        -- Activating segment received -> first text of the batch sent
+        SELECT 'activation_to_sms', EXTRACT(EPOCH FROM MIN(t.sent_at) - MIN(r.received_at)) * 1000
+        FROM texts t JOIN recent r ON r.trace_id = t.trace_id
+        GROUP BY t.trace_id
+        HAVING MIN(r.received_at) IS NOT NULL
+    )
+    SELECT stage, COUNT(*) AS count,
+           percentile_cont(ARRAY[0.5, 0.95, 0.99]) WITHIN GROUP (ORDER BY ms) AS percentiles
+    FROM stage_times
+    WHERE ms IS NOT NULL
+    GROUP BY stage
+    ORDER BY stage
+"""
+
+@timed_query
+def get_trace_stage_percentiles(window_seconds):
+    """
+    Get p50/p95/p99 per stage for traces recorded within a time window
+    
+    Args:
+        window_seconds (int): How far back to look
+        
+    Returns:
+        dict: {'traces', 'stages': {stage: {count, p50_ms, p95_ms, p99_ms}},
+               'models': {model: {traces, input_tokens, output_tokens, total_tokens}}}, or None if error
+    """
+    try:
+        with connection() as conn:
+            cursor = conn.cursor(cursor_factory=RealDictCursor)
+            
+            cursor.execute(TRACE_STAGE_TIMES_QUERY, {'window': window_seconds})
+            stages = {
+                row['stage']: {
+                    'count': row['count'],
+                    'p50_ms': round(row['percentiles'][0], 2),
+                    'p95_ms': round(row['percentiles'][1], 2),
+                    'p99_ms': round(row['percentiles'][2], 2),
+                }
+                for row in cursor.fetchall()
+            }
+            
+            cursor.execute("""
+                SELECT COALESCE(model, 'unknown') AS model, COUNT(*) AS traces,
+                       COALESCE(SUM(input_tokens), 0) AS input_tokens,
+                       COALESCE(SUM(output_tokens), 0) AS output_tokens,
+                       COALESCE(SUM(total_tokens), 0) AS total_tokens
+                FROM traces
+                WHERE created_at >= NOW() - make_interval(secs => %s)
+                GROUP BY 1
+            """, (window_seconds,))
+            models = {row['model']: {k: v for k, v in row.items() if k != 'model'} for row in cursor.fetchall()}
+            
+            cursor.close()
+        
+        return {
+            'traces': sum(m['traces'] for m in models.values()),
+            'stages': stages,
+            'models': models,
+        }
+        
+    except Exception as e:
+        logger.error('traces.stats_failed', str(e))
+        return None
+
+@timed_query
+def get_trace(trace_id):
+    """
+    Get every recorded attempt of a trace and the texts it produced
+    
+    Args:
+        trace_id (str): Trace ID
+        
+    Returns:
+        dict: {'attempts': [traces rows], 'texts': [sms_outbox rows]}, or None if error
+    """
+    try:
+        with connection() as conn:
+            cursor = conn.cursor(cursor_factory=RealDictCursor)
+            
+            cursor.execute("SELECT * FROM traces WHERE trace_id = %s ORDER BY id", (trace_id,))
+            attempts = [dict(row) for row in cursor.fetchall()]
+            
+            cursor.execute("""
+                SELECT id, source, status, attempts, created_at, sent_at, send_latency_ms,
+                       text_id, delivered_with, message_id, last_error
+                FROM sms_outbox
+                WHERE trace_id = %s
+                ORDER BY id
+            """, (trace_id,))
+            texts = [dict(row) for row in cursor.fetchall()]
+            
+            cursor.close()
+        
+        return {'attempts': attempts, 'texts': texts}
+        
+    except Exception as e:
+        logger.error('traces.fetch_failed', str(e))
+        return None
+
+@timed_query
+def save_message(message_type, message_text, tool_executions=None, session_id=None):
     """
     Save a message (user or AI) to the database
     
@@ -159,40 +1458,41 @@ def save_message(message_type, message_text, tool_executions=None):
         message_type (str): 'user' or 'ai'
         message_text (str): The message content
         tool_executions (list, optional): List of tool names that were executed (not used with Agents SDK)
+        session_id (str, optional): Omi session ID the message belongs to
         
     Returns:
         int: ID of saved message, or None if error
     """
     try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        
-        # Note: tool_executions is kept for backwards compatibility but not used with Agents SDK
-        # The SDK handles tool execution internally
-        tool_executions_str = None
-        if tool_executions and len(tool_executions) > 0:
-            tool_executions_str = ','.join(tool_executions)
-        
-        query = """
-            INSERT INTO messages (message_type, message_text, tool_executions)
-            VALUES (%s, %s, %s)
-            RETURNING id
-        """
-        
-        cursor.execute(query, (message_type, message_text, tool_executions_str))
-        message_id = cursor.fetchone()[0]
+        with connection() as conn:
+            cursor = conn.cursor()
+            
+            # Note: tool_executions is kept for backwards compatibility but not used with Agents SDK
+            # The SDK handles tool execution internally
+            tool_executions_str = None
+            if tool_executions and len(tool_executions) > 0:
+                tool_executions_str = ','.join(tool_executions)
+            
+            query = """
+                INSERT INTO messages (message_type, message_text, tool_executions, session_id)
+                VALUES (%s, %s, %s, %s)
+                RETURNING id
+            """
+            
+            cursor.execute(query, (message_type, message_text, tool_executions_str, session_id))
+            message_id = cursor.fetchone()[0]
+            
+            conn.commit()
+            cursor.close()
         
-        conn.commit()
-        cursor.close()
-        conn.close()
-        
-        print(f"Saved {message_type} message (ID: {message_id})")
+        logger.debug('messages.saved', message_type=message_type, message_id=message_id)
         return message_id
         
     except Exception as e:
-        print(f"ERROR saving message: {str(e)}")
+        logger.error('messages.save_failed', str(e))
         return None
 
+@timed_query
 def get_conversation_history(limit=10):
     """
     Get recent conversation history
@@ -204,29 +1504,29 @@ def get_conversation_history(limit=10):
         list: List of message dictionaries, ordered by timestamp (oldest first)
     """
     try:
-        conn = get_connection()
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
-        
-        query = """
-            SELECT message_type, message_text, timestamp
-            FROM messages
-            ORDER BY timestamp DESC
-            LIMIT %s
-        """
-        
-        cursor.execute(query, (limit,))
-        messages = cursor.fetchall()
-        
-        cursor.close()
-        conn.close()
+        with connection() as conn:
+            cursor = conn.cursor(cursor_factory=RealDictCursor)
+            
+            query = """
+                SELECT message_type, message_text, timestamp
+                FROM messages
+                ORDER BY timestamp DESC
+                LIMIT %s
+            """
+            
+            cursor.execute(query, (limit,))
+            messages = cursor.fetchall()
+            
+            cursor.close()
         
         # Return in chronological order (oldest first)
         return [dict(m) for m in reversed(messages)]
         
     except Exception as e:
-        print(f"ERROR getting conversation history: {str(e)}")
+        logger.error('messages.fetch_failed', str(e))
         return []
 
+@timed_query
 def get_all_messages():
     """
     Get all messages for debugging/viewing
@@ -235,19 +1535,256 @@ def get_all_messages():
         list: List of all message dictionaries
     """
     try:
-        conn = get_connection()
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
-        
-        query = "SELECT * FROM messages ORDER BY timestamp ASC"
-        cursor.execute(query)
-        messages = cursor.fetchall()
-        
-        cursor.close()
-        conn.close()
+        with connection() as conn:
+            cursor = conn.cursor(cursor_factory=RealDictCursor)
+            
+            query = "SELECT * FROM messages ORDER BY timestamp ASC"
+            cursor.execute(query)
+            messages = cursor.fetchall()
+            
+            cursor.close()
         
         return [dict(m) for m in messages]
         
     except Exception as e:
-        print(f"ERROR getting all messages: {str(e)}")
+        logger.error('messages.fetch_failed', str(e))
         return []
 
+# Delivery status of the texts sent for a message (m), attached to paged and streamed messages
+MESSAGE_TEXTS_COLUMN = """
+    (SELECT json_agg(json_build_object(
+                'outbox_id', o.id, 'source', o.source, 'status', o.status,
+                'text_id', o.text_id, 'sent_at', o.sent_at
+            ) ORDER BY o.id)
+     FROM sms_outbox o
+     WHERE o.message_id = m.id) AS texts
+"""
+
+def _message_filters(before=None, after=None, session_id=None):
+    """Build the WHERE clause shared by the paginated and streaming message queries"""
+    conditions = []
+    params = []
+    
+    if session_id is not None:
+        conditions.append("session_id = %s")
+        params.append(session_id)
+    if before is not None:
+        conditions.append("(timestamp, id) < (%s, %s)")
+        params.extend(before)
+    if after is not None:
+        conditions.append("(timestamp, id) > (%s, %s)")
+        params.extend(after)
+    
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    return where, params
+
+@timed_query
+def get_messages_page(limit=100, before=None, after=None, session_id=None):
+    """
+    Get one page of messages using keyset pagination on (timestamp, id)
+    
+    Args:
+        limit (int): Maximum number of messages to return
+        before (tuple, optional): (timestamp, id) cursor; only return messages before it
+        after (tuple, optional): (timestamp, id) cursor; only return messages after it
+        session_id (str, optional): Only return messages from this Omi session
+        
+    Returns:
+        list: Message dictionaries in chronological order (oldest first), each with
+              the delivery status of the texts sent for it, or None if error
+    """
+    try:
+        with connection() as conn:
+            cursor = conn.cursor(cursor_factory=RealDictCursor)
+            
+            where, params = _message_filters(before, after, session_id)
+            
+            # Paging backwards reads newest-first from the cursor, then flips the page
+            descending = before is not None and after is None
+            order = "DESC" if descending else "ASC"
+            
+            query = f"""
+                SELECT m.*, {MESSAGE_TEXTS_COLUMN}
+                FROM messages m
+                {where}
+                ORDER BY timestamp {order}, id {order}
+                LIMIT %s
+            """
+            
+            cursor.execute(query, params + [limit])
+            messages = [dict(m) for m in cursor.fetchall()]
+            
+            cursor.close()
+        
+        if descending:
+            messages.reverse()
+        return messages
+        
+    except Exception as e:
+        logger.error('messages.fetch_failed', str(e))
+        return None
+
+def iter_messages(before=None, after=None, session_id=None, limit=None, batch_size=500):
+    """
+    Stream messages in chronological order through a server-side cursor
+    
+    Rows are fetched batch_size at a time from a named cursor, so memory stays
+    flat no matter how much history exists. The pooled connection is held
+    until the generator is exhausted or closed. Ordering, the limit applied
+    next to a before cursor and the 'texts' field match get_messages_page.
+    
+    Args:
+        before (tuple, optional): (timestamp, id) cursor; only return messages before it
+        after (tuple, optional): (timestamp, id) cursor; only return messages after it
+        session_id (str, optional): Only return messages from this Omi session
+        limit (int, optional): Maximum number of messages to return
+        batch_size (int): Rows fetched per round trip
+        
+    Yields:
+        dict: One message at a time
+    """
+    with connection() as conn:
+        cursor = conn.cursor(name=f"messages_stream_{uuid.uuid4().hex}", cursor_factory=RealDictCursor)
+        cursor.itersize = batch_size
+        
+        where, params = _message_filters(before, after, session_id)
+        
+        # With a limit, paging backwards takes the messages just before the cursor
+        descending = before is not None and after is None and limit is not None
+        order = "DESC" if descending else "ASC"
+        
+        query = f"SELECT m.*, {MESSAGE_TEXTS_COLUMN} FROM messages m {where} ORDER BY timestamp {order}, id {order}"
+        if limit is not None:
+            query += " LIMIT %s"
+            params.append(limit)
+        if descending:
+            query = f"SELECT * FROM ({query}) page ORDER BY timestamp ASC, id ASC"
+        
+        try:
+            cursor.execute(query, params)
+            for message in cursor:
+                yield dict(message)
+        finally:
+            cursor.close()
+
+@timed_query
+def get_session_mapping(omi_session_id):
+    """
+    Get the OpenAI conversation ID stored for an Omi session
+    
+    Args:
+        omi_session_id (str): Session ID from Omi device
+        
+    Returns:
+        str: OpenAI conversation ID, or None if not found or error
+    """
+    try:
+        with connection() as conn:
+            cursor = conn.cursor()
+            
+            query = "SELECT openai_conversation_id FROM sessions WHERE omi_session_id = %s"
+            cursor.execute(query, (omi_session_id,))
+            result = cursor.fetchone()
+            
+            cursor.close()
+        
+        return result[0] if result else None
+        
+    except Exception as e:
+        logger.error('sessions.lookup_failed', str(e), omi_session_id=omi_session_id)
+        return None
+
+@timed_query
+def save_session_mapping(omi_session_id, openai_conversation_id):
+    """
+    Save or update an Omi session -> OpenAI conversation mapping
+    
+    Args:
+        omi_session_id (str): Session ID from Omi device
+        openai_conversation_id (str): OpenAI conversation ID
+        
+    Returns:
+        bool: True if successful, False otherwise
+    """
+    try:
+        with connection() as conn:
+            cursor = conn.cursor()
+            
+            query = """
+                INSERT INTO sessions (omi_session_id, openai_conversation_id, last_used_at)
+                VALUES (%s, %s, CURRENT_TIMESTAMP)
+                ON CONFLICT (omi_session_id) 
+                DO UPDATE SET openai_conversation_id = EXCLUDED.openai_conversation_id,
+                              last_used_at = CURRENT_TIMESTAMP
+            """
+            
+            cursor.execute(query, (omi_session_id, openai_conversation_id))
+            conn.commit()
+            
+            cursor.close()
+        
+        return True
+        
+    except Exception as e:
+        logger.error('sessions.save_failed', str(e), omi_session_id=omi_session_id)
+        return False
+
+@timed_query
+def touch_sessions(touches):
+    """
+    Move sessions' last_used_at forward in one batched UPDATE
+    
+    Args:
+        touches (list): (omi_session_id, last used datetime) pairs
+        
+    Returns:
+        int: Number of touches written, or None if error
+    """
+    try:
+        with connection() as conn:
+            cursor = conn.cursor()
+            
+            execute_values(
+                cursor,
+                """
+                UPDATE sessions AS s
+                SET last_used_at = v.last_used_at
+                FROM (VALUES %s) AS v(omi_session_id, last_used_at)
+                WHERE s.omi_session_id = v.omi_session_id
+                  AND s.last_used_at < v.last_used_at
+                """,
+                touches,
+                template="(%s, %s::timestamp)"
+            )
+            conn.commit()
+            
+            cursor.close()
+        
+        return len(touches)
+        
+    except Exception as e:
+        logger.error('sessions.touch_flush_failed', str(e), pending=len(touches))
+        return None
+
+@timed_query
+def get_session_count():
+    """
+    Get total number of tracked conversations
+    
+    Returns:
+        int: Number of Omi sessions tracked, or 0 if error
+    """
+    try:
+        with connection() as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute("SELECT COUNT(*) FROM sessions")
+            count = cursor.fetchone()[0]
+            
+            cursor.close()
+        
+        return count
+        
+    except Exception as e:
+        logger.error('sessions.count_failed', str(e))
+        return 0
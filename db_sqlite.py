@@ -0,0 +1,1598 @@
+"""
+Embedded SQLite storage backend (sqlite:/// DATABASE_URLs)
+
+For single-device deployments: the database is a local file, so every
+segment insert, claim and status update is a function call instead of a
+network round trip to Postgres. Implements the operations listed in
+storage.OPERATIONS with the same signatures and return values as db.py.
+
+The database runs in WAL mode, so readers (the webhook's stats, /conversation)
+never block on the writer and commits only append to the log. Writes take
+the database write lock up front (BEGIN IMMEDIATE), which is what serializes
+claimers here instead of Postgres' row locks and SKIP LOCKED; busy_timeout
+makes a contending writer wait rather than fail.
+
+LISTEN/NOTIFY is replaced by an in-process wakeup, so notify mode works for
+the processor in the same process as the webhook; other processes sharing
+the file fall back to the processor's periodic poll.
+"""
+
+import os
+import json
+import time
+import atexit
+import sqlite3
+import threading
+from collections import deque, defaultdict, OrderedDict
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from urllib.parse import urlparse
+from dotenv import load_dotenv
+import log
+from storage import timed_query, segment_rows
+
+load_dotenv()
+
+logger = log.get_logger('db')
+
+# Connection pool configuration (shared with db.py)
+POOL_MAX_SIZE = int(os.getenv('DB_POOL_MAX_SIZE', '10'))
+POOL_CHECKOUT_TIMEOUT = float(os.getenv('DB_POOL_CHECKOUT_TIMEOUT', '10'))  # seconds
+
+# SQLite tuning
+SQLITE_SYNCHRONOUS = os.getenv('SQLITE_SYNCHRONOUS', 'NORMAL').upper()  # NORMAL: WAL commits survive app crashes, not power loss
+SQLITE_BUSY_TIMEOUT = int(os.getenv('SQLITE_BUSY_TIMEOUT', '5000'))  # ms a writer waits for the write lock
+SQLITE_CACHE_SIZE_MB = int(os.getenv('SQLITE_CACHE_SIZE_MB', '32'))  # page cache per connection
+SQLITE_MMAP_SIZE_MB = int(os.getenv('SQLITE_MMAP_SIZE_MB', '256'))  # memory-mapped reads, 0 disables
+
+# Name kept for parity with db.py; wakeups are in-process (see listen)
+NOTIFY_CHANNEL = 'new_transcripts'
+
+# Rows per multi-row INSERT, well under SQLite's bound-parameter limit
+SEGMENTS_PER_STATEMENT = 500
+
+# Timestamps are stored as ISO-8601 text with microseconds, so they sort and
+# compare correctly as strings; declared column types convert them back
+sqlite3.register_adapter(datetime, lambda value: value.isoformat(' ', 'microseconds'))
+sqlite3.register_converter('TIMESTAMP', lambda value: datetime.fromisoformat(value.decode()))
+sqlite3.register_converter('BOOLEAN', lambda value: bool(int(value)))
+sqlite3.register_converter('JSON', lambda value: json.loads(value))
+
+def database_path(url=None):
+    """
+    Get the database file path from a sqlite:/// URL
+
+    sqlite:///data/jarvis.db is relative to the working directory,
+    sqlite:////var/lib/jarvis/jarvis.db is absolute.
+
+    Args:
+        url (str, optional): Database URL (default: DATABASE_URL)
+
+    Returns:
+        str: File path
+
+    Raises:
+        ValueError: If the URL is not a sqlite:/// URL with a path
+    """
+    url = url or os.getenv('DATABASE_URL', '')
+    parsed = urlparse(url)
+    path = parsed.path[1:] if parsed.path.startswith('/') else parsed.path
+    if parsed.scheme != 'sqlite' or parsed.netloc or not path:
+        raise ValueError(f"Expected a sqlite:///path URL, got '{url}'")
+    return path
+
+def get_connection():
+    """Get a new, unpooled database connection with the tuned pragmas applied"""
+    path = database_path()
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    # isolation_level=None: autocommit unless a transaction is opened explicitly
+    conn = sqlite3.connect(
+        path, timeout=SQLITE_BUSY_TIMEOUT / 1000, isolation_level=None, check_same_thread=False,
+        detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES
+    )
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute(f"PRAGMA synchronous = {SQLITE_SYNCHRONOUS}")
+    conn.execute(f"PRAGMA busy_timeout = {SQLITE_BUSY_TIMEOUT}")
+    conn.execute("PRAGMA foreign_keys = ON")
+    conn.execute("PRAGMA temp_store = MEMORY")
+    conn.execute(f"PRAGMA cache_size = {-SQLITE_CACHE_SIZE_MB * 1024}")
+    conn.execute(f"PRAGMA mmap_size = {SQLITE_MMAP_SIZE_MB * 1024 * 1024}")
+    return conn
+
+class PoolTimeout(Exception):
+    """Raised when no pooled connection becomes available in time"""
+
+class ConnectionPool:
+    """
+    Thread-safe pool of SQLite connections
+
+    Connections are opened on demand up to max_size and each is used by one
+    thread at a time. Under WAL any number of them can read concurrently;
+    writes are serialized by SQLite's own write lock.
+    """
+
+    def __init__(self, max_size=POOL_MAX_SIZE, checkout_timeout=POOL_CHECKOUT_TIMEOUT):
+        self.max_size = max(1, max_size)
+        self.checkout_timeout = checkout_timeout
+
+        self._cond = threading.Condition()
+        self._idle = deque()
+        self._in_use = 0
+        self._closed = False
+
+        # Stats
+        self._checkouts = 0
+        self._waits = 0
+        self._wait_time_total = 0.0
+        self._wait_time_max = 0.0
+        self._timeouts = 0
+        self._created = 0
+        self._discarded = 0
+
+    def getconn(self):
+        """
+        Check out a connection, waiting up to checkout_timeout if the pool is exhausted
+
+        Returns:
+            sqlite3.Connection: A configured connection
+        """
+        start = time.monotonic()
+        deadline = start + self.checkout_timeout
+        waited = False
+
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise PoolTimeout("Connection pool is closed")
+                if self._idle:
+                    conn = self._idle.pop()
+                    break
+                if self._in_use < self.max_size:
+                    conn = None
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._timeouts += 1
+                    raise PoolTimeout(
+                        f"No database connection available after {self.checkout_timeout}s"
+                    )
+                waited = True
+                self._cond.wait(remaining)
+            self._in_use += 1
+
+        if conn is None:
+            try:
+                conn = get_connection()
+            except Exception:
+                with self._cond:
+                    self._in_use -= 1
+                    self._cond.notify()
+                raise
+            with self._cond:
+                self._created += 1
+
+        wait_time = time.monotonic() - start
+        with self._cond:
+            self._checkouts += 1
+            if waited:
+                self._waits += 1
+            self._wait_time_total += wait_time
+            self._wait_time_max = max(self._wait_time_max, wait_time)
+        return conn
+
+    def putconn(self, conn, discard=False):
+        """
+        Return a connection to the pool
+
+        Args:
+            conn: Connection previously returned by getconn()
+            discard (bool): Close the connection instead of reusing it
+        """
+        if not discard and conn.in_transaction:
+            try:
+                # Never hand out a connection with an open transaction
+                conn.rollback()
+            except sqlite3.Error:
+                discard = True
+
+        with self._cond:
+            self._in_use -= 1
+            if discard or self._closed:
+                self._discarded += 1
+                conn.close()
+            else:
+                self._idle.append(conn)
+            self._cond.notify()
+
+    def closeall(self):
+        """Close all idle connections and refuse further checkouts"""
+        with self._cond:
+            self._closed = True
+            while self._idle:
+                self._discarded += 1
+                self._idle.pop().close()
+            self._cond.notify_all()
+
+    def stats(self):
+        """
+        Get pool statistics
+
+        Returns:
+            dict: Pool size, usage and checkout wait times
+        """
+        with self._cond:
+            return {
+                'max_size': self.max_size,
+                'in_use': self._in_use,
+                'idle': len(self._idle),
+                'checkouts': self._checkouts,
+                'waits': self._waits,
+                'timeouts': self._timeouts,
+                'wait_time_total_ms': round(self._wait_time_total * 1000, 2),
+                'wait_time_avg_ms': round(self._wait_time_total * 1000 / self._checkouts, 3) if self._checkouts else 0.0,
+                'wait_time_max_ms': round(self._wait_time_max * 1000, 2),
+                'connections_created': self._created,
+                'connections_discarded': self._discarded,
+            }
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    """Get the shared connection pool, creating it on first use"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool()
+    return _pool
+
+@contextmanager
+def connection():
+    """
+    Check out a pooled connection for the duration of a with-block
+
+    An open transaction is rolled back when the block exits.
+    """
+    pool = get_pool()
+    conn = pool.getconn()
+    discard = False
+    try:
+        yield conn
+    except (sqlite3.InterfaceError, sqlite3.ProgrammingError):
+        discard = True
+        raise
+    finally:
+        pool.putconn(conn, discard=discard)
+
+def get_pool_stats():
+    """
+    Get connection pool statistics
+
+    Returns:
+        dict: Pool stats, or an empty dict if the pool hasn't been created yet
+    """
+    if _pool is None:
+        return {}
+    return _pool.stats()
+
+def _close_pool():
+    """Let SQLite refresh its query planner statistics, then close the pool"""
+    if _pool is None:
+        return
+    try:
+        with connection() as conn:
+            conn.execute("PRAGMA optimize")
+    except Exception:
+        pass
+    _pool.closeall()
+
+atexit.register(_close_pool)
+
+# In-process stand-in for LISTEN/NOTIFY: a counter bumped by inserts with an activation
+_notify_cond = threading.Condition()
+_notify_seq = 0
+
+class Listener:
+    """Subscription returned by listen(); has the closed / close() surface of a LISTEN connection"""
+
+    def __init__(self, channel):
+        self.channel = channel
+        self.closed = False
+        self.seen = _notify_seq
+
+    def close(self):
+        self.closed = True
+
+def _notify():
+    """Wake every listener in this process"""
+    global _notify_seq
+    with _notify_cond:
+        _notify_seq += 1
+        _notify_cond.notify_all()
+
+def listen(channel=NOTIFY_CHANNEL):
+    """
+    Subscribe to new-activation wakeups from inserts in this process
+
+    Args:
+        channel (str): Channel name, for parity with db.listen
+
+    Returns:
+        Listener: Subscription to pass to wait_for_notify()
+    """
+    return Listener(channel)
+
+def wait_for_notify(conn, timeout):
+    """
+    Block until an insert in this process signals new activations
+
+    Args:
+        conn (Listener): Subscription returned by listen()
+        timeout (float): Maximum seconds to wait
+
+    Returns:
+        list: One empty payload if signalled (any number of signals coalesce), empty on timeout
+    """
+    with _notify_cond:
+        if _notify_seq == conn.seen:
+            _notify_cond.wait(timeout)
+        if _notify_seq == conn.seen:
+            return []
+        conn.seen = _notify_seq
+    return ['']
+
+def _id_list(ids):
+    """Bind a list of IDs as one parameter, used as IN (SELECT value FROM json_each(?))"""
+    return json.dumps(list(ids))
+
+def _retry_at(now, attempts, retry_base_delay, retry_max_delay):
+    """Next attempt time: retry_base_delay * 2^(attempts-1), capped at retry_max_delay"""
+    delay = min(retry_base_delay * 2 ** max(attempts - 1, 0), retry_max_delay)
+    return now + timedelta(seconds=delay)
+
+def init_db():
+    """Initialize database tables from schema_sqlite.sql"""
+    try:
+        with connection() as conn:
+            with open('schema_sqlite.sql', 'r') as f:
+                schema = f.read()
+
+            conn.executescript(schema)
+
+        logger.info('db.initialized', backend='sqlite', path=database_path())
+        return True
+    except Exception as e:
+        logger.error('db.init_failed', str(e))
+        return False
+
+INSERT_SEGMENT_COLUMNS = (
+    "segment_id, text, speaker, speaker_id, is_user, start_time, end_time, session_id, activation, trace_id, received_at"
+)
+
+@timed_query
+def save_transcript_segment(segment_data):
+    """
+    Save a transcript segment to the database
+
+    Args:
+        segment_data (dict): Segment data from Omi webhook
+
+    Returns:
+        int: ID of saved transcript, or None if error or duplicate
+    """
+    try:
+        rows = segment_rows([segment_data], segment_data.get('session_id'))
+        if not rows:
+            return None
+
+        with connection() as conn:
+            result = conn.execute(f"""
+                INSERT INTO transcripts ({INSERT_SEGMENT_COLUMNS})
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (segment_id) DO NOTHING
+                RETURNING id
+            """, rows[0] + (datetime.now(),)).fetchall()
+
+        transcript_id = result[0][0] if result else None
+
+        if transcript_id:
+            logger.debug('transcripts.saved', segment_id=segment_data.get('id'))
+            if rows[0][8]:
+                _notify()
+        else:
+            logger.debug('transcripts.duplicate', segment_id=segment_data.get('id'))
+
+        return transcript_id
+
+    except Exception as e:
+        logger.error('transcripts.save_failed', str(e))
+        return None
+
+@timed_query
+def save_transcript_segments(segments, session_id=None):
+    """
+    Save a whole webhook payload of transcript segments in one transaction
+
+    New segment ids are inserted with ON CONFLICT (segment_id) DO NOTHING in
+    multi-row statements, so the batch costs one commit regardless of its size.
+
+    Args:
+        segments (list): Segment dicts from Omi webhook (flagged with 'activation' at ingest)
+        session_id (str, optional): Session ID applied to segments that don't carry one
+
+    Returns:
+        dict: {'inserted': [segment ids], 'duplicates': [segment ids]}, or None if error
+    """
+    try:
+        rows = segment_rows(segments, session_id)
+
+        if not rows:
+            return {'inserted': [], 'duplicates': []}
+
+        received_at = datetime.now()
+        inserted = set()
+
+        with connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+
+            for start in range(0, len(rows), SEGMENTS_PER_STATEMENT):
+                chunk = rows[start:start + SEGMENTS_PER_STATEMENT]
+                values = ", ".join(["(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"] * len(chunk))
+                params = [value for row in chunk for value in row + (received_at,)]
+                cursor = conn.execute(f"""
+                    INSERT INTO transcripts ({INSERT_SEGMENT_COLUMNS})
+                    VALUES {values}
+                    ON CONFLICT (segment_id) DO NOTHING
+                    RETURNING segment_id
+                """, params)
+                inserted.update(r[0] for r in cursor.fetchall())
+
+            conn.commit()
+
+        result = {
+            'inserted': [r[0] for r in rows if r[0] in inserted],
+            'duplicates': [r[0] for r in rows if r[0] not in inserted],
+        }
+
+        logger.debug('transcripts.saved', inserted=len(result['inserted']), duplicates=len(result['duplicates']))
+
+        if any(r[8] for r in rows if r[0] in inserted):
+            _notify()
+
+        return result
+
+    except Exception as e:
+        logger.error('transcripts.save_failed', str(e))
+        return None
+
+@timed_query
+def get_unprocessed_transcripts():
+    """
+    Get all unprocessed transcripts
+
+    Returns:
+        list: List of unprocessed transcript dictionaries
+    """
+    try:
+        with connection() as conn:
+            transcripts = conn.execute("""
+                SELECT * FROM transcripts
+                WHERE processed = 0
+                ORDER BY received_at ASC
+            """).fetchall()
+
+        return [dict(t) for t in transcripts]
+
+    except Exception as e:
+        logger.error('transcripts.fetch_failed', str(e))
+        return []
+
+@timed_query
+def mark_transcripts_processed(transcript_ids, message_id):
+    """
+    Mark transcripts as processed and link them to a message
+
+    Args:
+        transcript_ids (list): List of transcript IDs to mark as processed
+        message_id (int): ID of the message these transcripts belong to
+
+    Returns:
+        bool: True if successful, False otherwise
+    """
+    try:
+        with connection() as conn:
+            cursor = conn.execute("""
+                UPDATE transcripts
+                SET processed = 1, message_id = ?
+                WHERE id IN (SELECT value FROM json_each(?))
+            """, (message_id, _id_list(transcript_ids)))
+            rows_updated = cursor.rowcount
+
+        logger.debug('transcripts.processed', count=rows_updated)
+        return True
+
+    except Exception as e:
+        logger.error('transcripts.mark_failed', str(e))
+        return False
+
+@timed_query
+def claim_transcript_batches(worker_id, max_sessions, lease_seconds, max_attempts):
+    """
+    Claim unprocessed transcripts for up to max_sessions sessions
+
+    Same rules as db.claim_transcript_batches: a session is claimable when it
+    has a pending activation and none of its unprocessed rows are leased or
+    waiting out a retry delay, and rows whose lease expired after max_attempts
+    claims are dead-lettered first. The whole claim runs under the database
+    write lock, so concurrent claimers (threads or processes) are serialized.
+
+    Args:
+        worker_id (str): Unique identifier of the claiming processor
+        max_sessions (int): Maximum number of sessions to claim
+        lease_seconds (int): How long the claim is valid before another processor may take over
+        max_attempts (int): Claims allowed per row before it is dead-lettered
+
+    Returns:
+        OrderedDict: session_id -> list of claimed transcript dicts (oldest first)
+    """
+    claimed = OrderedDict()
+    if max_sessions <= 0:
+        return claimed
+
+    try:
+        with connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            now = datetime.now()
+
+            # Dead-letter rows whose processor died on their final attempt
+            conn.execute("""
+                UPDATE transcripts
+                SET processed = 1, dead_lettered_at = :now,
+                    claimed_by = NULL, lease_expires_at = NULL,
+                    last_error = COALESCE(last_error, 'lease expired')
+                WHERE processed = 0
+                  AND lease_expires_at < :now
+                  AND attempts >= :max_attempts
+            """, {'now': now, 'max_attempts': max_attempts})
+
+            # Sessions with a pending activation and no live lease or pending retry, oldest first
+            candidates = [row['session_key'] for row in conn.execute("""
+                SELECT COALESCE(session_id, 'unknown') AS session_key,
+                       MIN(received_at) AS oldest
+                FROM transcripts
+                WHERE processed = 0
+                GROUP BY 1
+                HAVING MAX(activation) = 1
+                   AND COUNT(*) FILTER (WHERE lease_expires_at >= :now) = 0
+                   AND COUNT(*) FILTER (WHERE next_attempt_at > :now) = 0
+                ORDER BY oldest
+                LIMIT :limit
+            """, {'now': now, 'limit': max_sessions}).fetchall()]
+
+            for session_key in candidates:
+                rows = [dict(r) for r in conn.execute("""
+                    UPDATE transcripts
+                    SET claimed_by = :worker_id,
+                        lease_expires_at = :lease_expires_at,
+                        attempts = attempts + 1
+                    WHERE processed = 0
+                      AND COALESCE(session_id, 'unknown') = :session_key
+                      AND (next_attempt_at IS NULL OR next_attempt_at <= :now)
+                      AND (lease_expires_at IS NULL OR lease_expires_at < :now)
+                    RETURNING *
+                """, {
+                    'worker_id': worker_id, 'session_key': session_key, 'now': now,
+                    'lease_expires_at': now + timedelta(seconds=lease_seconds),
+                }).fetchall()]
+                if rows:
+                    rows.sort(key=lambda r: (r['received_at'], r['id']))
+                    claimed[session_key] = rows
+
+            conn.commit()
+
+        return claimed
+
+    except Exception as e:
+        logger.error('transcripts.claim_failed', str(e))
+        return OrderedDict()
+
+@timed_query
+def complete_transcripts(transcript_ids, worker_id, message_id=None):
+    """
+    Mark claimed transcripts as processed and release their lease
+
+    Only rows still leased to worker_id are updated, so a processor whose
+    lease expired can't overwrite the work of the one that took over.
+
+    Args:
+        transcript_ids (list): IDs of the claimed transcripts
+        worker_id (str): Processor that holds the claim
+        message_id (int, optional): ID of the message these transcripts belong to
+
+    Returns:
+        bool: True if successful, False otherwise
+    """
+    try:
+        with connection() as conn:
+            cursor = conn.execute("""
+                UPDATE transcripts
+                SET processed = 1, message_id = ?,
+                    claimed_by = NULL, lease_expires_at = NULL, last_error = NULL
+                WHERE id IN (SELECT value FROM json_each(?)) AND claimed_by = ?
+            """, (message_id, _id_list(transcript_ids), worker_id))
+            rows_updated = cursor.rowcount
+
+        if rows_updated < len(transcript_ids):
+            logger.warning('transcripts.lease_lost', count=len(transcript_ids) - rows_updated, worker_id=worker_id)
+        logger.debug('transcripts.processed', count=rows_updated)
+        return True
+
+    except Exception as e:
+        logger.error('transcripts.complete_failed', str(e))
+        return False
+
+@timed_query
+def release_transcripts(transcript_ids, worker_id, error, max_attempts, retry_base_delay, retry_max_delay):
+    """
+    Release claimed transcripts after a failure, scheduling a retry or dead-lettering them
+
+    Same backoff as db.release_transcripts (retry_base_delay * 2^(attempts-1),
+    capped at retry_max_delay); rows that used up max_attempts are dead-lettered.
+
+    Args:
+        transcript_ids (list): IDs of the claimed transcripts
+        worker_id (str): Processor that holds the claim
+        error (str): Failure reason, stored in last_error
+        max_attempts (int): Claims allowed per row before it is dead-lettered
+        retry_base_delay (float): Delay in seconds before the first retry
+        retry_max_delay (float): Upper bound on the retry delay in seconds
+
+    Returns:
+        dict: {'retrying': count, 'dead_lettered': count}, or None if error
+    """
+    try:
+        with connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            now = datetime.now()
+
+            rows = conn.execute("""
+                SELECT id, attempts FROM transcripts
+                WHERE id IN (SELECT value FROM json_each(?)) AND claimed_by = ?
+            """, (_id_list(transcript_ids), worker_id)).fetchall()
+
+            updates = []
+            for row in rows:
+                dead = row['attempts'] >= max_attempts
+                updates.append((
+                    error, _retry_at(now, row['attempts'], retry_base_delay, retry_max_delay),
+                    dead, now if dead else None, row['id']
+                ))
+
+            conn.executemany("""
+                UPDATE transcripts
+                SET claimed_by = NULL, lease_expires_at = NULL, last_error = ?,
+                    next_attempt_at = ?, processed = ?, dead_lettered_at = ?
+                WHERE id = ?
+            """, updates)
+            conn.commit()
+
+        dead_flags = [u[2] for u in updates]
+        result = {
+            'retrying': dead_flags.count(False),
+            'dead_lettered': dead_flags.count(True),
+        }
+        logger.info('transcripts.released', retrying=result['retrying'], dead_lettered=result['dead_lettered'])
+        return result
+
+    except Exception as e:
+        logger.error('transcripts.release_failed', str(e))
+        return None
+
+@timed_query
+def sweep_inactive_transcripts(grace_seconds, limit=5000):
+    """
+    Bulk-mark ambient transcripts that will never be sent to AI as processed
+
+    Rows without an activation are kept for grace_seconds so they can serve
+    as context if an activation arrives in the same session, then swept in a
+    single UPDATE. Sessions with a pending activation are left alone. The
+    swept rows are returned so the processor can fold them into the
+    session's rolling summary.
+
+    Args:
+        grace_seconds (int): Minimum age of a row before it is swept
+        limit (int): Maximum rows swept per call
+
+    Returns:
+        OrderedDict: session_id -> list of swept transcript dicts (oldest first),
+                     empty if error
+    """
+    swept = OrderedDict()
+
+    try:
+        now = datetime.now()
+        with connection() as conn:
+            rows = [dict(r) for r in conn.execute("""
+                UPDATE transcripts
+                SET processed = 1
+                WHERE id IN (
+                    SELECT s.id FROM transcripts s
+                    WHERE s.processed = 0
+                      AND s.activation = 0
+                      AND s.received_at < :cutoff
+                      AND (s.lease_expires_at IS NULL OR s.lease_expires_at < :now)
+                      AND NOT EXISTS (
+                          SELECT 1 FROM transcripts a
+                          WHERE a.processed = 0
+                            AND a.activation
+                            AND COALESCE(a.session_id, 'unknown') = COALESCE(s.session_id, 'unknown')
+                      )
+                    LIMIT :limit
+                )
+                RETURNING id, segment_id, text, speaker, start_time, end_time,
+                          COALESCE(session_id, 'unknown') AS session_key, received_at
+            """, {'cutoff': now - timedelta(seconds=grace_seconds), 'now': now, 'limit': limit}).fetchall()]
+
+        rows.sort(key=lambda r: (r['session_key'], r['received_at'], r['id']))
+        for row in rows:
+            swept.setdefault(row['session_key'], []).append(row)
+
+        if rows:
+            logger.info('transcripts.swept', count=len(rows), sessions=len(swept))
+        return swept
+
+    except Exception as e:
+        logger.error('transcripts.sweep_failed', str(e))
+        return OrderedDict()
+
+@timed_query
+def ensure_transcript_partitions(months_ahead=3):
+    """
+    No-op: the SQLite transcripts table is not partitioned
+
+    Args:
+        months_ahead (int): Ignored
+
+    Returns:
+        int: 0 partitions created
+    """
+    return 0
+
+@timed_query
+def drop_old_transcript_partitions(retention_months, dedup_retention_days=30, batch_size=10000):
+    """
+    Delete transcripts older than the retention period
+
+    Same cutoff as db.drop_old_transcript_partitions (whole months before the
+    current one), deleted batch_size rows per transaction so the webhook's
+    inserts aren't held up behind one long write. Segment ids live on the
+    transcripts rows here, so they go with them.
+
+    Args:
+        retention_months (int): Number of whole months to keep besides the current one
+        dedup_retention_days (int): Unused; kept for parity with db.py
+        batch_size (int): Maximum rows deleted per transaction
+
+    Returns:
+        list: Expired months, named like the Postgres partitions (transcripts_pYYYY_MM), or None if error
+    """
+    try:
+        today = datetime.now()
+        month_index = today.year * 12 + today.month - 1 - retention_months
+        cutoff = datetime(month_index // 12, month_index % 12 + 1, 1)
+
+        with connection() as conn:
+            dropped = [
+                f"transcripts_p{row[0]}" for row in conn.execute("""
+                    SELECT DISTINCT strftime('%Y_%m', received_at) FROM transcripts
+                    WHERE received_at < ? ORDER BY 1
+                """, (cutoff,)).fetchall()
+            ]
+
+            while dropped:
+                cursor = conn.execute("""
+                    DELETE FROM transcripts
+                    WHERE id IN (SELECT id FROM transcripts WHERE received_at < ? LIMIT ?)
+                """, (cutoff, batch_size))
+                if cursor.rowcount < batch_size:
+                    break
+
+        if dropped:
+            logger.info('transcripts.partitions_dropped', partitions=','.join(dropped))
+        return dropped
+
+    except Exception as e:
+        logger.error('transcripts.retention_failed', str(e))
+        return None
+
+@timed_query
+def get_transcript_queue_stats():
+    """
+    Get counts of transcripts by processing state
+
+    Returns:
+        dict: pending, claimed, pending-activation and dead-lettered counts plus age of the oldest pending row
+    """
+    try:
+        now = datetime.now()
+        with connection() as conn:
+            row = dict(conn.execute("""
+                SELECT
+                    COUNT(*) FILTER (WHERE lease_expires_at IS NULL OR lease_expires_at < :now) AS pending,
+                    COUNT(*) FILTER (WHERE lease_expires_at >= :now) AS claimed,
+                    COUNT(*) FILTER (WHERE activation) AS pending_activations,
+                    MIN(received_at) AS "oldest [TIMESTAMP]",
+                    (SELECT COUNT(*) FROM transcripts WHERE dead_lettered_at IS NOT NULL) AS dead_lettered
+                FROM transcripts
+                WHERE processed = 0
+            """, {'now': now}).fetchone())
+
+        oldest = row.pop('oldest')
+        row['oldest_pending_age_seconds'] = (now - oldest).total_seconds() if oldest is not None else None
+        return row
+
+    except Exception as e:
+        logger.error('transcripts.stats_failed', str(e))
+        return {}
+
+@timed_query
+def enqueue_sms(phone_number, message, source=None, trace_id=None, immediate=False):
+    """
+    Add a text to the SMS outbox
+
+    Args:
+        phone_number (str): Recipient
+        message (str): The message to send
+        source (str, optional): Producer, e.g. 'response' or 'tool'
+        trace_id (str, optional): Trace of the batch that produced the text
+        immediate (bool): Claimable without waiting out the coalescing window
+
+    Returns:
+        int: ID of the outbox row, or None if error
+    """
+    try:
+        now = datetime.now()
+        with connection() as conn:
+            outbox_id = conn.execute("""
+                INSERT INTO sms_outbox (phone_number, message, source, trace_id, immediate, next_attempt_at, created_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                RETURNING id
+            """, (phone_number, message, source, trace_id, int(immediate), now, now)).fetchall()[0][0]
+
+        return outbox_id
+
+    except Exception as e:
+        logger.error('sms_outbox.enqueue_failed', str(e))
+        return None
+
+@timed_query
+def claim_sms_batches(worker_id, coalesce_window, lease_seconds, max_numbers=10):
+    """
+    Claim pending outbox texts, grouped by recipient
+
+    Same rules as db.claim_sms_batches, run under the database write lock.
+
+    Args:
+        worker_id (str): Unique identifier of the claiming worker
+        coalesce_window (float): Seconds to let texts to the same number accumulate
+        lease_seconds (int): How long the claim is valid before another worker may take over
+        max_numbers (int): Maximum number of recipients to claim
+
+    Returns:
+        OrderedDict: phone_number -> list of claimed outbox dicts (oldest first)
+    """
+    claimed = OrderedDict()
+
+    try:
+        with connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            now = datetime.now()
+
+            conn.execute("""
+                UPDATE sms_outbox
+                SET status = 'pending', claimed_by = NULL, lease_expires_at = NULL,
+                    last_error = COALESCE(last_error, 'lease expired')
+                WHERE status = 'sending' AND lease_expires_at < ?
+            """, (now,))
+
+            rows = conn.execute("""
+                UPDATE sms_outbox
+                SET status = 'sending', claimed_by = :worker_id,
+                    lease_expires_at = :lease_expires_at,
+                    attempts = attempts + 1
+                WHERE status = 'pending'
+                  AND next_attempt_at <= :now
+                  AND phone_number IN (
+                      SELECT phone_number FROM sms_outbox
+                      WHERE status IN ('pending', 'sending')
+                      GROUP BY phone_number
+                      HAVING COUNT(*) FILTER (WHERE status <> 'pending') = 0
+                         AND COUNT(*) FILTER (WHERE next_attempt_at > :now) = 0
+                         AND (MIN(created_at) <= :coalesced_before OR MAX(immediate) = 1)
+                      ORDER BY MIN(created_at)
+                      LIMIT :max_numbers
+                  )
+                RETURNING *
+            """, {
+                'worker_id': worker_id, 'now': now, 'max_numbers': max_numbers,
+                'lease_expires_at': now + timedelta(seconds=lease_seconds),
+                'coalesced_before': now - timedelta(seconds=coalesce_window),
+            }).fetchall()
+
+            for row in sorted((dict(r) for r in rows), key=lambda r: r['id']):
+                claimed.setdefault(row['phone_number'], []).append(row)
+
+            conn.commit()
+
+        return claimed
+
+    except Exception as e:
+        logger.error('sms_outbox.claim_failed', str(e))
+        return OrderedDict()
+
+@timed_query
+def extend_sms_lease(outbox_ids, worker_id, lease_seconds):
+    """
+    Renew the lease on claimed outbox texts before the next send
+
+    Args:
+        outbox_ids (list): IDs of the claimed texts
+        worker_id (str): Worker that holds the claim
+        lease_seconds (float): New lease length, counted from now
+
+    Returns:
+        int: Number of texts still leased to worker_id, or None if error
+    """
+    try:
+        with connection() as conn:
+            cursor = conn.execute("""
+                UPDATE sms_outbox
+                SET lease_expires_at = :lease_expires_at
+                WHERE id IN (SELECT value FROM json_each(:ids)) AND claimed_by = :worker_id AND status = 'sending'
+            """, {
+                'lease_expires_at': datetime.now() + timedelta(seconds=lease_seconds),
+                'ids': _id_list(outbox_ids), 'worker_id': worker_id,
+            })
+
+        return cursor.rowcount
+
+    except Exception as e:
+        logger.error('sms_outbox.extend_lease_failed', str(e))
+        return None
+
+@timed_query
+def get_recently_sent_sms(phone_number, trace_ids, within_seconds):
+    """
+    Find the texts already sent to a number for the given traces
+
+    Args:
+        phone_number (str): Recipient
+        trace_ids (list): Traces to check
+        within_seconds (float): How far back to look
+
+    Returns:
+        dict: (trace ID, message body) -> outbox ID it was sent as
+    """
+    try:
+        with connection() as conn:
+            rows = conn.execute("""
+                SELECT trace_id, message, id
+                FROM sms_outbox
+                WHERE phone_number = ?
+                  AND status IN ('sent', 'coalesced')
+                  AND sent_at >= ?
+                  AND trace_id IN (SELECT value FROM json_each(?))
+                ORDER BY sent_at ASC
+            """, (phone_number, datetime.now() - timedelta(seconds=within_seconds), json.dumps(trace_ids))).fetchall()
+
+        # Oldest first, so the most recent send of each body wins
+        return {(row[0], row[1]): row[2] for row in rows}
+
+    except Exception as e:
+        logger.error('sms_outbox.dedupe_failed', str(e))
+        return {}
+
+@timed_query
+def complete_sms(outbox_ids, worker_id, status, text_id=None, delivered_with=None, send_latency_ms=None):
+    """
+    Settle claimed outbox texts
+
+    Args:
+        outbox_ids (list): IDs of the claimed texts
+        worker_id (str): Worker that holds the claim
+        status (str): 'sent', 'coalesced' or 'duplicate'
+        text_id (str, optional): Textbelt textId of the text that carried them
+        delivered_with (int, optional): Outbox ID of the text they were folded into
+        send_latency_ms (float, optional): Time the Textbelt call took
+
+    Returns:
+        bool: True if successful, False otherwise
+    """
+    try:
+        with connection() as conn:
+            conn.execute("""
+                UPDATE sms_outbox
+                SET status = :status, text_id = :text_id, delivered_with = :delivered_with,
+                    send_latency_ms = :send_latency_ms,
+                    sent_at = CASE WHEN :status = 'duplicate' THEN sent_at ELSE :now END,
+                    claimed_by = NULL, lease_expires_at = NULL, last_error = NULL
+                WHERE id IN (SELECT value FROM json_each(:ids)) AND claimed_by = :worker_id
+            """, {
+                'status': status, 'text_id': text_id, 'delivered_with': delivered_with,
+                'send_latency_ms': send_latency_ms, 'now': datetime.now(),
+                'ids': _id_list(outbox_ids), 'worker_id': worker_id,
+            })
+
+        return True
+
+    except Exception as e:
+        logger.error('sms_outbox.complete_failed', str(e))
+        return False
+
+@timed_query
+def release_sms(outbox_ids, worker_id, error, max_attempts, retry_base_delay, retry_max_delay):
+    """
+    Release claimed outbox texts after a failed send, scheduling a retry or failing them
+
+    Same backoff as release_transcripts. Texts that used up max_attempts are marked failed.
+
+    Args:
+        outbox_ids (list): IDs of the claimed texts
+        worker_id (str): Worker that holds the claim
+        error (str): Failure reason, stored in last_error
+        max_attempts (int): Send attempts allowed per text
+        retry_base_delay (float): Delay in seconds before the first retry
+        retry_max_delay (float): Upper bound on the retry delay in seconds
+
+    Returns:
+        dict: {'retrying': count, 'failed': count}, or None if error
+    """
+    try:
+        with connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            now = datetime.now()
+
+            rows = conn.execute("""
+                SELECT id, attempts FROM sms_outbox
+                WHERE id IN (SELECT value FROM json_each(?)) AND claimed_by = ?
+            """, (_id_list(outbox_ids), worker_id)).fetchall()
+
+            updates = [
+                (error, _retry_at(now, row['attempts'], retry_base_delay, retry_max_delay),
+                 'failed' if row['attempts'] >= max_attempts else 'pending', row['id'])
+                for row in rows
+            ]
+
+            conn.executemany("""
+                UPDATE sms_outbox
+                SET claimed_by = NULL, lease_expires_at = NULL, last_error = ?,
+                    next_attempt_at = ?, status = ?
+                WHERE id = ?
+            """, updates)
+            conn.commit()
+
+        statuses = [u[2] for u in updates]
+        return {
+            'retrying': statuses.count('pending'),
+            'failed': statuses.count('failed'),
+        }
+
+    except Exception as e:
+        logger.error('sms_outbox.release_failed', str(e))
+        return None
+
+@timed_query
+def attach_sms_to_message(outbox_ids, message_id):
+    """
+    Link outbox texts to the message they were sent for
+
+    Args:
+        outbox_ids (list): IDs of the outbox texts
+        message_id (int): ID of the message
+
+    Returns:
+        bool: True if successful, False otherwise
+    """
+    try:
+        with connection() as conn:
+            conn.execute(
+                "UPDATE sms_outbox SET message_id = ? WHERE id IN (SELECT value FROM json_each(?))",
+                (message_id, _id_list(outbox_ids))
+            )
+
+        return True
+
+    except Exception as e:
+        logger.error('sms_outbox.attach_failed', str(e), message_id=message_id)
+        return False
+
+@timed_query
+def get_sms_outbox_stats():
+    """
+    Get counts of outbox texts by status
+
+    Returns:
+        dict: Count per status plus age of the oldest pending text
+    """
+    try:
+        with connection() as conn:
+            stats = {row[0]: row[1] for row in conn.execute(
+                "SELECT status, COUNT(*) FROM sms_outbox GROUP BY status"
+            ).fetchall()}
+
+            oldest = conn.execute("""
+                SELECT MIN(created_at) AS "oldest [TIMESTAMP]"
+                FROM sms_outbox WHERE status = 'pending'
+            """).fetchone()[0]
+
+        stats['oldest_pending_age_seconds'] = (datetime.now() - oldest).total_seconds() if oldest is not None else None
+        return stats
+
+    except Exception as e:
+        logger.error('sms_outbox.stats_failed', str(e))
+        return {}
+
+@timed_query
+def save_trace(trace_id, session_id, outcome, stages, elapsed_ms, message_id=None, model=None, usage=None,
+               web_searches=None, received_at=None):
+    """
+    Store one processed batch's trace
+
+    Args:
+        trace_id (str): Trace ID (shared by retries of the same batch)
+        session_id (str): Omi session ID
+        outcome (str): Batch outcome, e.g. 'responded' or 'retry'
+        stages (dict): Stage name -> milliseconds
+        elapsed_ms (float): Processing time so far, used to derive started_at
+        message_id (int, optional): ID of the AI message the batch produced
+        model (str, optional): Model that ran the agent
+        usage (dict, optional): input_tokens, output_tokens, total_tokens, requests
+        web_searches (int, optional): Web searches the agent ran
+        received_at (datetime, optional): When the activating segment arrived
+
+    Returns:
+        int: ID of the traces row, or None if error
+    """
+    usage = usage or {}
+    try:
+        now = datetime.now()
+        with connection() as conn:
+            row_id = conn.execute("""
+                INSERT INTO traces (trace_id, session_id, message_id, outcome, model,
+                                    input_tokens, output_tokens, total_tokens, llm_requests, web_searches,
+                                    stages, received_at, started_at, created_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                RETURNING id
+            """, (
+                trace_id, session_id, message_id, outcome, model,
+                usage.get('input_tokens'), usage.get('output_tokens'),
+                usage.get('total_tokens'), usage.get('requests'), web_searches,
+                json.dumps(stages), received_at, now - timedelta(milliseconds=elapsed_ms), now
+            )).fetchall()[0][0]
+
+        return row_id
+
+    except Exception as e:
+        logger.error('traces.save_failed', str(e))
+        return None
+
+def _percentile_cont(values, fraction):
+    """Linear-interpolated percentile of sorted values, like Postgres percentile_cont"""
+    position = fraction * (len(values) - 1)
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+@timed_query
+def get_trace_stage_percentiles(window_seconds):
+    """
+    Get p50/p95/p99 per stage for traces recorded within a time window
+
+    Stages are derived as in db.TRACE_STAGE_TIMES_QUERY; SQLite has no
+    percentile_cont, so the timings are fetched and ranked here.
+
+    Args:
+        window_seconds (int): How far back to look
+
+    Returns:
+        dict: {'traces', 'stages': {stage: {count, p50_ms, p95_ms, p99_ms}},
+               'models': {model: {traces, input_tokens, output_tokens, total_tokens}}}, or None if error
+    """
+    try:
+        since = datetime.now() - timedelta(seconds=window_seconds)
+        with connection() as conn:
+            recent = conn.execute("""
+                SELECT trace_id, stages, received_at, started_at
+                FROM traces
+                WHERE created_at >= ?
+            """, (since,)).fetchall()
+
+            texts = conn.execute("""
+                SELECT trace_id, created_at, sent_at, send_latency_ms, status
+                FROM sms_outbox
+                WHERE trace_id IN (SELECT trace_id FROM traces WHERE created_at >= ?)
+                  AND sent_at IS NOT NULL
+                  AND status IN ('sent', 'coalesced')
+            """, (since,)).fetchall()
+
+            models = {row['model']: {k: row[k] for k in row.keys() if k != 'model'} for row in conn.execute("""
+                SELECT COALESCE(model, 'unknown') AS model, COUNT(*) AS traces,
+                       COALESCE(SUM(input_tokens), 0) AS input_tokens,
+                       COALESCE(SUM(output_tokens), 0) AS output_tokens,
+                       COALESCE(SUM(total_tokens), 0) AS total_tokens
+                FROM traces
+                WHERE created_at >= ?
+                GROUP BY 1
+            """, (since,)).fetchall()}
+
+        stage_times = defaultdict(list)
+        first_received = {}
+        for row in recent:
+            for stage, ms in row['stages'].items():
+                stage_times[stage].append(float(ms))
+            if row['received_at'] is not None:
+                # Activating segment received -> processor picked the batch up (includes retry backoff)
+                stage_times['queue_wait'].append((row['started_at'] - row['received_at']).total_seconds() * 1000)
+                previous = first_received.get(row['trace_id'])
+                if previous is None or row['received_at'] < previous:
+                    first_received[row['trace_id']] = row['received_at']
+
+        first_sent = {}
+        for text in texts:
+            # Queued until handed to Textbelt: coalescing window, worker wake-up, retries
+            stage_times['sms_delivery'].append((text['sent_at'] - text['created_at']).total_seconds() * 1000)
+            if text['status'] == 'sent' and text['send_latency_ms'] is not None:
+                stage_times['sms_send'].append(text['send_latency_ms'])
+            previous = first_sent.get(text['trace_id'])
+            if previous is None or text['sent_at'] < previous:
+                first_sent[text['trace_id']] = text['sent_at']
+
+        # Activating segment received -> first text of the batch sent
+        for trace_id, sent_at in first_sent.items():
+            if trace_id in first_received:
+                stage_times['activation_to_sms'].append((sent_at - first_received[trace_id]).total_seconds() * 1000)
+
+        stages = {}
+        for stage in sorted(stage_times):
+            values = sorted(stage_times[stage])
+            stages[stage] = {
+                'count': len(values),
+                'p50_ms': round(_percentile_cont(values, 0.5), 2),
+                'p95_ms': round(_percentile_cont(values, 0.95), 2),
+                'p99_ms': round(_percentile_cont(values, 0.99), 2),
+            }
+
+        return {
+            'traces': sum(m['traces'] for m in models.values()),
+            'stages': stages,
+            'models': models,
+        }
+
+    except Exception as e:
+        logger.error('traces.stats_failed', str(e))
+        return None
+
+@timed_query
+def get_trace(trace_id):
+    """
+    Get every recorded attempt of a trace and the texts it produced
+
+    Args:
+        trace_id (str): Trace ID
+
+    Returns:
+        dict: {'attempts': [traces rows], 'texts': [sms_outbox rows]}, or None if error
+    """
+    try:
+        with connection() as conn:
+            attempts = [dict(row) for row in conn.execute(
+                "SELECT * FROM traces WHERE trace_id = ? ORDER BY id", (trace_id,)
+            ).fetchall()]
+
+            texts = [dict(row) for row in conn.execute("""
+                SELECT id, source, status, attempts, created_at, sent_at, send_latency_ms,
+                       text_id, delivered_with, message_id, last_error
+                FROM sms_outbox
+                WHERE trace_id = ?
+                ORDER BY id
+            """, (trace_id,)).fetchall()]
+
+        return {'attempts': attempts, 'texts': texts}
+
+    except Exception as e:
+        logger.error('traces.fetch_failed', str(e))
+        return None
+
+@timed_query
+def save_message(message_type, message_text, tool_executions=None, session_id=None):
+    """
+    Save a message (user or AI) to the database
+
+    Args:
+        message_type (str): 'user' or 'ai'
+        message_text (str): The message content
+        tool_executions (list, optional): List of tool names that were executed (not used with Agents SDK)
+        session_id (str, optional): Omi session ID the message belongs to
+
+    Returns:
+        int: ID of saved message, or None if error
+    """
+    try:
+        tool_executions_str = ','.join(tool_executions) if tool_executions else None
+
+        with connection() as conn:
+            message_id = conn.execute("""
+                INSERT INTO messages (message_type, message_text, tool_executions, session_id, timestamp)
+                VALUES (?, ?, ?, ?, ?)
+                RETURNING id
+            """, (message_type, message_text, tool_executions_str, session_id, datetime.now())).fetchall()[0][0]
+
+        logger.debug('messages.saved', message_type=message_type, message_id=message_id)
+        return message_id
+
+    except Exception as e:
+        logger.error('messages.save_failed', str(e))
+        return None
+
+@timed_query
+def get_conversation_history(limit=10):
+    """
+    Get recent conversation history
+
+    Args:
+        limit (int): Maximum number of messages to retrieve
+
+    Returns:
+        list: List of message dictionaries, ordered by timestamp (oldest first)
+    """
+    try:
+        with connection() as conn:
+            messages = conn.execute("""
+                SELECT message_type, message_text, timestamp
+                FROM messages
+                ORDER BY timestamp DESC
+                LIMIT ?
+            """, (limit,)).fetchall()
+
+        # Return in chronological order (oldest first)
+        return [dict(m) for m in reversed(messages)]
+
+    except Exception as e:
+        logger.error('messages.fetch_failed', str(e))
+        return []
+
+@timed_query
+def get_all_messages():
+    """
+    Get all messages for debugging/viewing
+
+    Returns:
+        list: List of all message dictionaries
+    """
+    try:
+        with connection() as conn:
+            messages = conn.execute("SELECT * FROM messages ORDER BY timestamp ASC").fetchall()
+
+        return [dict(m) for m in messages]
+
+    except Exception as e:
+        logger.error('messages.fetch_failed', str(e))
+        return []
+
+# Delivery status of the texts sent for a message (m), attached to paged and streamed messages
+MESSAGE_TEXTS_COLUMN = """
+    (SELECT json_group_array(json_object(
+                'outbox_id', o.id, 'source', o.source, 'status', o.status,
+                'text_id', o.text_id, 'sent_at', o.sent_at
+            ))
+     FROM (SELECT * FROM sms_outbox WHERE message_id = m.id ORDER BY id) o) AS texts
+"""
+
+def _load_texts(message):
+    """Decode a message row's texts column (None when no texts were sent for it)"""
+    message['texts'] = json.loads(message['texts']) or None
+    return message
+
+def _message_filters(before=None, after=None, session_id=None):
+    """Build the WHERE clause shared by the paginated and streaming message queries"""
+    conditions = []
+    params = []
+
+    if session_id is not None:
+        conditions.append("session_id = ?")
+        params.append(session_id)
+    if before is not None:
+        conditions.append("(timestamp, id) < (?, ?)")
+        params.extend(before)
+    if after is not None:
+        conditions.append("(timestamp, id) > (?, ?)")
+        params.extend(after)
+
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    return where, params
+
+@timed_query
+def get_messages_page(limit=100, before=None, after=None, session_id=None):
+    """
+    Get one page of messages using keyset pagination on (timestamp, id)
+
+    Args:
+        limit (int): Maximum number of messages to return
+        before (tuple, optional): (timestamp, id) cursor; only return messages before it
+        after (tuple, optional): (timestamp, id) cursor; only return messages after it
+        session_id (str, optional): Only return messages from this Omi session
+
+    Returns:
+        list: Message dictionaries in chronological order (oldest first), each with
+              the delivery status of the texts sent for it, or None if error
+    """
+    try:
+        where, params = _message_filters(before, after, session_id)
+
+        # Paging backwards reads newest-first from the cursor, then flips the page
+        descending = before is not None and after is None
+        order = "DESC" if descending else "ASC"
+
+        with connection() as conn:
+            messages = [dict(m) for m in conn.execute(f"""
+                SELECT m.*, {MESSAGE_TEXTS_COLUMN}
+                FROM messages m
+                {where}
+                ORDER BY timestamp {order}, id {order}
+                LIMIT ?
+            """, params + [limit]).fetchall()]
+
+        for message in messages:
+            _load_texts(message)
+
+        if descending:
+            messages.reverse()
+        return messages
+
+    except Exception as e:
+        logger.error('messages.fetch_failed', str(e))
+        return None
+
+def iter_messages(before=None, after=None, session_id=None, limit=None, batch_size=500):
+    """
+    Stream messages in chronological order
+
+    Rows are stepped batch_size at a time from one query, so memory stays
+    flat no matter how much history exists. The pooled connection is held
+    until the generator is exhausted or closed. Ordering, the limit applied
+    next to a before cursor and the 'texts' field match get_messages_page.
+
+    Args:
+        before (tuple, optional): (timestamp, id) cursor; only return messages before it
+        after (tuple, optional): (timestamp, id) cursor; only return messages after it
+        session_id (str, optional): Only return messages from this Omi session
+        limit (int, optional): Maximum number of messages to return
+        batch_size (int): Rows fetched per step
+
+    Yields:
+        dict: One message at a time
+    """
+    with connection() as conn:
+        where, params = _message_filters(before, after, session_id)
+
+        # With a limit, paging backwards takes the messages just before the cursor
+        descending = before is not None and after is None and limit is not None
+        order = "DESC" if descending else "ASC"
+
+        query = f"SELECT m.*, {MESSAGE_TEXTS_COLUMN} FROM messages m {where} ORDER BY timestamp {order}, id {order}"
+        if limit is not None:
+            query += " LIMIT ?"
+            params.append(limit)
+        if descending:
+            query = f"SELECT * FROM ({query}) page ORDER BY timestamp ASC, id ASC"
+
+        cursor = conn.execute(query, params)
+        try:
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                for message in rows:
+                    yield _load_texts(dict(message))
+        finally:
+            cursor.close()
+
+@timed_query
+def get_session_mapping(omi_session_id):
+    """
+    Get the OpenAI conversation ID stored for an Omi session
+
+    Args:
+        omi_session_id (str): Session ID from Omi device
+
+    Returns:
+        str: OpenAI conversation ID, or None if not found or error
+    """
+    try:
+        with connection() as conn:
+            result = conn.execute(
+                "SELECT openai_conversation_id FROM sessions WHERE omi_session_id = ?", (omi_session_id,)
+            ).fetchone()
+
+        return result[0] if result else None
+
+    except Exception as e:
+        logger.error('sessions.lookup_failed', str(e), omi_session_id=omi_session_id)
+        return None
+
+@timed_query
+def save_session_mapping(omi_session_id, openai_conversation_id):
+    """
+    Save or update an Omi session -> OpenAI conversation mapping
+
+    Args:
+        omi_session_id (str): Session ID from Omi device
+        openai_conversation_id (str): OpenAI conversation ID
+
+    Returns:
+        bool: True if successful, False otherwise
+    """
+    try:
+        now = datetime.now()
+        with connection() as conn:
+            conn.execute("""
+                INSERT INTO sessions (omi_session_id, openai_conversation_id, created_at, last_used_at)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT (omi_session_id)
+                DO UPDATE SET openai_conversation_id = excluded.openai_conversation_id,
+                              last_used_at = excluded.last_used_at
+            """, (omi_session_id, openai_conversation_id, now, now))
+
+        return True
+
+    except Exception as e:
+        logger.error('sessions.save_failed', str(e), omi_session_id=omi_session_id)
+        return False
+
+@timed_query
+def touch_sessions(touches):
+    """
+    Move sessions' last_used_at forward in one transaction
+
+    Args:
+        touches (list): (omi_session_id, last used datetime) pairs
+
+    Returns:
+        int: Number of touches written, or None if error
+    """
+    try:
+        with connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.executemany("""
+                UPDATE sessions
+                SET last_used_at = :used_at
+                WHERE omi_session_id = :omi_session_id AND last_used_at < :used_at
+            """, [{'omi_session_id': omi_session_id, 'used_at': used_at} for omi_session_id, used_at in touches])
+            conn.commit()
+
+        return len(touches)
+
+    except Exception as e:
+        logger.error('sessions.touch_flush_failed', str(e), pending=len(touches))
+        return None
+
+@timed_query
+def get_session_count():
+    """
+    Get total number of tracked conversations
+
+    Returns:
+        int: Number of Omi sessions tracked, or 0 if error
+    """
+    try:
+        with connection() as conn:
+            return conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+    except Exception as e:
+        logger.error('sessions.count_failed', str(e))
+        return 0
@@ -0,0 +1,95 @@
+"""
+Micro-benchmark: compiled activation matcher vs. the legacy phrase loop
+Run from project root: python dev/bench_activation.py [segments_per_batch] [batches]
+"""
+
+import os
+import sys
+import random
+import timeit
+
+# Add parent directory to path so we can import modules
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import activation
+
+AMBIENT_LINES = [
+    "yeah I think we should push the meeting to Thursday",
+    "did you see the game last night",
+    "okay so the numbers for last quarter look pretty good",
+    "they said the delivery would be here around noon",
+    "can you pass me that charger",
+    "I'll grab coffee on the way in tomorrow",
+    "hmm, not sure about that one, let me check",
+    "so anyway, the contractor is coming at three",
+]
+
+ACTIVATION_LINES = [
+    "Hey Jarvis, what's the weather tomorrow?",
+    "hey, uh, Jarvis, remind me to call mom",
+    "Okay Jervis, how long to the airport?",
+]
+
+def format_batch(transcripts):
+    """Format a batch the way ai_handler.format_transcripts_for_ai does"""
+    return "\n".join(
+        f"{t.get('speaker', 'UNKNOWN')}: {t.get('text', '').strip()}" for t in transcripts
+    )
+
+def legacy_detect(user_message):
+    """The original transcript_processor loop: lowercase the prompt, scan each phrase"""
+    user_message_lower = user_message.lower()
+    for phrase in activation.ACTIVATION_PHRASES:
+        if phrase in user_message_lower:
+            return phrase
+    return None
+
+def make_batches(segments_per_batch, batches, activation_rate=0.05, seed=42):
+    """Generate synthetic transcript batches, some of them containing an activation"""
+    rng = random.Random(seed)
+    result = []
+    for _ in range(batches):
+        batch = [
+            {'speaker': f"SPEAKER_{rng.randint(0, 2)}", 'text': rng.choice(AMBIENT_LINES), 'is_user': False}
+            for _ in range(segments_per_batch)
+        ]
+        if rng.random() < activation_rate:
+            batch[rng.randrange(len(batch))]['text'] = rng.choice(ACTIVATION_LINES)
+        result.append(batch)
+    return result
+
+def run_benchmark(segments_per_batch=20, batches=500):
+    """Time both detectors over the same batches and compare their hits"""
+    data = make_batches(segments_per_batch, batches)
+    # The prompt is formatted either way, so it isn't part of the legacy timing
+    messages = [format_batch(b) for b in data]
+    matcher = activation.ActivationMatcher(user_only=False, speakers=[])
+
+    legacy_time = min(timeit.repeat(lambda: [legacy_detect(m) for m in messages], number=1, repeat=5))
+    matcher_time = min(timeit.repeat(lambda: [matcher.detect(b) for b in data], number=1, repeat=5))
+    session_time = min(timeit.repeat(
+        lambda: [matcher.detect(b, session_id='bench') for b in data], number=1, repeat=5
+    ))
+
+    legacy_hits = sum(1 for m in messages if legacy_detect(m))
+    matcher_hits = sum(1 for b in data if matcher.detect(b))
+
+    # Phrase split across two batches: only the session-aware matcher sees it
+    split = [[{'text': "so I said hey"}], [{'text': "Jarvis, set a timer"}]]
+    split_legacy = any(legacy_detect(format_batch(b)) for b in split)
+    split_matcher = any(matcher.detect(b, session_id='split') for b in split)
+
+    print("\n" + "="*60)
+    print("ACTIVATION MATCHER BENCHMARK")
+    print("="*60)
+    print(f"Batches: {batches} x {segments_per_batch} segments")
+    print(f"Legacy loop:          {legacy_time / batches * 1e6:8.1f} us/batch  ({legacy_hits} hits)")
+    print(f"Compiled matcher:     {matcher_time / batches * 1e6:8.1f} us/batch  ({matcher_hits} hits)")
+    print(f"Matcher + tail state: {session_time / batches * 1e6:8.1f} us/batch")
+    print(f"Split across batches: legacy={split_legacy} matcher={split_matcher}")
+    print("="*60 + "\n")
+
+if __name__ == "__main__":
+    segments_per_batch = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    batches = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    run_benchmark(segments_per_batch, batches)
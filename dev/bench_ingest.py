@@ -0,0 +1,368 @@
+"""
+Load test for the webhook ingest path
+Run from project root: python dev/bench_ingest.py [options] > result.json
+
+Generates Omi-shaped transcript payloads (with configurable resent payloads
+and overlapping segments), posts them to the webhook at a fixed target rate
+and prints a JSON report: throughput, latency percentiles, database calls
+and transactions per request, and how many segments were stored vs deduped.
+
+By default the Flask app is driven in-process through its test client
+against DATABASE_URL (use a local Postgres, not production). With --url an
+already running server is driven over HTTP instead.
+
+Requests are scheduled open-loop: latency is measured from when a request
+was due, not when a worker got to it, so a server that falls behind shows
+up in the percentiles instead of silently lowering the offered rate.
+
+--max-p99-ms / --min-throughput turn the run into a gate: the exit code is 1
+when a threshold is missed, so it can run before deploy.
+"""
+
+import os
+import re
+import sys
+import json
+import math
+import time
+import uuid
+import random
+import argparse
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+# Add parent directory to path so we can import modules
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from bench_activation import AMBIENT_LINES, ACTIVATION_LINES
+
+_DB_CALLS_RE = re.compile(r'^omi_db_query_duration_seconds_count\{function="([^"]+)"\} (\d+)$', re.M)
+
+def make_payloads(requests, sessions=20, max_segments=5, duplicate_rate=0.05, overlap_rate=0.2,
+                  overlap_segments=2, activation_rate=0.0, seed=42):
+    """
+    Generate webhook payloads shaped like Omi's real-time transcript webhook
+
+    Args:
+        requests (int): Number of payloads
+        sessions (int): Concurrent Omi sessions the payloads are spread over
+        max_segments (int): Segments per payload are drawn from 1..max_segments
+        duplicate_rate (float): Fraction of payloads that are an exact resend of an earlier one (webhook retry)
+        overlap_rate (float): Fraction of payloads that repeat the tail of the session's previous payload
+        overlap_segments (int): Segments repeated by an overlapping payload
+        activation_rate (float): Fraction of new segments that contain an activation phrase
+        seed (int): Random seed, so runs are comparable
+
+    Returns:
+        tuple: (list of payload dicts, dict of expected counts)
+    """
+    rng = random.Random(seed)
+    run_id = uuid.uuid4().hex[:8]  # Fresh segment ids on every run
+    session_ids = [f"bench-{run_id}-{n}" for n in range(sessions)]
+    clock = {sid: 0.0 for sid in session_ids}
+    counters = {sid: 0 for sid in session_ids}
+    last_segments = {sid: [] for sid in session_ids}
+
+    payloads = []
+    expected = Counter()
+    for _ in range(requests):
+        if payloads and rng.random() < duplicate_rate:
+            payload = rng.choice(payloads)
+            payloads.append(payload)
+            expected['resent_payloads'] += 1
+            expected['repeated_segments'] += len(payload['segments'])
+            continue
+
+        session_id = rng.choice(session_ids)
+        segments = []
+        if last_segments[session_id] and rng.random() < overlap_rate:
+            repeated = last_segments[session_id][-overlap_segments:]
+            segments.extend(repeated)
+            expected['overlapping_payloads'] += 1
+            expected['repeated_segments'] += len(repeated)
+
+        for _ in range(rng.randint(1, max_segments)):
+            start = clock[session_id]
+            end = start + rng.uniform(1.0, 6.0)
+            clock[session_id] = end + rng.uniform(0.0, 1.5)
+            counters[session_id] += 1
+            speaker_id = rng.randint(0, 2)
+            activated = rng.random() < activation_rate
+            segments.append({
+                'id': f"{session_id}-{counters[session_id]}",
+                'text': rng.choice(ACTIVATION_LINES if activated else AMBIENT_LINES),
+                'speaker': f"SPEAKER_{speaker_id}",
+                'speaker_id': speaker_id,
+                'is_user': speaker_id == 0,
+                'start': round(start, 2),
+                'end': round(end, 2),
+            })
+            expected['new_segments'] += 1
+
+        last_segments[session_id] = segments
+        payloads.append({'session_id': session_id, 'segments': segments})
+
+    return payloads, dict(expected)
+
+class InProcessClient:
+    """Drives the Flask app through its test client (one client per thread)"""
+
+    def __init__(self):
+        import app as app_module
+        self._app = app_module.app
+        self._local = threading.local()
+
+    def _client(self):
+        if not hasattr(self._local, 'client'):
+            self._local.client = self._app.test_client()
+        return self._local.client
+
+    def post(self, path, payload):
+        response = self._client().post(path, json=payload)
+        return response.status_code, response.get_json(silent=True)
+
+    def get_text(self, path):
+        return self._client().get(path).get_data(as_text=True)
+
+class HttpClient:
+    """Drives a running server over HTTP (one keep-alive session per thread)"""
+
+    def __init__(self, base_url, timeout=30):
+        import requests
+        self._requests = requests
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _session(self):
+        if not hasattr(self._local, 'session'):
+            self._local.session = self._requests.Session()
+        return self._local.session
+
+    def post(self, path, payload):
+        try:
+            response = self._session().post(self.base_url + path, json=payload, timeout=self.timeout)
+        except self._requests.RequestException:
+            return 0, None
+        try:
+            body = response.json()
+        except ValueError:
+            body = None
+        return response.status_code, body
+
+    def get_text(self, path):
+        return self._session().get(self.base_url + path, timeout=self.timeout).text
+
+def db_calls(client):
+    """Calls per db.py function so far, parsed from GET /metrics"""
+    try:
+        return {name: int(count) for name, count in _DB_CALLS_RE.findall(client.get_text('/metrics'))}
+    except Exception:
+        return {}
+
+def db_transactions():
+    """
+    Committed + rolled back transactions in the benchmark database, or None if unavailable
+
+    Database-wide, so background work (the processor, metric scrapes) is
+    included; run against an otherwise idle database.
+    """
+    try:
+        import db
+        conn = db.get_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT pg_stat_clear_snapshot()")
+            cursor.execute("""
+                SELECT xact_commit + xact_rollback FROM pg_stat_database
+                WHERE datname = current_database()
+            """)
+            value = cursor.fetchone()[0]
+            cursor.close()
+            return value
+        finally:
+            conn.close()
+    except Exception:
+        return None
+
+def wait_for_ingest(client, timeout=30):
+    """Wait until the async ingest queue (if any) has been written out"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            stats = json.loads(client.get_text('/stats'))
+            if stats.get('ingest', {}).get('queue_depth', 0) == 0:
+                return
+        except Exception:
+            return
+        time.sleep(0.1)
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    index = max(0, math.ceil(fraction * len(sorted_values)) - 1)
+    return sorted_values[index]
+
+def summarize(values_ms):
+    """Latency percentiles in milliseconds"""
+    values = sorted(values_ms)
+    return {
+        'p50_ms': round(percentile(values, 0.50), 2) if values else None,
+        'p90_ms': round(percentile(values, 0.90), 2) if values else None,
+        'p99_ms': round(percentile(values, 0.99), 2) if values else None,
+        'max_ms': round(values[-1], 2) if values else None,
+        'mean_ms': round(sum(values) / len(values), 2) if values else None,
+    }
+
+def run_benchmark(client, payloads, rate, concurrency, path='/webhook'):
+    """
+    Post payloads open-loop at the target rate
+
+    Returns:
+        dict: Raw per-request results and timings
+    """
+    results = [None] * len(payloads)
+    interval = 1.0 / rate
+    started = time.monotonic()
+
+    def send(index):
+        due = started + index * interval
+        sent = time.monotonic()
+        status, body = client.post(path, payloads[index])
+        done = time.monotonic()
+        results[index] = (status, body, (done - sent) * 1000, (done - due) * 1000)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for index in range(len(payloads)):
+            delay = started + index * interval - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            executor.submit(send, index)
+
+    return results, time.monotonic() - started
+
+def build_report(args, payloads, expected, results, elapsed, calls_before, calls_after, xact_before, xact_after):
+    """Assemble the JSON report and evaluate the --max-p99-ms / --min-throughput gates"""
+    statuses = Counter(r[0] for r in results)
+    ok = [r for r in results if r[0] == 200]
+    segments_sent = sum(len(p['segments']) for p in payloads)
+    saved = sum((r[1] or {}).get('segments_saved', 0) for r in ok)
+    duplicates = sum((r[1] or {}).get('segments_duplicate', 0) for r in ok)
+    queued = sum((r[1] or {}).get('segments_queued', 0) for r in ok)
+    filtered = sum((r[1] or {}).get('segments_filtered', 0) for r in ok)
+
+    calls = {
+        name: count - calls_before.get(name, 0)
+        for name, count in calls_after.items()
+        if count - calls_before.get(name, 0) > 0
+    }
+
+    report = {
+        'config': {
+            'target': args.url or 'in-process',
+            'requests': len(payloads),
+            'target_rps': args.rate,
+            'concurrency': args.concurrency,
+            'sessions': args.sessions,
+            'max_segments': args.max_segments,
+            'duplicate_rate': args.duplicate_rate,
+            'overlap_rate': args.overlap_rate,
+            'activation_rate': args.activation_rate,
+            'seed': args.seed,
+        },
+        'duration_seconds': round(elapsed, 3),
+        'throughput': {
+            'requests_per_second': round(len(results) / elapsed, 2),
+            'segments_per_second': round(segments_sent / elapsed, 2),
+        },
+        'status_codes': {str(code): count for code, count in sorted(statuses.items())},
+        'latency': summarize([r[2] for r in results]),
+        # Measured from when the request was due; grows when the server falls behind the target rate
+        'scheduled_latency': summarize([r[3] for r in results]),
+        'segments': {
+            'sent': segments_sent,
+            'saved': saved,
+            'duplicate': duplicates,
+            # Duplicates dropped by the seen-segment filter without touching the database
+            'filtered': filtered,
+            'queued': queued,
+            'expected_new': expected.get('new_segments', 0),
+            'expected_repeated': expected.get('repeated_segments', 0),
+        },
+        'db': {
+            'calls_per_request': round(sum(calls.values()) / len(results), 3) if calls else None,
+            'calls_by_function': calls,
+            'transactions_per_request': (
+                round((xact_after - xact_before) / len(results), 3)
+                if xact_before is not None and xact_after is not None else None
+            ),
+        },
+    }
+
+    failures = []
+    if args.max_p99_ms is not None and (report['latency']['p99_ms'] or 0) > args.max_p99_ms:
+        failures.append(f"p99 {report['latency']['p99_ms']} ms > {args.max_p99_ms} ms")
+    if args.min_throughput is not None and report['throughput']['requests_per_second'] < args.min_throughput:
+        failures.append(f"throughput {report['throughput']['requests_per_second']} rps < {args.min_throughput} rps")
+    if statuses.get(200, 0) != len(results):
+        failures.append(f"{len(results) - statuses.get(200, 0)} non-200 responses")
+    report['passed'] = not failures
+    report['failures'] = failures
+
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description="Webhook ingest load test")
+    parser.add_argument('--requests', type=int, default=2000, help="payloads to send")
+    parser.add_argument('--rate', type=float, default=200, help="target requests per second")
+    parser.add_argument('--concurrency', type=int, default=16, help="requests in flight at most")
+    parser.add_argument('--sessions', type=int, default=20, help="Omi sessions the payloads are spread over")
+    parser.add_argument('--max-segments', type=int, default=5, help="segments per payload are 1..N")
+    parser.add_argument('--duplicate-rate', type=float, default=0.05, help="fraction of payloads resent as-is")
+    parser.add_argument('--overlap-rate', type=float, default=0.2, help="fraction of payloads repeating earlier segments")
+    parser.add_argument('--overlap-segments', type=int, default=2, help="segments repeated by an overlapping payload")
+    parser.add_argument('--activation-rate', type=float, default=0.0,
+                        help="fraction of segments with an activation phrase (non-zero wakes the agent)")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--url', help="base URL of a running server (default: drive the app in-process)")
+    parser.add_argument('--output', help="write the JSON report here instead of stdout")
+    parser.add_argument('--max-p99-ms', type=float, help="fail if p99 latency exceeds this")
+    parser.add_argument('--min-throughput', type=float, help="fail if requests per second fall below this")
+    args = parser.parse_args()
+
+    payloads, expected = make_payloads(
+        args.requests, args.sessions, args.max_segments, args.duplicate_rate,
+        args.overlap_rate, args.overlap_segments, args.activation_rate, args.seed
+    )
+
+    if not args.url:
+        # App logs share stdout with the report; keep them to warnings unless asked otherwise
+        os.environ.setdefault('LOG_LEVEL', 'WARNING')
+    client = HttpClient(args.url) if args.url else InProcessClient()
+
+    calls_before = db_calls(client)
+    xact_before = db_transactions()
+
+    results, elapsed = run_benchmark(client, payloads, args.rate, args.concurrency)
+
+    wait_for_ingest(client)
+    time.sleep(1)  # let Postgres publish transaction counters
+    calls_after = db_calls(client)
+    xact_after = db_transactions()
+
+    report = build_report(args, payloads, expected, results, elapsed,
+                          calls_before, calls_after, xact_before, xact_after)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+    sys.exit(0 if report['passed'] else 1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,224 @@
+"""
+Side-by-side benchmark of the storage backends
+Run from project root: python dev/bench_storage.py --url postgresql://localhost/jarvis_bench --url sqlite:///bench.db
+
+Drives the storage interface directly (no Flask, no agent) with the
+pipeline's own access pattern, once per --url:
+
+1. ingest: webhook payloads (with resent payloads, overlapping segments and
+   activations) saved by --concurrency threads
+2. process: processors claim sessions, save a message and complete the batch
+   until the backlog is drained
+3. outbox: texts enqueued, claimed, settled and linked to their message
+4. sessions: session mappings written and read back
+5. reads: /conversation pages and queue stats
+
+Each backend runs in its own subprocess (fresh module state and pools). The
+JSON report has per-operation latency percentiles and per-phase throughput
+for every backend. Use scratch databases: rows are added with unique ids,
+but the process phase also claims any backlog already present.
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import argparse
+import subprocess
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+# Add parent directory to path so we can import modules
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from bench_ingest import make_payloads, summarize
+
+class Recorder:
+    """Collects per-operation latencies from many threads"""
+
+    def __init__(self):
+        self.timings = defaultdict(list)
+        self._lock = threading.Lock()
+
+    def call(self, name, func, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            elapsed = (time.perf_counter() - started) * 1000
+            with self._lock:
+                self.timings[name].append(elapsed)
+
+    def report(self):
+        return {name: dict(summarize(values), calls=len(values)) for name, values in sorted(self.timings.items())}
+
+def run_phase(concurrency, items, work):
+    """Run work(item) over items on a thread pool; returns wall seconds"""
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(work, items))
+    return time.perf_counter() - started
+
+def bench_backend(args):
+    """Run every phase against the backend for args.url in this process"""
+    os.environ['DATABASE_URL'] = args.url
+    import storage
+    import activation
+    backend = storage.load(args.url)
+    if not backend.init_db():
+        raise SystemExit(f"init_db failed for {args.url}")
+
+    run_id = uuid.uuid4().hex[:8]
+    payloads, expected = make_payloads(
+        args.requests, sessions=args.sessions, duplicate_rate=args.duplicate_rate,
+        overlap_rate=args.overlap_rate, activation_rate=args.activation_rate, seed=args.seed
+    )
+    for payload in payloads:
+        payload['session_id'] = f"{run_id}-{payload['session_id']}"
+        payload['segments'] = [dict(s, id=f"{run_id}-{s['id']}") for s in payload['segments']]
+        # Flagged here as the webhook does, so the process phase has activated sessions to claim
+        activation.flag_activations(payload['segments'], payload['session_id'])
+
+    recorder = Recorder()
+    phases = {}
+
+    # 1. Ingest
+    seconds = run_phase(args.concurrency, payloads, lambda p: recorder.call(
+        'save_transcript_segments', backend.save_transcript_segments, p['segments'], p['session_id']
+    ))
+    phases['ingest'] = {'seconds': round(seconds, 3), 'payloads_per_second': round(len(payloads) / seconds, 1)}
+
+    # 2. Process: claim -> save message -> complete, until nothing is claimable
+    worker_ids = [f"bench-{run_id}-{n}" for n in range(args.processors)]
+    batches = []
+    batches_lock = threading.Lock()
+
+    def process(worker_id):
+        while True:
+            claimed = recorder.call('claim_transcript_batches', backend.claim_transcript_batches,
+                                    worker_id, args.sessions_per_claim, 300, 5)
+            if not claimed:
+                return
+            for session_id, rows in claimed.items():
+                message_id = recorder.call('save_message', backend.save_message,
+                                           'user', ' '.join(r['text'] for r in rows), session_id=session_id)
+                recorder.call('complete_transcripts', backend.complete_transcripts,
+                              [r['id'] for r in rows], worker_id, message_id)
+                with batches_lock:
+                    batches.append((session_id, message_id))
+
+    seconds = run_phase(args.processors, worker_ids, process)
+    recorder.call('sweep_inactive_transcripts', backend.sweep_inactive_transcripts, 0)
+    phases['process'] = {'seconds': round(seconds, 3), 'batches': len(batches),
+                         'batches_per_second': round(len(batches) / seconds, 1) if seconds else None}
+
+    # 3. Outbox: every batch texts once, spread over a few recipients; one worker drains the outbox
+    def enqueue(item):
+        index, (session_id, message_id) = item
+        outbox_id = recorder.call('enqueue_sms', backend.enqueue_sms, f"555{run_id[:3]}{index % 10:04d}",
+                                  f"Reply {index} for {session_id}", 'response', None)
+        recorder.call('attach_sms_to_message', backend.attach_sms_to_message, [outbox_id], message_id)
+
+    seconds = run_phase(args.concurrency, list(enumerate(batches)), enqueue)
+    started = time.perf_counter()
+    sent = 0
+    while True:
+        claimed = recorder.call('claim_sms_batches', backend.claim_sms_batches, f"bench-{run_id}", 0, 60, 50)
+        if not claimed:
+            break
+        for rows in claimed.values():
+            recorder.call('get_recently_sent_sms', backend.get_recently_sent_sms,
+                          rows[0]['phone_number'], [r['trace_id'] for r in rows if r['trace_id']], 300)
+            recorder.call('complete_sms', backend.complete_sms, [r['id'] for r in rows], f"bench-{run_id}", 'sent',
+                          text_id='bench', send_latency_ms=0.0)
+            sent += len(rows)
+    seconds += time.perf_counter() - started
+    phases['outbox'] = {'seconds': round(seconds, 3), 'texts': sent,
+                        'texts_per_second': round(sent / seconds, 1) if seconds else None}
+
+    # 4. Session mappings
+    session_ids = sorted({p['session_id'] for p in payloads})
+    seconds = run_phase(args.concurrency, session_ids, lambda s: (
+        recorder.call('save_session_mapping', backend.save_session_mapping, s, f"conv_{s}"),
+        recorder.call('get_session_mapping', backend.get_session_mapping, s),
+    ))
+    phases['sessions'] = {'seconds': round(seconds, 3), 'sessions': len(session_ids)}
+
+    # 5. Reads
+    seconds = run_phase(args.concurrency, range(args.reads), lambda n: (
+        recorder.call('get_messages_page', backend.get_messages_page, 100),
+        recorder.call('get_transcript_queue_stats', backend.get_transcript_queue_stats),
+    ))
+    phases['reads'] = {'seconds': round(seconds, 3), 'reads_per_second': round(2 * args.reads / seconds, 1)}
+
+    return {
+        'backend': backend.__name__,
+        'segments': expected,
+        'phases': phases,
+        'total_seconds': round(sum(p['seconds'] for p in phases.values()), 3),
+        'operations': recorder.report(),
+        'pool': backend.get_pool_stats(),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark storage backends side by side")
+    parser.add_argument('--url', action='append', help="database URL to benchmark (repeatable)")
+    parser.add_argument('--requests', type=int, default=2000, help="webhook payloads to ingest")
+    parser.add_argument('--sessions', type=int, default=50)
+    parser.add_argument('--duplicate-rate', type=float, default=0.05)
+    parser.add_argument('--overlap-rate', type=float, default=0.2)
+    parser.add_argument('--activation-rate', type=float, default=0.05)
+    parser.add_argument('--concurrency', type=int, default=8, help="threads for ingest, outbox, sessions and reads")
+    parser.add_argument('--processors', type=int, default=4, help="threads claiming transcript batches")
+    parser.add_argument('--sessions-per-claim', type=int, default=4)
+    parser.add_argument('--reads', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help="write the JSON report here instead of stdout")
+    parser.add_argument('--single', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    urls = args.url or [os.getenv('DATABASE_URL') or 'sqlite:///bench_storage.db']
+
+    if args.single:
+        args.url = urls[0]
+        print(json.dumps(bench_backend(args), default=str))
+        return
+
+    results = {}
+    for url in urls:
+        # One subprocess per backend so pools and module state don't mix
+        argv = [sys.executable, os.path.abspath(__file__), '--single', '--url', url]
+        for name in ('requests', 'sessions', 'duplicate_rate', 'overlap_rate', 'activation_rate',
+                     'concurrency', 'processors', 'sessions_per_claim', 'reads', 'seed'):
+            argv += [f"--{name.replace('_', '-')}", str(getattr(args, name))]
+        completed = subprocess.run(argv, capture_output=True, text=True, env=dict(os.environ, LOG_LEVEL='WARNING'))
+        key = url.split('@')[-1]  # keep credentials out of the report
+        if completed.returncode != 0:
+            results[key] = {'error': completed.stderr.strip().splitlines()[-1:] or completed.returncode}
+            continue
+        results[key] = json.loads(completed.stdout.strip().splitlines()[-1])
+
+    report = {
+        'config': {name: getattr(args, name) for name in (
+            'requests', 'sessions', 'duplicate_rate', 'overlap_rate', 'activation_rate',
+            'concurrency', 'processors', 'sessions_per_claim', 'reads', 'seed')},
+        'backends': results,
+    }
+
+    # Side-by-side view of the phase timings
+    report['comparison'] = {
+        phase: {key: result['phases'][phase]['seconds'] for key, result in results.items() if 'phases' in result}
+        for phase in ('ingest', 'process', 'outbox', 'sessions', 'reads')
+    }
+
+    output = json.dumps(report, indent=2, default=str)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,601 @@
+"""
+Local stand-ins for the model API and Textbelt, for offline pipeline runs
+Used by dev/simulate_pipeline.py; run directly to keep both servers up for manual testing:
+    python dev/fake_services.py --openai-latency lognormal:800:0.4
+
+FakeOpenAI answers the parts of the OpenAI API the agent uses: the
+Responses API (plain JSON and SSE streaming, optionally with a
+send_text_message tool call and web search first) and the Conversations API
+backing OpenAIConversationsSession. FakeTextbelt answers POST /text.
+
+Both servers draw response times from a latency distribution and inject
+server errors and 429s at configurable rates. FakeOpenAI can also proxy to
+the real API and record responses (--record), then serve them back
+(--replay) so benchmark runs are deterministic without spending quota.
+
+Latency specs (milliseconds):
+    fixed:200  uniform:100:500  normal:300:50  lognormal:800:0.4 (median, sigma)  exp:250 (mean)
+"""
+
+import re
+import sys
+import json
+import math
+import time
+import uuid
+import random
+import hashlib
+import argparse
+import threading
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import Counter, defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Marker the simulator appends to activation segments; echoed in replies so texts can be matched to activations
+REF_RE = re.compile(r"\[?\(?ref (q\d+)\)?\]?")
+
+def parse_latency(spec):
+    """
+    Parse a latency spec into a sampler
+
+    Args:
+        spec (str): e.g. 'fixed:200', 'uniform:100:500', 'normal:300:50', 'lognormal:800:0.4', 'exp:250'
+
+    Returns:
+        callable: sampler(rng) -> seconds
+    """
+    kind, _, rest = spec.partition(':')
+    params = [float(p) for p in rest.split(':') if p]
+    if kind == 'fixed' and len(params) == 1:
+        return lambda rng: params[0] / 1000
+    if kind == 'uniform' and len(params) == 2:
+        return lambda rng: rng.uniform(params[0], params[1]) / 1000
+    if kind == 'normal' and len(params) == 2:
+        return lambda rng: max(0.0, rng.gauss(params[0], params[1])) / 1000
+    if kind == 'lognormal' and len(params) == 2:
+        mu = math.log(params[0])
+        return lambda rng: rng.lognormvariate(mu, params[1]) / 1000
+    if kind == 'exp' and len(params) == 1:
+        return lambda rng: rng.expovariate(1 / params[0]) / 1000
+    raise ValueError(f"Invalid latency spec: {spec}")
+
+class FaultProfile:
+    """Latency distribution plus error and 429 injection for one service"""
+
+    def __init__(self, latency='fixed:0', error_rate=0.0, rate_limit_rate=0.0, seed=None):
+        self._sample = parse_latency(latency)
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def latency(self):
+        with self._lock:
+            return self._sample(self._rng)
+
+    def fault(self):
+        """Return 429, 500 or None for the next request"""
+        with self._lock:
+            roll = self._rng.random()
+        if roll < self.rate_limit_rate:
+            return 429
+        if roll < self.rate_limit_rate + self.error_rate:
+            return 500
+        return None
+
+    def chance(self, rate):
+        with self._lock:
+            return self._rng.random() < rate
+
+class _Server:
+    """ThreadingHTTPServer on an ephemeral localhost port, run in a daemon thread"""
+
+    def __init__(self, handler_class, port=0):
+        handler = type(handler_class.__name__, (handler_class,), {'service': self})
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', port), handler)
+        self.httpd.daemon_threads = True
+        self.stats = Counter()
+        self._stats_lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address
+        return f"http://{host}:{port}"
+
+    def count(self, key, amount=1):
+        with self._stats_lock:
+            self.stats[key] += amount
+
+    def get_stats(self):
+        with self._stats_lock:
+            return dict(self.stats)
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    service = None
+
+    def log_message(self, format, *args):
+        pass  # Keep the simulator's output clean
+
+    def _body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length) if length else b''
+
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_fault(self, status):
+        if status == 429:
+            self.service.count('rate_limited')
+            self._send_json(429, {'error': {'message': "Rate limit reached (simulated)",
+                                            'type': 'rate_limit_error', 'code': 'rate_limit_exceeded'}},
+                            {'Retry-After': '1'})
+        else:
+            self.service.count('errors')
+            self._send_json(500, {'error': {'message': "Internal error (simulated)", 'type': 'server_error'}})
+
+def _new_id(prefix):
+    return f"{prefix}_{uuid.uuid4().hex[:24]}"
+
+def _text_of(content):
+    """Flatten a Responses API content field (string or list of parts) to text"""
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list):
+        return ' '.join(part.get('text', '') for part in content if isinstance(part, dict))
+    return ''
+
+def _last_user_turn(request):
+    """
+    Find the latest user message in a Responses API request
+
+    Returns:
+        tuple: (user text, number of tool outputs that follow it)
+    """
+    items = request.get('input')
+    if isinstance(items, str):
+        return items, 0
+    text, tool_outputs = '', 0
+    for item in items or []:
+        if not isinstance(item, dict):
+            continue
+        if item.get('role') == 'user':
+            text, tool_outputs = _text_of(item.get('content')), 0
+        elif item.get('type') == 'function_call_output':
+            tool_outputs += 1
+    return text, tool_outputs
+
+def recording_key(request):
+    """Key a request by its latest user turn (refs stripped), so replays match across runs"""
+    text, tool_outputs = _last_user_turn(request)
+    text = REF_RE.sub('', text).strip()
+    return hashlib.sha256(f"{tool_outputs}:{text}".encode()).hexdigest()[:32]
+
+class Recordings:
+    """
+    Recorded model responses, keyed by recording_key()
+
+    Several responses under one key are served in recorded order, then cycled.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self._responses = defaultdict(list)
+        self._cursor = Counter()
+        self._lock = threading.Lock()
+        if path:
+            try:
+                with open(path) as f:
+                    for line in f:
+                        if line.strip():
+                            entry = json.loads(line)
+                            self._responses[entry['key']].append(entry['response'])
+            except FileNotFoundError:
+                pass
+
+    def __len__(self):
+        return sum(len(v) for v in self._responses.values())
+
+    def get(self, key):
+        with self._lock:
+            responses = self._responses.get(key)
+            if not responses:
+                return None
+            response = responses[self._cursor[key] % len(responses)]
+            self._cursor[key] += 1
+            return json.loads(json.dumps(response))
+
+    def add(self, key, response):
+        with self._lock:
+            self._responses[key].append(response)
+            if self.path:
+                with open(self.path, 'a') as f:
+                    f.write(json.dumps({'key': key, 'response': response}) + "\n")
+
+def _usage(request, output_items):
+    input_tokens = max(1, len(json.dumps(request.get('input', ''))) // 4)
+    output_tokens = max(1, len(json.dumps(output_items)) // 4)
+    return {
+        'input_tokens': input_tokens,
+        'input_tokens_details': {'cached_tokens': 0},
+        'output_tokens': output_tokens,
+        'output_tokens_details': {'reasoning_tokens': 0},
+        'total_tokens': input_tokens + output_tokens,
+    }
+
+def _response_object(request, output_items, status='completed'):
+    return {
+        'id': _new_id('resp'),
+        'object': 'response',
+        'created_at': int(time.time()),
+        'status': status,
+        'model': request.get('model', 'fake-model'),
+        'output': output_items,
+        'parallel_tool_calls': True,
+        'tool_choice': 'auto',
+        'tools': [],
+        'error': None,
+        'incomplete_details': None,
+        'instructions': None,
+        'metadata': {},
+        'temperature': 1.0,
+        'top_p': 1.0,
+        'text': {'format': {'type': 'text'}},
+        'usage': _usage(request, output_items) if status == 'completed' else None,
+    }
+
+def _message_item(text):
+    return {
+        'type': 'message',
+        'id': _new_id('msg'),
+        'status': 'completed',
+        'role': 'assistant',
+        'content': [{'type': 'output_text', 'text': text, 'annotations': []}],
+    }
+
+class FakeOpenAIHandler(_Handler):
+
+    def do_POST(self):
+        path = urllib.parse.urlparse(self.path).path
+        body = self._body()
+        if self.service.upstream and path != '/v1/responses':
+            return self._proxy(body)
+        if path == '/v1/responses':
+            return self._responses(json.loads(body or b'{}'), body)
+        if path == '/v1/conversations':
+            return self._send_json(200, self.service.create_conversation())
+        match = re.fullmatch(r'/v1/conversations/([^/]+)/items', path)
+        if match:
+            items = json.loads(body or b'{}').get('items', [])
+            return self._send_json(200, self.service.add_items(match.group(1), items))
+        self._send_json(404, {'error': {'message': f"Unknown path {path}"}})
+
+    def do_GET(self):
+        path = urllib.parse.urlparse(self.path).path
+        if self.service.upstream:
+            return self._proxy(None)
+        match = re.fullmatch(r'/v1/conversations/([^/]+)/items', path)
+        if match:
+            query = urllib.parse.parse_qs(urllib.parse.urlparse(self.path).query)
+            limit = int(query.get('limit', ['100'])[0])
+            order = query.get('order', ['desc'])[0]
+            return self._send_json(200, self.service.list_items(match.group(1), limit, order))
+        match = re.fullmatch(r'/v1/conversations/([^/]+)', path)
+        if match:
+            return self._send_json(200, {'id': match.group(1), 'object': 'conversation',
+                                         'created_at': int(time.time()), 'metadata': {}})
+        self._send_json(404, {'error': {'message': f"Unknown path {path}"}})
+
+    def do_DELETE(self):
+        if self.service.upstream:
+            return self._proxy(None)
+        match = re.fullmatch(r'/v1/conversations/([^/]+)/items/([^/]+)', urllib.parse.urlparse(self.path).path)
+        if match:
+            self.service.delete_item(match.group(1), match.group(2))
+            return self._send_json(200, {'id': match.group(1), 'object': 'conversation'})
+        self._send_json(404, {'error': {'message': "Unknown path"}})
+
+    def _proxy(self, body, override=None):
+        """Forward a request to the real API (record mode)"""
+        url = self.service.upstream + self.path[len('/v1'):]
+        headers = {k: v for k, v in self.headers.items()
+                   if k.lower() in ('authorization', 'content-type', 'openai-organization', 'openai-project')}
+        data = json.dumps(override).encode() if override is not None else body
+        request = urllib.request.Request(url, data=data, headers=headers, method=self.command)
+        try:
+            with urllib.request.urlopen(request, timeout=120) as response:
+                status, payload = response.status, response.read()
+        except urllib.error.HTTPError as e:
+            status, payload = e.code, e.read()
+        if override is not None:
+            return status, payload
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _responses(self, request, raw_body):
+        service = self.service
+        service.count('requests')
+        stream = bool(request.get('stream'))
+        key = recording_key(request)
+        text, _ = _last_user_turn(request)
+        refs = sorted(set(REF_RE.findall(text)))
+
+        if service.upstream:
+            # Record: ask upstream for the whole response at once, then serve it in the requested shape
+            status, payload = self._proxy(raw_body, dict(request, stream=False))
+            if status != 200:
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+                return
+            response = json.loads(payload)
+            service.recordings.add(key, response)
+            service.count('recorded')
+            output = response.get('output', [])
+            return self._send_output(request, output, stream, response=response)
+
+        fault = service.faults.fault()
+        time.sleep(service.faults.latency() * (0.3 if stream else 1.0))
+        if fault:
+            return self._send_fault(fault)
+
+        recorded = service.recordings.get(key) if service.recordings is not None else None
+        if recorded is not None:
+            service.count('replayed')
+            output = recorded.get('output', [])
+        else:
+            if service.recordings is not None:
+                service.count('replay_misses')
+            output = service.synthesize(request, refs)
+
+        # Echo the activation refs so the simulator can match texts to activations
+        if refs:
+            for item in output:
+                if item.get('type') == 'message':
+                    for part in item.get('content', []):
+                        if part.get('type') == 'output_text' and not REF_RE.search(part.get('text', '')):
+                            part['text'] = part.get('text', '') + ' ' + ' '.join(f"[ref {r}]" for r in refs)
+
+        self._send_output(request, output, stream)
+
+    def _send_output(self, request, output, stream, response=None):
+        if not stream:
+            response = response or _response_object(request, output)
+            response['output'] = output
+            return self._send_json(200, response)
+        self._stream(request, output)
+
+    def _stream(self, request, output):
+        """Send output items as a Responses API SSE stream"""
+        service = self.service
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+        sequence = 0
+
+        def emit(event):
+            nonlocal sequence
+            event['sequence_number'] = sequence
+            sequence += 1
+            self.wfile.write(f"event: {event['type']}\ndata: {json.dumps(event)}\n\n".encode())
+            self.wfile.flush()
+
+        emit({'type': 'response.created', 'response': _response_object(request, [], 'in_progress')})
+        emit({'type': 'response.in_progress', 'response': _response_object(request, [], 'in_progress')})
+
+        for index, item in enumerate(output):
+            kind = item.get('type')
+            if kind == 'message':
+                emit({'type': 'response.output_item.added', 'output_index': index,
+                      'item': dict(item, status='in_progress', content=[])})
+                for content_index, part in enumerate(item.get('content', [])):
+                    text = part.get('text', '')
+                    emit({'type': 'response.content_part.added', 'item_id': item['id'], 'output_index': index,
+                          'content_index': content_index, 'part': dict(part, text='')})
+                    words = re.findall(r'\S+\s*', text) or ['']
+                    delay = service.faults.latency() * 0.7 / len(words)
+                    for word in words:
+                        time.sleep(delay)
+                        emit({'type': 'response.output_text.delta', 'item_id': item['id'], 'output_index': index,
+                              'content_index': content_index, 'delta': word, 'logprobs': []})
+                    emit({'type': 'response.output_text.done', 'item_id': item['id'], 'output_index': index,
+                          'content_index': content_index, 'text': text, 'logprobs': []})
+                    emit({'type': 'response.content_part.done', 'item_id': item['id'], 'output_index': index,
+                          'content_index': content_index, 'part': part})
+            elif kind == 'web_search_call':
+                emit({'type': 'response.output_item.added', 'output_index': index,
+                      'item': dict(item, status='in_progress')})
+                emit({'type': 'response.web_search_call.in_progress', 'item_id': item['id'], 'output_index': index})
+                emit({'type': 'response.web_search_call.searching', 'item_id': item['id'], 'output_index': index})
+                time.sleep(service.web_search_latency())
+                emit({'type': 'response.web_search_call.completed', 'item_id': item['id'], 'output_index': index})
+            elif kind == 'function_call':
+                emit({'type': 'response.output_item.added', 'output_index': index,
+                      'item': dict(item, arguments='', status='in_progress')})
+                emit({'type': 'response.function_call_arguments.delta', 'item_id': item['id'],
+                      'output_index': index, 'delta': item['arguments']})
+                emit({'type': 'response.function_call_arguments.done', 'item_id': item['id'],
+                      'output_index': index, 'arguments': item['arguments']})
+            else:
+                emit({'type': 'response.output_item.added', 'output_index': index, 'item': item})
+            emit({'type': 'response.output_item.done', 'output_index': index, 'item': item})
+
+        emit({'type': 'response.completed', 'response': _response_object(request, output)})
+
+class FakeOpenAI(_Server):
+    """
+    Stand-in for the OpenAI Responses and Conversations APIs
+
+    Args:
+        faults (FaultProfile): Latency and error injection for /v1/responses
+        tool_rate (float): Fraction of turns that first call send_text_message
+        web_search_rate (float): Fraction of turns that include a web search
+        web_search_latency (str): Latency spec added for each web search
+        recordings (Recordings, optional): Responses to replay (or record into)
+        upstream (str, optional): Real API base URL; proxies and records instead of faking
+    """
+
+    def __init__(self, faults=None, tool_rate=0.0, web_search_rate=0.0, web_search_latency='fixed:0',
+                 recordings=None, upstream=None, seed=None, port=0):
+        super().__init__(FakeOpenAIHandler, port)
+        self.faults = faults or FaultProfile(seed=seed)
+        self.tool_rate = tool_rate
+        self.web_search_rate = web_search_rate
+        self._web_search_sample = parse_latency(web_search_latency)
+        self._rng = random.Random(seed)
+        self._rng_lock = threading.Lock()
+        self.recordings = recordings
+        self.upstream = upstream.rstrip('/') if upstream else None
+        self._conversations = defaultdict(list)
+        self._conversations_lock = threading.Lock()
+
+    def web_search_latency(self):
+        with self._rng_lock:
+            return self._web_search_sample(self._rng)
+
+    def synthesize(self, request, refs):
+        """Build output items for a turn: optional tool call first, then web search and a reply"""
+        text, tool_outputs = _last_user_turn(request)
+        tools = {t.get('name') for t in request.get('tools') or [] if isinstance(t, dict)}
+        output = []
+
+        if tool_outputs == 0 and 'send_text_message' in tools and self.faults.chance(self.tool_rate):
+            self.count('tool_calls')
+            return [{
+                'type': 'function_call', 'id': _new_id('fc'), 'call_id': _new_id('call'),
+                'name': 'send_text_message', 'status': 'completed',
+                'arguments': json.dumps({'message': "On it, one sec " + ' '.join(f"[ref {r}]" for r in refs)}),
+            }]
+
+        if self.faults.chance(self.web_search_rate):
+            self.count('web_searches')
+            if not request.get('stream'):
+                time.sleep(self.web_search_latency())
+            output.append({'type': 'web_search_call', 'id': _new_id('ws'), 'status': 'completed',
+                           'action': {'type': 'search', 'query': text[-80:]}})
+
+        output.append(_message_item("Sure thing. Here's what I found: it's 72 and sunny, light wind."))
+        return output
+
+    def create_conversation(self):
+        conversation_id = _new_id('conv')
+        with self._conversations_lock:
+            self._conversations[conversation_id] = []
+        self.count('conversations')
+        return {'id': conversation_id, 'object': 'conversation', 'created_at': int(time.time()), 'metadata': {}}
+
+    def add_items(self, conversation_id, items):
+        stored = []
+        for item in items:
+            item = dict(item)
+            item.setdefault('id', _new_id('item'))
+            item.setdefault('type', 'message')
+            stored.append(item)
+        with self._conversations_lock:
+            self._conversations[conversation_id].extend(stored)
+        return {'object': 'list', 'data': stored, 'first_id': stored[0]['id'] if stored else None,
+                'last_id': stored[-1]['id'] if stored else None, 'has_more': False}
+
+    def list_items(self, conversation_id, limit, order):
+        with self._conversations_lock:
+            items = list(self._conversations.get(conversation_id, []))
+        if order == 'desc':
+            items.reverse()
+        items = items[:limit]
+        return {'object': 'list', 'data': items, 'first_id': items[0]['id'] if items else None,
+                'last_id': items[-1]['id'] if items else None, 'has_more': False}
+
+    def delete_item(self, conversation_id, item_id):
+        with self._conversations_lock:
+            items = self._conversations.get(conversation_id, [])
+            self._conversations[conversation_id] = [i for i in items if i.get('id') != item_id]
+
+class FakeTextbeltHandler(_Handler):
+
+    def do_POST(self):
+        service = self.service
+        if urllib.parse.urlparse(self.path).path != '/text':
+            return self._send_json(404, {'success': False, 'error': "Unknown path"})
+
+        form = urllib.parse.parse_qs(self._body().decode())
+        message = form.get('message', [''])[0]
+        service.count('requests')
+
+        fault = service.faults.fault()
+        time.sleep(service.faults.latency())
+        if fault:
+            return self._send_fault(fault)
+        if service.faults.chance(service.reject_rate):
+            service.count('rejected')
+            return self._send_json(200, {'success': False, 'error': "Out of quota (simulated)", 'quotaRemaining': 0})
+
+        service.count('sent')
+        if service.on_text is not None:
+            service.on_text(message, time.monotonic())
+        self._send_json(200, {'success': True, 'textId': uuid.uuid4().hex[:12], 'quotaRemaining': 9999})
+
+class FakeTextbelt(_Server):
+    """
+    Stand-in for Textbelt's POST /text
+
+    Args:
+        faults (FaultProfile): Latency and error injection
+        reject_rate (float): Fraction of texts answered with success=false
+        on_text (callable, optional): Called with (message, monotonic receive time) for each accepted text
+    """
+
+    def __init__(self, faults=None, reject_rate=0.0, on_text=None, seed=None, port=0):
+        super().__init__(FakeTextbeltHandler, port)
+        self.faults = faults or FaultProfile(seed=seed)
+        self.reject_rate = reject_rate
+        self.on_text = on_text
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the fake model API and Textbelt servers")
+    parser.add_argument('--openai-port', type=int, default=8801)
+    parser.add_argument('--textbelt-port', type=int, default=8802)
+    parser.add_argument('--openai-latency', default='lognormal:800:0.4')
+    parser.add_argument('--sms-latency', default='lognormal:300:0.3')
+    parser.add_argument('--tool-rate', type=float, default=0.2)
+    parser.add_argument('--web-search-rate', type=float, default=0.3)
+    args = parser.parse_args()
+
+    openai_server = FakeOpenAI(FaultProfile(args.openai_latency), args.tool_rate, args.web_search_rate,
+                               port=args.openai_port).start()
+    textbelt_server = FakeTextbelt(FaultProfile(args.sms_latency), port=args.textbelt_port).start()
+    print(f"OPENAI_BASE_URL={openai_server.url}/v1")
+    print(f"TEXTBELT_BASE_URL={textbelt_server.url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        sys.exit(0)
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,15 @@
 """
 Simple database reset script
-Deletes all data from transcripts and messages tables
+Deletes all data from transcripts, messages, sms_outbox and traces tables
 """
 
 import os
 import sys
 
-# Add parent directory to path so we can import db
+# Add parent directory to path so we can import storage
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-import db
+import storage
 
 def reset_database():
     """Reset the database by truncating all tables"""
@@ -17,8 +17,10 @@ def reset_database():
     print("DATABASE RESET SCRIPT")
     print("="*60)
     print("\nThis will DELETE ALL DATA from:")
-    print("  - transcripts table")
+    print("  - transcripts table (and its segment id registry)")
     print("  - messages table")
+    print("  - sms_outbox table")
+    print("  - traces table")
     print("\nThis action CANNOT be undone!")
     print("="*60)
     
@@ -31,14 +33,20 @@ def reset_database():
     
     try:
         # Connect to database
-        conn = db.get_connection()
+        backend = storage.get()
+        conn = backend.get_connection()
         cursor = conn.cursor()
         
         print("\nResetting database...")
         
-        # Truncate tables and reset auto-increment counters
-        # CASCADE removes dependent data
-        cursor.execute("TRUNCATE TABLE transcripts, messages RESTART IDENTITY CASCADE;")
+        if backend.__name__ == 'db_sqlite':
+            # Children first for the foreign keys; rowids restart at 1 once a table is empty
+            for table in ('traces', 'sms_outbox', 'transcripts', 'messages'):
+                cursor.execute(f"DELETE FROM {table}")
+        else:
+            # Truncate tables and reset auto-increment counters
+            # CASCADE removes dependent data
+            cursor.execute("TRUNCATE TABLE transcripts, transcript_segment_ids, messages, sms_outbox, traces RESTART IDENTITY CASCADE;")
         
         conn.commit()
         cursor.close()
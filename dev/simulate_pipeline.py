@@ -0,0 +1,380 @@
+"""
+Offline end-to-end pipeline simulation: webhook -> processor -> agent -> SMS
+Run from project root: python dev/simulate_pipeline.py [options] > result.json
+
+Starts the fake model API and Textbelt servers (dev/fake_services.py), points
+the app at them and runs it in-process against DATABASE_URL (use a local
+Postgres). Recorded transcript sessions are then replayed through the webhook
+with their original pacing, several sessions at a time.
+
+Each activation segment gets a "(ref qN)" marker that the fake model echoes
+in its replies, so every text that reaches the fake Textbelt is matched to
+the activation that caused it. The JSON report has activation-to-first-SMS
+latency percentiles, sustained throughput, fake server counters (including
+injected errors and 429s) and the app's own /stats and /traces/stats.
+
+Sessions come from --sessions-file (JSONL, one webhook payload per line:
+{"session_id", "segments", optional "offset" seconds since the session's
+first payload}), exported from a database with --export-sessions, or are
+synthesized.
+
+For deterministic runs, record real agent responses once with
+--record responses.jsonl (needs a real OPENAI_API_KEY; texts still go to the
+fake Textbelt), then replay them with --replay responses.jsonl.
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import argparse
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+# Add parent directory to path so we can import modules
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import activation
+from bench_ingest import InProcessClient, make_payloads, summarize
+from fake_services import REF_RE, FakeOpenAI, FakeTextbelt, FaultProfile, Recordings
+
+def load_sessions(path):
+    """
+    Load recorded webhook payloads grouped by session
+
+    Args:
+        path (str): JSONL file, one payload per line
+
+    Returns:
+        list: One list of (offset seconds, payload) per session, in order
+    """
+    sessions = defaultdict(list)
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                payload = json.loads(line)
+                sessions[payload.get('session_id', 'unknown')].append(payload)
+
+    result = []
+    for payloads in sessions.values():
+        result.append([(float(p.pop('offset', i)), p) for i, p in enumerate(payloads)])
+    return result
+
+def export_sessions(path, limit):
+    """
+    Export the most recent sessions from the transcripts table as replayable payloads
+
+    Segments stored in one transaction (one webhook request in sync ingest
+    mode) share a received_at and become one payload.
+
+    Args:
+        path (str): JSONL file to write
+        limit (int): Number of sessions to export
+
+    Returns:
+        int: Number of payloads written
+    """
+    import db
+    conn = db.get_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT session_id, received_at, segment_id, text, speaker, speaker_id, is_user, start_time, end_time
+            FROM transcripts
+            WHERE session_id IN (
+                SELECT session_id FROM transcripts
+                WHERE session_id IS NOT NULL
+                GROUP BY session_id
+                ORDER BY MAX(received_at) DESC
+                LIMIT %s
+            )
+            ORDER BY session_id, received_at, start_time, id
+        """, (limit,))
+        rows = cursor.fetchall()
+        cursor.close()
+    finally:
+        conn.close()
+
+    payloads = []
+    first_seen = {}
+    for session_id, received_at, segment_id, text, speaker, speaker_id, is_user, start, end in rows:
+        first_seen.setdefault(session_id, received_at)
+        if not payloads or payloads[-1][0] != (session_id, received_at):
+            payloads.append(((session_id, received_at), {
+                'session_id': session_id,
+                'offset': (received_at - first_seen[session_id]).total_seconds(),
+                'segments': [],
+            }))
+        payloads[-1][1]['segments'].append({
+            'id': segment_id, 'text': text, 'speaker': speaker, 'speaker_id': speaker_id,
+            'is_user': is_user, 'start': start, 'end': end,
+        })
+
+    with open(path, 'w') as f:
+        for _, payload in payloads:
+            f.write(json.dumps(payload) + "\n")
+    return len(payloads)
+
+def synthesize_sessions(sessions, payloads_per_session, interval, activation_rate, seed):
+    """Generate sessions with one payload every interval seconds"""
+    payloads, _ = make_payloads(
+        sessions * payloads_per_session, sessions=sessions, duplicate_rate=0.0, overlap_rate=0.0,
+        activation_rate=activation_rate, seed=seed
+    )
+    grouped = defaultdict(list)
+    for payload in payloads:
+        grouped[payload['session_id']].append(payload)
+    return [[(i * interval, p) for i, p in enumerate(group)] for group in grouped.values()]
+
+class Simulation:
+    """Replays sessions through the webhook and matches texts back to activations"""
+
+    def __init__(self, client, speed=1.0):
+        self.client = client
+        self.speed = speed
+        self.posted = {}    # ref -> monotonic time its payload was posted
+        self.answered = {}  # ref -> monotonic time the first text carrying it arrived
+        self.texts = 0
+        self.webhook_statuses = defaultdict(int)
+        self._lock = threading.Lock()
+        self._next_ref = 0
+
+    def prepare(self, sessions, repeat):
+        """
+        Copy sessions with fresh ids and tag activation segments with refs
+
+        Returns:
+            list: Sessions ready to replay
+        """
+        run_id = uuid.uuid4().hex[:6]
+        matcher = activation.ActivationMatcher()
+        prepared = []
+        for copy in range(repeat):
+            for index, session in enumerate(sessions):
+                session_id = f"sim-{run_id}-{copy}-{index}"
+                replay = []
+                for offset, payload in session:
+                    segments = [
+                        dict(s, id=f"{session_id}-{s.get('id', n)}-{offset}")
+                        for n, s in enumerate(payload.get('segments') or payload.get('transcript_segments') or [])
+                    ]
+                    refs = []
+                    for match in matcher.scan(segments, session_id):
+                        self._next_ref += 1
+                        ref = f"q{self._next_ref}"
+                        segment = segments[match.segment_index]
+                        segment['text'] = f"{segment.get('text', '')} (ref {ref})"
+                        refs.append(ref)
+                    replay.append((offset, {'session_id': session_id, 'segments': segments}, refs))
+                prepared.append(replay)
+        return prepared
+
+    def on_text(self, message, received_at):
+        """Fake Textbelt callback"""
+        with self._lock:
+            self.texts += 1
+            for ref in REF_RE.findall(message):
+                self.answered.setdefault(ref, received_at)
+
+    def replay(self, session):
+        """Post one session's payloads with their original pacing"""
+        started = time.monotonic()
+        for offset, payload, refs in session:
+            delay = started + offset / self.speed - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            posted_at = time.monotonic()
+            with self._lock:
+                for ref in refs:
+                    self.posted[ref] = posted_at
+            status, _ = self.client.post('/webhook', payload)
+            with self._lock:
+                self.webhook_statuses[status] += 1
+
+    def wait_for_answers(self, timeout):
+        """Wait until every posted activation has been texted, or timeout"""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with self._lock:
+                if set(self.posted) <= set(self.answered):
+                    return True
+            time.sleep(0.1)
+        return False
+
+    def wait_for_backlog(self, timeout):
+        """Wait until the processor has no activations left to handle, or timeout"""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            queue = json.loads(self.client.get_text('/stats')).get('transcripts') or {}
+            if not queue.get('pending_activations') and not queue.get('claimed'):
+                return True
+            time.sleep(0.5)
+        return False
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline end-to-end pipeline simulation")
+    parser.add_argument('--sessions-file', help="JSONL of recorded webhook payloads")
+    parser.add_argument('--export-sessions', metavar='PATH',
+                        help="export recent sessions from DATABASE_URL to PATH and exit")
+    parser.add_argument('--export-limit', type=int, default=20, help="sessions to export")
+    parser.add_argument('--synthetic-sessions', type=int, default=20)
+    parser.add_argument('--synthetic-payloads', type=int, default=10, help="payloads per synthetic session")
+    parser.add_argument('--synthetic-interval', type=float, default=2.0, help="seconds between synthetic payloads")
+    parser.add_argument('--activation-rate', type=float, default=0.05, help="synthetic segments with an activation")
+    parser.add_argument('--repeat', type=int, default=1, help="replay the session set this many times")
+    parser.add_argument('--speed', type=float, default=1.0, help="replay speed-up factor")
+    parser.add_argument('--concurrency', type=int, default=8,
+                        help="sessions replayed at once; also AGENT_CONCURRENCY / PROCESSOR_CONCURRENCY")
+    parser.add_argument('--stream', action='store_true', help="run with STREAM_RESPONSES=true")
+    parser.add_argument('--openai-latency', default='lognormal:1500:0.5')
+    parser.add_argument('--openai-error-rate', type=float, default=0.0)
+    parser.add_argument('--openai-429-rate', type=float, default=0.0)
+    parser.add_argument('--tool-rate', type=float, default=0.2, help="turns that text an update via the tool first")
+    parser.add_argument('--web-search-rate', type=float, default=0.3)
+    parser.add_argument('--web-search-latency', default='lognormal:2000:0.5')
+    parser.add_argument('--sms-latency', default='lognormal:400:0.3')
+    parser.add_argument('--sms-error-rate', type=float, default=0.0)
+    parser.add_argument('--sms-429-rate', type=float, default=0.0)
+    parser.add_argument('--sms-reject-rate', type=float, default=0.0)
+    parser.add_argument('--record', metavar='PATH', help="proxy to the real model API and record responses")
+    parser.add_argument('--replay', metavar='PATH', help="serve recorded model responses")
+    parser.add_argument('--upstream', default='https://api.openai.com/v1', help="real API for --record")
+    parser.add_argument('--drain-timeout', type=float, default=120, help="seconds to wait for outstanding texts")
+    parser.add_argument('--max-p99-ms', type=float, help="fail if activation-to-SMS p99 exceeds this")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help="write the JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    if args.export_sessions:
+        count = export_sessions(args.export_sessions, args.export_limit)
+        print(f"Exported {count} payloads to {args.export_sessions}")
+        return
+
+    if args.sessions_file:
+        sessions = load_sessions(args.sessions_file)
+    else:
+        sessions = synthesize_sessions(args.synthetic_sessions, args.synthetic_payloads,
+                                       args.synthetic_interval, args.activation_rate, args.seed)
+
+    recordings = Recordings(args.record or args.replay) if (args.record or args.replay) else None
+    openai_server = FakeOpenAI(
+        FaultProfile(args.openai_latency, args.openai_error_rate, args.openai_429_rate, args.seed),
+        tool_rate=args.tool_rate, web_search_rate=args.web_search_rate,
+        web_search_latency=args.web_search_latency, recordings=recordings,
+        upstream=args.upstream if args.record else None, seed=args.seed
+    ).start()
+    textbelt_server = FakeTextbelt(
+        FaultProfile(args.sms_latency, args.sms_error_rate, args.sms_429_rate, args.seed + 1),
+        reject_rate=args.sms_reject_rate
+    ).start()
+
+    # Point the app at the stand-ins; must happen before it is imported
+    os.environ['OPENAI_BASE_URL'] = f"{openai_server.url}/v1"
+    os.environ['TEXTBELT_BASE_URL'] = textbelt_server.url
+    os.environ['TEXTBELT_API_KEY'] = 'simulated'
+    os.environ['OPENAI_AGENTS_DISABLE_TRACING'] = '1'
+    if not args.record:
+        os.environ['OPENAI_API_KEY'] = 'sk-simulated'
+    os.environ.setdefault('PHONE_NUMBER', '5555550100')
+    os.environ.setdefault('AGENT_CONCURRENCY', str(args.concurrency))
+    os.environ.setdefault('PROCESSOR_CONCURRENCY', str(args.concurrency))
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+    if args.stream:
+        os.environ['STREAM_RESPONSES'] = 'true'
+
+    simulation = Simulation(InProcessClient(), args.speed)
+    textbelt_server.on_text = simulation.on_text
+    replays = simulation.prepare(sessions, args.repeat)
+
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        list(executor.map(simulation.replay, replays))
+    replay_seconds = time.monotonic() - started
+
+    # Real replies don't echo refs, so in record mode wait on the processor instead
+    if args.record:
+        drained = simulation.wait_for_backlog(args.drain_timeout)
+    else:
+        drained = simulation.wait_for_answers(args.drain_timeout)
+    finished = time.monotonic()
+
+    with simulation._lock:
+        posted = dict(simulation.posted)
+        answered = dict(simulation.answered)
+        texts = simulation.texts
+    latencies = [(answered[ref] - posted[ref]) * 1000 for ref in posted if ref in answered]
+    last_answer = max(answered.values(), default=finished)
+    busy_seconds = max(last_answer - started, 1e-9)
+
+    app_stats = json.loads(simulation.client.get_text('/stats'))
+    trace_stats = json.loads(simulation.client.get_text(f"/traces/stats?window={int(finished - started) + 60}"))
+
+    report = {
+        'config': {
+            'sessions': len(replays),
+            'payloads': sum(len(r) for r in replays),
+            'concurrency': args.concurrency,
+            'speed': args.speed,
+            'stream': args.stream,
+            'openai_latency': args.openai_latency,
+            'openai_error_rate': args.openai_error_rate,
+            'openai_429_rate': args.openai_429_rate,
+            'tool_rate': args.tool_rate,
+            'web_search_rate': args.web_search_rate,
+            'sms_latency': args.sms_latency,
+            'sms_error_rate': args.sms_error_rate,
+            'sms_429_rate': args.sms_429_rate,
+            'mode': 'record' if args.record else 'replay' if args.replay else 'synthetic',
+        },
+        'replay_seconds': round(replay_seconds, 3),
+        'drained': drained,
+        'activations': {
+            'posted': len(posted),
+            'answered': len(latencies),
+            'unanswered': len(posted) - len(latencies),
+        },
+        # Webhook post of the activating payload -> first text carrying its ref at Textbelt
+        'activation_to_sms': summarize(latencies),
+        'throughput': {
+            'activations_per_second': round(len(latencies) / busy_seconds, 3),
+            'texts_per_second': round(texts / busy_seconds, 3),
+            'webhooks_per_second': round(sum(simulation.webhook_statuses.values()) / replay_seconds, 2)
+            if replay_seconds else None,
+        },
+        'webhook_statuses': {str(k): v for k, v in sorted(simulation.webhook_statuses.items())},
+        'fake_openai': openai_server.get_stats(),
+        'fake_textbelt': textbelt_server.get_stats(),
+        'app': {key: app_stats.get(key) for key in ('agent', 'sms', 'sms_outbox', 'transcripts')},
+        # Agent run start -> first streamed chunk, against the whole run
+        'first_text': {
+            'avg_ms': app_stats['agent']['first_text_avg_ms'],
+            'run_avg_ms': app_stats['agent']['latency_avg_ms'],
+            'share_of_run': round(app_stats['agent']['first_text_avg_ms'] / app_stats['agent']['latency_avg_ms'], 3)
+            if app_stats['agent']['latency_avg_ms'] else None,
+        } if args.stream else None,
+        'traces': trace_stats,
+    }
+
+    failures = []
+    if report['activations']['unanswered'] and not args.record:
+        failures.append(f"{report['activations']['unanswered']} activations never texted")
+    if args.max_p99_ms is not None and (report['activation_to_sms']['p99_ms'] or 0) > args.max_p99_ms:
+        failures.append(f"p99 {report['activation_to_sms']['p99_ms']} ms > {args.max_p99_ms} ms")
+    report['passed'] = not failures
+    report['failures'] = failures
+
+    output = json.dumps(report, indent=2, default=str)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+    openai_server.stop()
+    textbelt_server.stop()
+    sys.exit(0 if report['passed'] else 1)
+
+if __name__ == "__main__":
+    main()
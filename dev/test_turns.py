@@ -0,0 +1,85 @@
+"""
+Tests for turn assembly across batches
+Run from project root: python -m pytest dev/test_turns.py
+"""
+
+import sys
+import os
+
+# Add parent directory to path so we can import modules
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import context_builder
+import turns
+
+def segment(id, text, start, end, speaker='A', activation=False):
+    return {
+        'id': id,
+        'segment_id': f"seg-{id}",
+        'speaker': speaker,
+        'text': text,
+        'start_time': start,
+        'end_time': end,
+        'activation': activation,
+    }
+
+FIRST = [segment(1, "hey jarvis whats the weather today", 0.0, 3.0, activation=True)]
+SECOND = [
+    segment(2, "the weather today", 1.5, 3.0),
+    segment(3, "hey jarvis set a timer", 4.0, 6.0, activation=True),
+]
+
+def test_resent_fragment_does_not_bring_back_answered_turn():
+    context_builder.build_prompt('fragment', FIRST)
+    prompt = context_builder.build_prompt('fragment', SECOND)
+
+    assert prompt == "A: hey jarvis set a timer"
+
+def test_retried_batch_with_resent_fragment():
+    assembler = turns.TurnAssembler()
+    assembler.add(FIRST)
+    assembler.add(SECOND)
+    view = assembler.add(SECOND)
+
+    assert [(t['text'], t['activation']) for t in view] == [("hey jarvis set a timer", True)]
+
+def test_retried_batch_keeps_its_activation():
+    assembler = turns.TurnAssembler()
+    assembler.add(FIRST)
+    view = assembler.add(FIRST)
+
+    assert [(t['text'], t['activation']) for t in view] == [("hey jarvis whats the weather today", True)]
+
+def test_extension_in_later_batch_is_shown():
+    assembler = turns.TurnAssembler()
+    assembler.add([segment(1, "hey jarvis whats the", 0.0, 1.5, activation=True)])
+    view = assembler.add([segment(2, "hey jarvis whats the weather", 0.0, 2.5, activation=True)])
+
+    assert [(t['text'], t['activation']) for t in view] == [("hey jarvis whats the weather", True)]
+
+def test_touching_segments_are_not_collapsed():
+    view = turns.TurnAssembler().add([
+        segment(1, "no", 0.0, 0.5),
+        segment(2, "no", 0.5, 1.0),
+    ])
+
+    assert [t['text'] for t in view] == ["no no"]
+
+def test_overlapping_fragment_is_collapsed():
+    view = turns.TurnAssembler().add([
+        segment(1, "whats the weather", 0.0, 2.0),
+        segment(2, "the weather", 0.5, 2.0),
+    ])
+
+    assert [t['text'] for t in view] == ["whats the weather"]
+
+def test_summary_keeps_rows_committed_out_of_order():
+    later = segment(9, "the quarterly budget review moved to thursday", 10.0, 12.0, speaker='B')
+    earlier = segment(4, "marketing launch planning needs another designer", 4.0, 6.0, speaker='C')
+    context_builder.absorb('out-of-order', [later])
+    context_builder.absorb('out-of-order', [earlier])
+    context_builder.absorb('out-of-order', [earlier])
+
+    summary = context_builder._get_summary('out-of-order').render()
+    assert summary.count("marketing launch planning") == 1
+    assert "quarterly budget review" in summary
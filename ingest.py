@@ -0,0 +1,251 @@
+"""
+Asynchronous ingest queue for webhook transcript segments
+
+In async mode the webhook validates the payload, pushes its segments onto a
+bounded in-process queue and acks immediately. A single writer thread drains
+the queue and group-commits segments from many webhook requests in one
+transaction, so a slow database no longer turns into slow webhooks.
+
+Segments are acked before they are stored, so the writer never gives up on
+a batch while the app is running: it keeps retrying the commit and the
+queue fills up behind it, which turns a database outage into 503s instead
+of lost transcripts. Only at shutdown is a batch dropped after
+MAX_COMMIT_ATTEMPTS, and dropped segments are counted in /stats and
+/metrics.
+"""
+
+import os
+import time
+import queue
+import atexit
+import threading
+import log
+import storage
+import metrics
+import seen_segments
+
+# Configuration
+INGEST_MODE = os.getenv('INGEST_MODE', 'sync').lower()  # 'sync' or 'async'
+QUEUE_MAX_SIZE = int(os.getenv('INGEST_QUEUE_MAX_SIZE', '1000'))  # webhook payloads
+MAX_BATCH_SEGMENTS = int(os.getenv('INGEST_MAX_BATCH_SEGMENTS', '500'))
+BATCH_LINGER = float(os.getenv('INGEST_BATCH_LINGER', '0.05'))  # seconds to wait for more payloads
+MAX_COMMIT_ATTEMPTS = int(os.getenv('INGEST_MAX_COMMIT_ATTEMPTS', '5'))  # per batch once shutting down
+MAX_RETRY_DELAY = 10  # seconds between commit attempts at most
+RETRY_AFTER = int(os.getenv('INGEST_RETRY_AFTER', '5'))  # seconds, sent to clients when the queue is full
+
+RUNNING = False
+
+logger = log.get_logger('ingest')
+
+_queue = queue.Queue(maxsize=QUEUE_MAX_SIZE)
+_writer_thread = None
+_stats_lock = threading.Lock()
+_stats = {
+    'enqueued_payloads': 0,
+    'rejected_payloads': 0,
+    'processed_payloads': 0,
+    'commits': 0,
+    'failed_commits': 0,
+    'dropped_segments': 0,
+    'segments_committed': 0,
+    'segments_inserted': 0,
+    'segments_duplicate': 0,
+    'last_batch_size': 0,
+    'max_batch_size': 0,
+    'queue_wait_max_ms': 0.0,
+    'queue_wait_total_ms': 0.0,
+}
+
+def is_enabled():
+    """
+    Check whether webhook ingestion should go through the queue
+
+    Returns:
+        bool: True if INGEST_MODE is 'async'
+    """
+    return INGEST_MODE == 'async'
+
+def submit(segments):
+    """
+    Enqueue a webhook payload's segments for the writer thread
+
+    Args:
+        segments (list): Segment dicts, each already carrying its session_id
+
+    Returns:
+        bool: True if queued, False if the queue is full (caller should ask the client to retry)
+    """
+    try:
+        _queue.put_nowait((segments, time.monotonic()))
+    except queue.Full:
+        with _stats_lock:
+            _stats['rejected_payloads'] += 1
+        return False
+
+    with _stats_lock:
+        _stats['enqueued_payloads'] += 1
+    return True
+
+def _drain_batch():
+    """
+    Collect queued payloads into one batch
+
+    Blocks briefly for the first payload, then keeps pulling for up to
+    BATCH_LINGER seconds or until MAX_BATCH_SEGMENTS is reached.
+
+    Returns:
+        list: List of (segments, enqueued_at) tuples, possibly empty
+    """
+    try:
+        first = _queue.get(timeout=1.0)
+    except queue.Empty:
+        return []
+
+    batch = [first]
+    segment_count = len(first[0])
+    deadline = time.monotonic() + BATCH_LINGER
+
+    while segment_count < MAX_BATCH_SEGMENTS:
+        remaining = deadline - time.monotonic()
+        try:
+            if remaining > 0:
+                item = _queue.get(timeout=remaining)
+            else:
+                item = _queue.get_nowait()
+        except queue.Empty:
+            break
+        batch.append(item)
+        segment_count += len(item[0])
+
+    return batch
+
+def _commit_batch(batch):
+    """
+    Group-commit a batch of payloads, retrying with backoff on failure
+
+    Retries until the commit succeeds while the writer is running; after
+    stop_writer() the batch is dropped after MAX_COMMIT_ATTEMPTS.
+
+    Args:
+        batch (list): List of (segments, enqueued_at) tuples
+    """
+    segments = [segment for payload, _ in batch for segment in payload]
+
+    attempt = 0
+    while True:
+        attempt += 1
+        result = storage.get().save_transcript_segments(segments)
+        if result is not None:
+            break
+        with _stats_lock:
+            _stats['failed_commits'] += 1
+        if not RUNNING and attempt >= MAX_COMMIT_ATTEMPTS:
+            break
+        if attempt == 1:
+            logger.warning('ingest.commit_retrying', count=len(segments), queue_depth=_queue.qsize())
+        # Inserts are idempotent (ON CONFLICT DO NOTHING), so retrying is safe
+        time.sleep(min(0.5 * 2 ** (attempt - 1), MAX_RETRY_DELAY))
+
+    now = time.monotonic()
+    with _stats_lock:
+        if result is None:
+            _stats['dropped_segments'] += len(segments)
+        else:
+            _stats['commits'] += 1
+            _stats['segments_committed'] += len(segments)
+            _stats['segments_inserted'] += len(result['inserted'])
+            _stats['segments_duplicate'] += len(result['duplicates'])
+            _stats['last_batch_size'] = len(segments)
+            _stats['max_batch_size'] = max(_stats['max_batch_size'], len(segments))
+        _stats['processed_payloads'] += len(batch)
+        for _, enqueued_at in batch:
+            wait_ms = (now - enqueued_at) * 1000
+            _stats['queue_wait_total_ms'] += wait_ms
+            _stats['queue_wait_max_ms'] = max(_stats['queue_wait_max_ms'], wait_ms)
+
+    if result is not None:
+        seen_segments.remember(result)
+        metrics.SEGMENTS_INSERTED.inc(len(result['inserted']))
+        metrics.SEGMENTS_DUPLICATE.inc(len(result['duplicates']))
+    else:
+        metrics.SEGMENTS_DROPPED.inc(len(segments))
+        logger.error('ingest.segments_dropped', count=len(segments), attempts=attempt)
+
+def writer_loop():
+    """
+    Background writer loop that drains the ingest queue
+    Keeps running after stop_writer() until the queue is empty
+    """
+    logger.info('ingest.writer_started', queue_size=QUEUE_MAX_SIZE, max_batch_segments=MAX_BATCH_SEGMENTS)
+
+    while RUNNING or not _queue.empty():
+        try:
+            batch = _drain_batch()
+            if batch:
+                try:
+                    _commit_batch(batch)
+                finally:
+                    for _ in batch:
+                        _queue.task_done()
+        except Exception:
+            logger.exception('ingest.writer_error')
+
+    logger.info('ingest.writer_stopped')
+
+def start_writer():
+    """
+    Start the background ingest writer thread
+    """
+    global RUNNING, _writer_thread
+
+    if RUNNING:
+        logger.warning('ingest.writer_already_running')
+        return _writer_thread
+
+    RUNNING = True
+
+    _writer_thread = threading.Thread(target=writer_loop, daemon=True)
+    _writer_thread.start()
+
+    return _writer_thread
+
+def stop_writer(timeout=10):
+    """
+    Stop the ingest writer, flushing anything still queued
+
+    Args:
+        timeout (float): Seconds to wait for the queue to drain
+    """
+    global RUNNING
+
+    if not RUNNING:
+        return
+
+    RUNNING = False
+    logger.info('ingest.writer_stopping', queue_depth=_queue.qsize())
+
+    if _writer_thread is not None:
+        _writer_thread.join(timeout)
+
+def get_stats():
+    """
+    Get ingest queue statistics
+
+    Returns:
+        dict: Queue depth, commit batch sizes and queue wait times
+    """
+    with _stats_lock:
+        stats = dict(_stats)
+
+    stats['mode'] = INGEST_MODE
+    stats['queue_depth'] = _queue.qsize()
+    stats['queue_max_size'] = QUEUE_MAX_SIZE
+    stats['avg_batch_size'] = round(stats['segments_committed'] / stats['commits'], 2) if stats['commits'] else 0.0
+    stats['queue_wait_avg_ms'] = round(stats['queue_wait_total_ms'] / stats['processed_payloads'], 2) if stats['processed_payloads'] else 0.0
+    stats['queue_wait_max_ms'] = round(stats['queue_wait_max_ms'], 2)
+    del stats['queue_wait_total_ms']
+
+    return stats
+
+# Flush queued segments on interpreter / worker shutdown
+atexit.register(stop_writer)
@@ -0,0 +1,260 @@
+"""
+Structured, asynchronous logging
+
+Modules log named events with key/value fields through get_logger(). Records
+are put on a bounded in-memory queue and written to stdout by a single
+listener thread, so request and worker threads never wait on terminal I/O;
+when the queue is full, records are dropped and counted instead of blocking.
+
+Level checks happen before any formatting, so disabled events cost next to
+nothing. Large debug dumps (raw webhook payloads, transcripts, responses) go
+through dump(), which is additionally sampled per event and can be switched
+off entirely with LOG_DEBUG_DUMPS=false.
+"""
+
+import os
+import sys
+import json
+import queue
+import atexit
+import random
+import logging
+import threading
+import logging.handlers
+from datetime import datetime
+
+# Configuration
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'text').lower()  # 'text' or 'json'
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', '10000'))  # records buffered before dropping
+LOG_DEBUG_DUMPS = os.getenv('LOG_DEBUG_DUMPS', 'true').lower() == 'true'  # kill switch for payload dumps
+LOG_DUMP_SAMPLE_RATE = float(os.getenv('LOG_DUMP_SAMPLE_RATE', '1.0'))  # fraction of dumps kept, per event
+# Per-event overrides, e.g. "webhook.raw_payload=0.01,agent.prompt=0.1"
+LOG_DUMP_SAMPLE_RATES = {
+    name.strip(): float(rate)
+    for name, rate in (
+        item.split('=', 1) for item in os.getenv('LOG_DUMP_SAMPLE_RATES', '').split(',') if '=' in item
+    )
+}
+
+_stats_lock = threading.Lock()
+_stats = {
+    'dropped': 0,
+    'dumps_logged': 0,
+    'dumps_skipped': 0,
+}
+
+class _TextFormatter(logging.Formatter):
+    """One line per event: time, level, logger, event, message, then key=value fields"""
+
+    def format(self, record):
+        parts = [
+            datetime.fromtimestamp(record.created).strftime('%H:%M:%S'),
+            record.levelname,
+            f"{record.name}:",
+            getattr(record, 'event', ''),
+        ]
+        if record.getMessage():
+            parts.append(record.getMessage())
+        fields = getattr(record, 'fields', None)
+        if fields:
+            parts.extend(f"{key}={value}" for key, value in fields.items())
+        line = ' '.join(p for p in parts if p)
+
+        payload = getattr(record, 'payload', None)
+        if payload is not None:
+            line += "\n" + payload
+        if record.exc_text:
+            line += "\n" + record.exc_text
+        return line
+
+class _JsonFormatter(logging.Formatter):
+    """One JSON object per event"""
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'event': getattr(record, 'event', None),
+        }
+        if record.getMessage():
+            entry['msg'] = record.getMessage()
+        entry.update(getattr(record, 'fields', None) or {})
+        payload = getattr(record, 'payload', None)
+        if payload is not None:
+            entry['payload'] = payload
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+class _NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Queue handler that never blocks the caller
+
+    Only the cheap parts of formatting happen in the calling thread (message
+    args and tracebacks are resolved so the record is self-contained); the
+    line itself is rendered by the listener thread.
+    """
+
+    def prepare(self, record):
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with _stats_lock:
+                _stats['dropped'] += 1
+
+class _Listener(logging.handlers.QueueListener):
+    """
+    Queue listener whose stop() waits for room in a full queue
+
+    The stock listener puts its stop sentinel with put_nowait(), which raises
+    queue.Full at exit whenever the queue is backed up.
+    """
+
+    def enqueue_sentinel(self):
+        self.queue.put(self._sentinel, timeout=_SHUTDOWN_TIMEOUT)
+
+class EventLogger:
+    """
+    Logger for named events with structured fields
+
+    Usage: logger.info('webhook.received', "optional message", segments=3)
+    """
+
+    def __init__(self, name):
+        self._logger = logging.getLogger(name)
+
+    def enabled(self, level):
+        """Check a level (e.g. logging.DEBUG) before building expensive fields"""
+        return self._logger.isEnabledFor(level)
+
+    def _log(self, level, event, message, fields, exc_info=False):
+        if self._logger.isEnabledFor(level):
+            self._logger.log(level, message or '', exc_info=exc_info,
+                             extra={'event': event, 'fields': fields})
+
+    def debug(self, event, message=None, **fields):
+        self._log(logging.DEBUG, event, message, fields)
+
+    def info(self, event, message=None, **fields):
+        self._log(logging.INFO, event, message, fields)
+
+    def warning(self, event, message=None, **fields):
+        self._log(logging.WARNING, event, message, fields)
+
+    def error(self, event, message=None, **fields):
+        self._log(logging.ERROR, event, message, fields)
+
+    def exception(self, event, message=None, **fields):
+        """Log at ERROR with the current exception's traceback"""
+        self._log(logging.ERROR, event, message, fields, exc_info=True)
+
+    def dump(self, event, payload, **fields):
+        """
+        Log a large debug payload, subject to the kill switch and sampling
+
+        The payload is only serialized when the dump is actually written.
+
+        Args:
+            event (str): Event name, also the key for LOG_DUMP_SAMPLE_RATES
+            payload: String, or any JSON-serializable object
+            **fields: Extra structured fields
+        """
+        if not LOG_DEBUG_DUMPS or not self._logger.isEnabledFor(logging.DEBUG):
+            return
+
+        rate = LOG_DUMP_SAMPLE_RATES.get(event, LOG_DUMP_SAMPLE_RATE)
+        if rate < 1.0 and random.random() >= rate:
+            with _stats_lock:
+                _stats['dumps_skipped'] += 1
+            return
+
+        if not isinstance(payload, str):
+            payload = json.dumps(payload, indent=2, default=str)
+        with _stats_lock:
+            _stats['dumps_logged'] += 1
+        self._logger.debug('', extra={'event': event, 'fields': fields, 'payload': payload})
+
+_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+_SHUTDOWN_TIMEOUT = 5.0  # seconds to wait for the listener to make room for its stop sentinel
+_listener = None
+_configured = False
+_configure_lock = threading.Lock()
+
+def configure():
+    """
+    Install the queue handler on the root logger and start the listener thread (idempotent)
+    """
+    global _listener, _configured
+
+    with _configure_lock:
+        if _configured:
+            return
+
+        output = logging.StreamHandler(sys.stdout)
+        output.setFormatter(_JsonFormatter() if LOG_FORMAT == 'json' else _TextFormatter())
+
+        root = logging.getLogger()
+        root.handlers = [_NonBlockingQueueHandler(_queue)]
+        root.setLevel(getattr(logging, LOG_LEVEL, logging.INFO))
+
+        _listener = _Listener(_queue, output, respect_handler_level=False)
+        _listener.start()
+        _configured = True
+
+def shutdown():
+    """
+    Flush queued records and stop the listener thread
+    """
+    global _listener, _configured
+
+    with _configure_lock:
+        if _listener is not None:
+            try:
+                _listener.stop()
+            except queue.Full:
+                # The listener is stuck; give up on the backlog rather than hang at exit
+                pass
+            _listener = None
+        _configured = False
+
+def get_logger(name):
+    """
+    Get an event logger, configuring logging on first use
+
+    Args:
+        name (str): Logger name, usually the module name
+
+    Returns:
+        EventLogger: Logger for structured events
+    """
+    configure()
+    return EventLogger(name)
+
+def get_stats():
+    """
+    Get logging statistics
+
+    Returns:
+        dict: Queue depth, dropped records and dump sampling counters
+    """
+    with _stats_lock:
+        stats = dict(_stats)
+
+    stats['level'] = LOG_LEVEL
+    stats['queue_depth'] = _queue.qsize()
+    stats['queue_max_size'] = LOG_QUEUE_SIZE
+    stats['debug_dumps'] = LOG_DEBUG_DUMPS
+
+    return stats
+
+atexit.register(shutdown)
@@ -0,0 +1,239 @@
+"""
+In-process metrics with a Prometheus text exposition endpoint
+
+Counters, gauges and histograms are plain Python objects guarded by a lock
+per metric, so recording a value costs a dict lookup and an addition.
+timed() works as a decorator or context manager for latency histograms.
+Gauges that need a database query (like the transcript backlog) are filled
+in by collector functions only when /metrics is scraped.
+
+Pipeline metrics are defined at the bottom of this module so every module
+records into the same registry.
+"""
+
+import time
+import bisect
+import threading
+import functools
+
+# Default latency buckets in seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Agent runs and texts take seconds, not milliseconds
+SLOW_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.0, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0)
+
+_registry = []
+_collectors = []
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(labelnames, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class _Metric:
+    """Base class: a named family of series keyed by label values"""
+
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._series = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _init_unlabeled(self):
+        # Unlabeled series are exported as zero from the start instead of appearing on first use
+        if not self.labelnames:
+            self._series[()] = self._new_series()
+
+    def _new_series(self):
+        return 0
+
+    def _key(self, labels):
+        if len(labels) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    @property
+    def family(self):
+        # Name used in HELP/TYPE, which must match the sample names
+        return self.name
+
+    def _render_series(self, key, value):
+        raise NotImplementedError
+
+    def render(self):
+        lines = [f"# HELP {self.family} {self.documentation}", f"# TYPE {self.family} {self.kind}"]
+        with self._lock:
+            series = {key: (list(v) if isinstance(v, list) else v) for key, v in self._series.items()}
+        for key, value in sorted(series.items()):
+            lines.extend(self._render_series(key, value))
+        return lines
+
+class Counter(_Metric):
+    """Monotonically increasing count"""
+
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._init_unlabeled()
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._series[key] = self._series.get(key, 0) + amount
+
+    @property
+    def family(self):
+        return f"{self.name}_total"
+
+    def _render_series(self, key, value):
+        return [f"{self.family}{_format_labels(self.labelnames, key)} {_format_value(value)}"]
+
+class Gauge(_Metric):
+    """Value that can go up and down"""
+
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._series[key] = value
+
+    def _render_series(self, key, value):
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"]
+
+class Histogram(_Metric):
+    """Distribution of observed values over fixed buckets"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._init_unlabeled()
+
+    def _new_series(self):
+        # Per-bucket counts (last slot is +Inf), then sum and count
+        return [0] * (len(self.buckets) + 1) + [0.0, 0]
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = self._new_series()
+            series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def time(self, **labels):
+        """Time a block or function into this histogram (see timed())"""
+        return timed(self, **labels)
+
+    def _render_series(self, key, value):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), value[:-2]):
+            cumulative += count
+            le = f'le="{_format_value(bound)}"'
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+        labels = _format_labels(self.labelnames, key)
+        lines.append(f"{self.name}_sum{labels} {_format_value(value[-2])}")
+        lines.append(f"{self.name}_count{labels} {value[-1]}")
+        return lines
+
+class timed:
+    """
+    Record elapsed wall time in a histogram
+
+    Usable as a context manager (with timed(HIST): ...) or as a decorator
+    (@timed(HIST, function='x')). Exceptions are timed too, then re-raised.
+    """
+
+    __slots__ = ('histogram', 'labels', '_started')
+
+    def __init__(self, histogram, **labels):
+        self.histogram = histogram
+        self.labels = labels
+        self._started = None
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self._started, **self.labels)
+        return False
+
+    def __call__(self, func):
+        histogram, labels = self.histogram, self.labels
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - started, **labels)
+
+        return wrapper
+
+def register_collector(func):
+    """
+    Register a function that refreshes gauges right before each scrape
+
+    Args:
+        func (callable): Called with no arguments; exceptions are ignored
+    """
+    _collectors.append(func)
+    return func
+
+def render():
+    """
+    Render every metric in the Prometheus text exposition format
+
+    Returns:
+        str: Exposition text
+    """
+    for collector in _collectors:
+        try:
+            collector()
+        except Exception:
+            pass
+
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+# Pipeline metrics
+WEBHOOK_REQUESTS = Counter('omi_webhook_requests', "Webhook requests by HTTP status", ['status'])
+WEBHOOK_SECONDS = Histogram('omi_webhook_duration_seconds', "Webhook handling time")
+SEGMENTS_RECEIVED = Counter('omi_segments_received', "Transcript segments received by the webhook")
+SEGMENTS_INSERTED = Counter('omi_segments_inserted', "Transcript segments stored")
+SEGMENTS_DUPLICATE = Counter('omi_segments_duplicate', "Transcript segments skipped as already stored")
+SEGMENTS_DROPPED = Counter('omi_segments_dropped', "Acknowledged segments the ingest writer gave up on at shutdown")
+SEGMENTS_FILTERED = Counter('omi_segments_filtered', "Duplicate segments dropped by the seen-segment filter before the database")
+ACTIVATIONS = Counter('omi_activations', "Activation phrases detected in incoming segments")
+DB_QUERY_SECONDS = Histogram('omi_db_query_duration_seconds', "Time spent in db.py functions", ['function'])
+PROCESSOR_CYCLE_SECONDS = Histogram('omi_processor_cycle_duration_seconds', "Time to claim and dispatch one processor cycle")
+PROCESSOR_BATCH_SECONDS = Histogram('omi_processor_batch_duration_seconds', "Time to process one session batch", buckets=SLOW_BUCKETS)
+PROCESSOR_BATCHES = Counter('omi_processor_batches', "Session batches processed by outcome", ['outcome'])
+TRANSCRIPT_BACKLOG = Gauge('omi_transcript_backlog', "Unprocessed transcripts by state", ['state'])
+TRANSCRIPT_BACKLOG_AGE = Gauge('omi_transcript_backlog_oldest_age_seconds', "Age of the oldest unprocessed transcript")
+AGENT_RUN_SECONDS = Histogram('omi_agent_run_duration_seconds', "send_to_jarvis agent run time", ['outcome'], buckets=SLOW_BUCKETS)
+SMS_SEND_SECONDS = Histogram('omi_sms_send_duration_seconds', "Textbelt send time including retries", buckets=SLOW_BUCKETS)
+SMS_SEND_FAILURES = Counter('omi_sms_send_failures', "Failed SMS sends by reason", ['reason'])
@@ -0,0 +1,417 @@
+"""
+Durable SMS outbox with a background delivery worker
+
+Producers (the AI response path and the send_text_message tool) only insert
+a row into sms_outbox and return. A worker thread claims pending texts per
+recipient, drops texts a retried batch already sent, coalesces texts that
+arrived within a short window into as few sends as possible, and records the textId or retries with
+backoff. A Textbelt outage no longer loses texts or stalls AI processing.
+
+dispatch() goes one step further for callers on the agent's critical path:
+even the outbox INSERT happens in the background and the caller gets a
+TextHandle back immediately. Once the message the texts belong to is saved,
+attach() links them to it so their delivery status can be read back.
+"""
+
+import os
+import time
+import uuid
+import atexit
+import socket
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+import log
+import storage
+import sms
+import tracing
+
+# Configuration
+SMS_OUTBOX_ENABLED = os.getenv('SMS_OUTBOX_ENABLED', 'true').lower() == 'true'  # false sends inline
+OUTBOX_COALESCE_WINDOW = float(os.getenv('OUTBOX_COALESCE_WINDOW', '1.0'))  # seconds texts may accumulate
+OUTBOX_MAX_CHARS = int(os.getenv('OUTBOX_MAX_CHARS', '640'))  # longest coalesced text
+OUTBOX_DEDUPE_SECONDS = int(os.getenv('OUTBOX_DEDUPE_SECONDS', '300'))  # skip bodies already sent for the same trace this recently
+OUTBOX_MAX_ATTEMPTS = int(os.getenv('OUTBOX_MAX_ATTEMPTS', '5'))
+OUTBOX_RETRY_BASE_DELAY = float(os.getenv('OUTBOX_RETRY_BASE_DELAY', '5'))  # seconds, doubles per attempt
+OUTBOX_RETRY_MAX_DELAY = float(os.getenv('OUTBOX_RETRY_MAX_DELAY', '300'))  # seconds
+OUTBOX_LEASE_SECONDS = int(os.getenv('OUTBOX_LEASE_SECONDS', '60'))  # claim validity, renewed before every send
+OUTBOX_POLL_INTERVAL = float(os.getenv('OUTBOX_POLL_INTERVAL', '15'))  # seconds, catches retries and other processes
+
+COALESCE_SEPARATOR = "\n\n"
+
+RUNNING = False
+
+logger = log.get_logger('outbox')
+
+# Identifies this worker's claims, unique per process
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+# Texts dispatched during the current agent run (set by ai_handler)
+current_run_texts = contextvars.ContextVar('current_run_texts', default=None)
+
+_dispatch_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='sms-dispatch')
+_worker_thread = None
+_wake = threading.Event()
+_due_lock = threading.Lock()
+_next_due = None  # monotonic time the earliest locally queued text becomes claimable
+_stats_lock = threading.Lock()
+_stats = {
+    'enqueued': 0,
+    'sent_inline': 0,
+    'texts_sent': 0,
+    'messages_sent': 0,
+    'coalesced': 0,
+    'duplicates': 0,
+    'send_failures': 0,
+    'failed': 0,
+}
+
+def _schedule(delay):
+    """Wake the worker once delay seconds have passed"""
+    global _next_due
+    due = time.monotonic() + delay
+    with _due_lock:
+        if _next_due is None or due < _next_due:
+            _next_due = due
+    _wake.set()
+
+def _send_inline(message, phone_number):
+    """Send directly through the SMS client (outbox disabled or unavailable)"""
+    result = sms.send_sms(message, phone_number)
+    with _stats_lock:
+        _stats['sent_inline'] += 1
+    if result is not None:
+        tracing.add_stage('sms_send', result['latency_ms'])
+    if result is None:
+        return {'success': False, 'queued': False, 'outbox_id': None, 'error': 'Failed to send'}
+    return dict(result, queued=False, outbox_id=None)
+
+def enqueue(message, phone_number=None, source=None, trace_id=None, immediate=False):
+    """
+    Queue a text for delivery
+
+    Falls back to sending inline if the outbox is disabled or the row can't
+    be written, so a text is never silently dropped.
+
+    Args:
+        message (str): The message to send
+        phone_number (str, optional): Recipient, defaults to PHONE_NUMBER from env
+        source (str, optional): Producer, e.g. 'response' or 'tool'
+        trace_id (str, optional): Trace to record the text under, defaults to the current trace
+        immediate (bool): Send without waiting out OUTBOX_COALESCE_WINDOW (the
+                          first part of a response, which the user is waiting for)
+
+    Returns:
+        dict: {'success', 'queued', 'outbox_id'} (plus Textbelt fields when sent inline)
+    """
+    phone_number = phone_number or sms.get_client().phone_number
+    if not phone_number:
+        logger.error('sms.no_phone_number')
+        return {'success': False, 'queued': False, 'outbox_id': None, 'error': 'No phone number configured'}
+
+    if not SMS_OUTBOX_ENABLED:
+        return _send_inline(message, phone_number)
+
+    outbox_id = storage.get().enqueue_sms(phone_number, message, source, trace_id or tracing.current_id(), immediate)
+    if outbox_id is None:
+        logger.warning('sms_outbox.unavailable', "Sending inline")
+        return _send_inline(message, phone_number)
+
+    with _stats_lock:
+        _stats['enqueued'] += 1
+    _schedule(0 if immediate else OUTBOX_COALESCE_WINDOW)
+
+    return {'success': True, 'queued': True, 'outbox_id': outbox_id}
+
+class TextHandle:
+    """
+    Handle for a text dispatched in the background
+
+    Resolves to the enqueue() result once the text has been queued (or sent
+    inline as a fallback).
+    """
+
+    def __init__(self, future, source=None):
+        self.id = f"sms-{uuid.uuid4().hex[:8]}"
+        self.source = source
+        self.future = future
+
+    def result(self, timeout=None):
+        """
+        Wait for the text to be queued
+
+        Args:
+            timeout (float, optional): Seconds to wait
+
+        Returns:
+            dict: The enqueue() result, or a failure dict if dispatch failed or timed out
+        """
+        try:
+            return self.future.result(timeout)
+        except Exception as e:
+            return {'success': False, 'queued': False, 'outbox_id': None, 'error': str(e) or 'Dispatch timed out'}
+
+    @property
+    def outbox_id(self):
+        """Outbox row ID, or None if not queued (yet)"""
+        if not self.future.done():
+            return None
+        return self.result().get('outbox_id')
+
+def dispatch(message, phone_number=None, source=None):
+    """
+    Queue a text without waiting for the database
+
+    The text is handed to a background thread and the call returns right
+    away. If called during an agent run (see current_run_texts), the handle
+    is also recorded there so the text can be attached to the run's message.
+
+    Args:
+        message (str): The message to send
+        phone_number (str, optional): Recipient, defaults to PHONE_NUMBER from env
+        source (str, optional): Producer, e.g. 'tool'
+
+    Returns:
+        TextHandle: Handle for the dispatched text
+    """
+    # Executor threads don't inherit context, so the trace ID is passed along explicitly
+    handle = TextHandle(
+        _dispatch_executor.submit(enqueue, message, phone_number, source, tracing.current_id()), source
+    )
+
+    run_texts = current_run_texts.get()
+    if run_texts is not None:
+        run_texts.append(handle)
+
+    return handle
+
+def attach(texts, message_id, timeout=5):
+    """
+    Link texts to the message they were sent for
+
+    Args:
+        texts (list): TextHandle objects and/or outbox IDs
+        message_id (int): ID of the saved message
+        timeout (float): Seconds to wait for each dispatched text to be queued
+
+    Returns:
+        list: Outbox IDs that were linked
+    """
+    outbox_ids = []
+    for text in texts:
+        if isinstance(text, TextHandle):
+            result = text.result(timeout)
+            if not result.get('success'):
+                logger.warning('sms_outbox.dispatch_failed', result.get('error'), handle=text.id)
+            text = result.get('outbox_id')
+        if text is not None:
+            outbox_ids.append(text)
+
+    if outbox_ids and message_id is not None:
+        storage.get().attach_sms_to_message(outbox_ids, message_id)
+    return outbox_ids
+
+def _pack(rows):
+    """
+    Coalesce a recipient's texts into as few sends as possible
+
+    Consecutive texts are joined while the result fits in OUTBOX_MAX_CHARS;
+    a single longer text is sent on its own.
+
+    Args:
+        rows (list): Outbox dicts in order
+
+    Returns:
+        list: Lists of rows, one per text to send
+    """
+    packs = []
+    length = 0
+    for row in rows:
+        added = len(COALESCE_SEPARATOR) + len(row['message'])
+        if packs and length + added <= OUTBOX_MAX_CHARS:
+            packs[-1].append(row)
+            length += added
+        else:
+            packs.append([row])
+            length = len(row['message'])
+    return packs
+
+def _deliver_recipient(phone_number, rows):
+    """
+    Dedupe, coalesce and send one recipient's claimed texts, in order
+
+    Args:
+        phone_number (str): Recipient
+        rows (list): Claimed outbox dicts, oldest first
+    """
+    # A body already sent for the same trace is a redelivery (a retried batch
+    # texting again); the same words from another run are a new text
+    trace_ids = list({r['trace_id'] for r in rows if r.get('trace_id')})
+    seen = storage.get().get_recently_sent_sms(phone_number, trace_ids, OUTBOX_DEDUPE_SECONDS) if trace_ids else {}
+    unique = []
+    for row in rows:
+        key = (row.get('trace_id'), row['message'])
+        if key[0] and key in seen:
+            storage.get().complete_sms([row['id']], WORKER_ID, 'duplicate', delivered_with=seen[key])
+            with _stats_lock:
+                _stats['duplicates'] += 1
+            continue
+        if key[0]:
+            seen[key] = row['id']
+        unique.append(row)
+
+    packs = _pack(unique)
+    # A send with all its retries can outlast the claim, and an expired lease
+    # lets another worker send the same texts again
+    lease_seconds = OUTBOX_LEASE_SECONDS + sms.get_client().max_send_seconds
+    for index, pack in enumerate(packs):
+        remaining = [r['id'] for p in packs[index:] for r in p]
+        held = storage.get().extend_sms_lease(remaining, WORKER_ID, lease_seconds)
+        if held != len(remaining):
+            # Lease lost (or unknown): leave the texts to whoever holds them now
+            logger.warning('sms_outbox.lease_lost', phone_number=phone_number, held=held, claimed=len(remaining))
+            return
+
+        text = COALESCE_SEPARATOR.join(r['message'] for r in pack)
+        result = sms.send_sms(text, phone_number)
+
+        if result is None:
+            # Keep ordering: this text and everything after it go back for retry
+            released = storage.get().release_sms(
+                remaining, WORKER_ID, "Failed to send",
+                OUTBOX_MAX_ATTEMPTS, OUTBOX_RETRY_BASE_DELAY, OUTBOX_RETRY_MAX_DELAY
+            )
+            with _stats_lock:
+                _stats['send_failures'] += 1
+                _stats['failed'] += released['failed'] if released else 0
+            if released and released['retrying']:
+                _schedule(OUTBOX_RETRY_BASE_DELAY)
+            logger.warning('sms_outbox.send_failed', phone_number=phone_number, released=len(remaining))
+            return
+
+        primary, rest = pack[0], pack[1:]
+        text_id = result.get('textId')
+        storage.get().complete_sms([primary['id']], WORKER_ID, 'sent', text_id=text_id,
+                        send_latency_ms=result.get('latency_ms'))
+        if rest:
+            storage.get().complete_sms([r['id'] for r in rest], WORKER_ID, 'coalesced',
+                            text_id=text_id, delivered_with=primary['id'])
+
+        with _stats_lock:
+            _stats['texts_sent'] += 1
+            _stats['messages_sent'] += len(pack)
+            _stats['coalesced'] += len(rest)
+
+        logger.info('sms_outbox.delivered', phone_number=phone_number, messages=len(pack), text_id=text_id)
+
+def deliver_pending():
+    """
+    Claim and deliver everything that is ready
+
+    Returns:
+        int: Number of outbox texts claimed
+    """
+    claimed = storage.get().claim_sms_batches(WORKER_ID, OUTBOX_COALESCE_WINDOW, OUTBOX_LEASE_SECONDS)
+
+    for phone_number, rows in claimed.items():
+        try:
+            _deliver_recipient(phone_number, rows)
+        except Exception:
+            logger.exception('sms_outbox.delivery_error', phone_number=phone_number)
+
+    return sum(len(rows) for rows in claimed.values())
+
+def worker_loop():
+    """
+    Background delivery loop
+    Wakes when a locally queued text becomes claimable, and at least every
+    OUTBOX_POLL_INTERVAL seconds for retries and texts queued by other processes
+    """
+    global _next_due
+
+    logger.info('sms_outbox.worker_started', coalesce_window=OUTBOX_COALESCE_WINDOW, max_chars=OUTBOX_MAX_CHARS)
+
+    last_poll = 0.0
+
+    while RUNNING:
+        try:
+            now = time.monotonic()
+            with _due_lock:
+                due = _next_due
+            deadline = last_poll + OUTBOX_POLL_INTERVAL
+            if due is not None:
+                deadline = min(deadline, due)
+
+            if deadline > now:
+                _wake.wait(deadline - now)
+                _wake.clear()
+                continue
+
+            with _due_lock:
+                if _next_due is not None and _next_due <= now:
+                    _next_due = None
+            last_poll = now
+
+            # Keep going while there's more ready (more recipients than one claim takes)
+            while RUNNING and deliver_pending():
+                pass
+        except Exception:
+            logger.exception('sms_outbox.worker_error')
+            time.sleep(1)
+
+    logger.info('sms_outbox.worker_stopped')
+
+def start_worker():
+    """
+    Start the background SMS outbox worker thread
+    """
+    global RUNNING, _worker_thread
+
+    if RUNNING:
+        logger.warning('sms_outbox.worker_already_running')
+        return _worker_thread
+
+    RUNNING = True
+
+    _worker_thread = threading.Thread(target=worker_loop, daemon=True)
+    _worker_thread.start()
+
+    return _worker_thread
+
+def stop_worker(timeout=10):
+    """
+    Stop the SMS outbox worker
+    Unsent texts stay in the outbox and are delivered on the next start
+
+    Args:
+        timeout (float): Seconds to wait for an in-progress delivery
+    """
+    global RUNNING
+
+    if not RUNNING:
+        return
+
+    RUNNING = False
+    _wake.set()
+    logger.info('sms_outbox.worker_stopping')
+
+    if _worker_thread is not None:
+        _worker_thread.join(timeout)
+
+def get_stats():
+    """
+    Get SMS outbox statistics
+
+    Returns:
+        dict: Delivery counters for this process plus outbox counts by status
+    """
+    with _stats_lock:
+        stats = dict(_stats)
+
+    stats['enabled'] = SMS_OUTBOX_ENABLED
+    stats['texts_saved'] = stats['coalesced'] + stats['duplicates']
+    stats['outbox'] = storage.get().get_sms_outbox_stats() if SMS_OUTBOX_ENABLED else {}
+
+    return stats
+
+atexit.register(stop_worker)
@@ -7,13 +7,46 @@ CREATE TABLE IF NOT EXISTS messages (
     message_type VARCHAR(10) NOT NULL CHECK (message_type IN ('user', 'ai')),
     message_text TEXT NOT NULL,
     tool_executions TEXT,
-    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    session_id VARCHAR(255)
 );
 
+ALTER TABLE messages ADD COLUMN IF NOT EXISTS session_id VARCHAR(255);
+
+-- Upgrade existing transcripts tables with the activation and claim / lease columns
+ALTER TABLE IF EXISTS transcripts ADD COLUMN IF NOT EXISTS activation BOOLEAN NOT NULL DEFAULT FALSE;
+ALTER TABLE IF EXISTS transcripts ADD COLUMN IF NOT EXISTS attempts INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE IF EXISTS transcripts ADD COLUMN IF NOT EXISTS claimed_by VARCHAR(255);
+ALTER TABLE IF EXISTS transcripts ADD COLUMN IF NOT EXISTS lease_expires_at TIMESTAMP;
+ALTER TABLE IF EXISTS transcripts ADD COLUMN IF NOT EXISTS next_attempt_at TIMESTAMP;
+ALTER TABLE IF EXISTS transcripts ADD COLUMN IF NOT EXISTS last_error TEXT;
+ALTER TABLE IF EXISTS transcripts ADD COLUMN IF NOT EXISTS dead_lettered_at TIMESTAMP;
+ALTER TABLE IF EXISTS transcripts ADD COLUMN IF NOT EXISTS trace_id VARCHAR(32);
+
+-- Upgrade a pre-partitioning transcripts heap: move it (and its indexes and
+-- sequence) out of the way; its rows are copied into the partitioned table below
+DO $$
+DECLARE
+    idx RECORD;
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_class WHERE relname = 'transcripts' AND relkind = 'r'
+               AND relnamespace = current_schema()::regnamespace) THEN
+        ALTER TABLE transcripts RENAME TO transcripts_unpartitioned;
+        ALTER SEQUENCE IF EXISTS transcripts_id_seq RENAME TO transcripts_unpartitioned_id_seq;
+        FOR idx IN SELECT indexname FROM pg_indexes
+                   WHERE tablename = 'transcripts_unpartitioned' AND schemaname = current_schema() LOOP
+            EXECUTE format('ALTER INDEX %I RENAME TO %I', idx.indexname, 'old_' || idx.indexname);
+        END LOOP;
+    END IF;
+END;
+$$;
+
 -- Table to store transcript segments from Omi device
+-- Range-partitioned by month on received_at, so retention drops whole
+-- partitions (db.drop_old_transcript_partitions) instead of a bulk DELETE
 CREATE TABLE IF NOT EXISTS transcripts (
-    id SERIAL PRIMARY KEY,
-    segment_id VARCHAR(255) UNIQUE NOT NULL,
+    id SERIAL,
+    segment_id VARCHAR(255) NOT NULL,
     text TEXT NOT NULL,
     speaker VARCHAR(50),
     speaker_id INTEGER,
@@ -22,11 +55,111 @@ CREATE TABLE IF NOT EXISTS transcripts (
     end_time FLOAT,
     session_id VARCHAR(255),
     message_id INTEGER,
-    received_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    received_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
     processed BOOLEAN DEFAULT FALSE,
+    -- Set at ingest when the segment completes an activation phrase
+    activation BOOLEAN NOT NULL DEFAULT FALSE,
+    -- Claim / lease state for transcript processors (see db.claim_transcript_batches)
+    attempts INTEGER NOT NULL DEFAULT 0,
+    claimed_by VARCHAR(255),
+    lease_expires_at TIMESTAMP,
+    next_attempt_at TIMESTAMP,
+    last_error TEXT,
+    dead_lettered_at TIMESTAMP,
+    -- Assigned by the webhook request that delivered the segment (see tracing.py)
+    trace_id VARCHAR(32),
+    PRIMARY KEY (id, received_at),
     FOREIGN KEY (message_id) REFERENCES messages(id) ON DELETE SET NULL
+) PARTITION BY RANGE (received_at);
+
+-- Catches rows for months that have no partition yet (maintenance not running
+-- or behind), so webhook inserts never fail for lack of a partition;
+-- ensure_transcript_partitions moves them out once their month is created
+CREATE TABLE IF NOT EXISTS transcripts_default PARTITION OF transcripts DEFAULT;
+
+-- Segment ids seen so far
+-- A partitioned table can't enforce UNIQUE (segment_id) across partitions, so
+-- inserts register the id here first and ON CONFLICT dedups against this table
+CREATE TABLE IF NOT EXISTS transcript_segment_ids (
+    segment_id VARCHAR(255) PRIMARY KEY,
+    received_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
 );
 
+-- Create monthly transcripts partitions from start_month through months_ahead months from now
+-- A month's rows already in transcripts_default are moved into its new partition
+-- (attaching the partition would fail while the default still holds them)
+CREATE OR REPLACE FUNCTION ensure_transcript_partitions(start_month DATE, months_ahead INTEGER)
+RETURNS INTEGER AS $$
+DECLARE
+    part_month DATE := date_trunc('month', start_month)::date;
+    last_month DATE := (date_trunc('month', CURRENT_DATE) + make_interval(months => months_ahead))::date;
+    next_month DATE;
+    partition_name TEXT;
+    created INTEGER := 0;
+BEGIN
+    WHILE part_month <= last_month LOOP
+        partition_name := 'transcripts_p' || to_char(part_month, 'YYYY_MM');
+        next_month := (part_month + INTERVAL '1 month')::date;
+        IF to_regclass(partition_name) IS NULL THEN
+            EXECUTE format('CREATE TABLE %I (LIKE transcripts)', partition_name);
+            EXECUTE format(
+                'WITH moved AS (
+                     DELETE FROM transcripts_default WHERE received_at >= %L AND received_at < %L RETURNING *
+                 )
+                 INSERT INTO %I SELECT * FROM moved',
+                part_month, next_month, partition_name
+            );
+            EXECUTE format(
+                'ALTER TABLE transcripts ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+                partition_name, part_month, next_month
+            );
+            created := created + 1;
+        END IF;
+        part_month := next_month;
+    END LOOP;
+    RETURN created;
+END;
+$$ LANGUAGE plpgsql;
+
+SELECT ensure_transcript_partitions(CURRENT_DATE, 3);
+
+-- Copy rows from a pre-partitioning transcripts heap, then drop it
+DO $$
+DECLARE
+    oldest TIMESTAMP;
+BEGIN
+    IF to_regclass('transcripts_unpartitioned') IS NOT NULL THEN
+        UPDATE transcripts_unpartitioned SET received_at = CURRENT_TIMESTAMP WHERE received_at IS NULL;
+        SELECT MIN(received_at) INTO oldest FROM transcripts_unpartitioned;
+        IF oldest IS NOT NULL THEN
+            PERFORM ensure_transcript_partitions(oldest::date, 3);
+        END IF;
+
+        INSERT INTO transcripts (
+            id, segment_id, text, speaker, speaker_id, is_user, start_time, end_time,
+            session_id, message_id, received_at, processed, activation, attempts,
+            claimed_by, lease_expires_at, next_attempt_at, last_error, dead_lettered_at, trace_id
+        )
+        SELECT
+            id, segment_id, text, speaker, speaker_id, is_user, start_time, end_time,
+            session_id, message_id, received_at, processed, activation, attempts,
+            claimed_by, lease_expires_at, next_attempt_at, last_error, dead_lettered_at, trace_id
+        FROM transcripts_unpartitioned;
+
+        INSERT INTO transcript_segment_ids (segment_id, received_at)
+        SELECT segment_id, received_at FROM transcripts_unpartitioned
+        ON CONFLICT (segment_id) DO NOTHING;
+
+        PERFORM setval(
+            pg_get_serial_sequence('transcripts', 'id'),
+            GREATEST((SELECT MAX(id) FROM transcripts_unpartitioned), 1)
+        );
+
+        DROP TABLE transcripts_unpartitioned;
+    END IF;
+END;
+$$;
+
 -- Table to store session mappings (Omi session_id -> OpenAI conversation_id)
 CREATE TABLE IF NOT EXISTS sessions (
     id SERIAL PRIMARY KEY,
@@ -36,12 +169,96 @@ CREATE TABLE IF NOT EXISTS sessions (
     last_used_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
+-- Outgoing texts, delivered by a background worker (see outbox.py)
+-- status: pending -> sending -> sent | failed, or coalesced/duplicate when folded into another text
+CREATE TABLE IF NOT EXISTS sms_outbox (
+    id SERIAL PRIMARY KEY,
+    phone_number VARCHAR(32) NOT NULL,
+    message TEXT NOT NULL,
+    source VARCHAR(50),
+    status VARCHAR(20) NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    claimed_by VARCHAR(255),
+    lease_expires_at TIMESTAMP,
+    next_attempt_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    sent_at TIMESTAMP,
+    text_id VARCHAR(255),
+    delivered_with INTEGER REFERENCES sms_outbox(id),
+    message_id INTEGER REFERENCES messages(id),
+    last_error TEXT,
+    -- Trace of the batch that produced the text, and the Textbelt call time once sent
+    trace_id VARCHAR(32),
+    send_latency_ms REAL,
+    -- Sent without waiting out the coalescing window (first part of a response)
+    immediate BOOLEAN NOT NULL DEFAULT FALSE
+);
+
+ALTER TABLE sms_outbox ADD COLUMN IF NOT EXISTS message_id INTEGER REFERENCES messages(id);
+ALTER TABLE sms_outbox ADD COLUMN IF NOT EXISTS trace_id VARCHAR(32);
+ALTER TABLE sms_outbox ADD COLUMN IF NOT EXISTS send_latency_ms REAL;
+ALTER TABLE sms_outbox ADD COLUMN IF NOT EXISTS immediate BOOLEAN NOT NULL DEFAULT FALSE;
+
+-- Per-batch stage timings and token usage (see tracing.py)
+-- One row per processing attempt, so a retried batch has several rows with the same trace_id
+CREATE TABLE IF NOT EXISTS traces (
+    id SERIAL PRIMARY KEY,
+    trace_id VARCHAR(32) NOT NULL,
+    session_id VARCHAR(255),
+    message_id INTEGER REFERENCES messages(id) ON DELETE SET NULL,
+    outcome VARCHAR(20),
+    model VARCHAR(100),
+    input_tokens INTEGER,
+    output_tokens INTEGER,
+    total_tokens INTEGER,
+    llm_requests INTEGER,
+    web_searches INTEGER,
+    -- stage name -> milliseconds
+    stages JSONB NOT NULL DEFAULT '{}',
+    -- Activating segment arrival and processing start; their difference is the queue wait
+    received_at TIMESTAMP,
+    started_at TIMESTAMP,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
 -- Indexes for performance
-CREATE INDEX IF NOT EXISTS idx_transcripts_processed ON transcripts(processed);
+-- Partial indexes only cover the small unprocessed working set, not the whole history
+CREATE INDEX IF NOT EXISTS idx_transcripts_unprocessed ON transcripts(received_at) WHERE processed = FALSE;
+CREATE INDEX IF NOT EXISTS idx_transcripts_unprocessed_session ON transcripts(session_id, received_at) WHERE processed = FALSE;
 CREATE INDEX IF NOT EXISTS idx_transcripts_session_id ON transcripts(session_id);
 CREATE INDEX IF NOT EXISTS idx_transcripts_message_id ON transcripts(message_id);
+CREATE INDEX IF NOT EXISTS idx_transcript_segment_ids_received_at ON transcript_segment_ids(received_at);
 CREATE INDEX IF NOT EXISTS idx_sessions_omi_id ON sessions(omi_session_id);
-CREATE INDEX IF NOT EXISTS idx_transcripts_received_at ON transcripts(received_at);
 CREATE INDEX IF NOT EXISTS idx_messages_timestamp ON messages(timestamp);
+-- Keyset pagination on (timestamp, id), optionally within a session
+CREATE INDEX IF NOT EXISTS idx_messages_timestamp_id ON messages(timestamp, id);
+CREATE INDEX IF NOT EXISTS idx_messages_session_timestamp_id ON messages(session_id, timestamp, id);
 CREATE INDEX IF NOT EXISTS idx_messages_type ON messages(message_type);
+CREATE INDEX IF NOT EXISTS idx_transcripts_pending_activation ON transcripts(session_id) WHERE processed = FALSE AND activation;
+CREATE INDEX IF NOT EXISTS idx_transcripts_dead_lettered ON transcripts(dead_lettered_at) WHERE dead_lettered_at IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_sms_outbox_pending ON sms_outbox(phone_number, id) WHERE status IN ('pending', 'sending');
+CREATE INDEX IF NOT EXISTS idx_sms_outbox_message_id ON sms_outbox(message_id);
+CREATE INDEX IF NOT EXISTS idx_sms_outbox_sent ON sms_outbox(phone_number, sent_at) WHERE status IN ('sent', 'coalesced');
+CREATE INDEX IF NOT EXISTS idx_sms_outbox_trace_id ON sms_outbox(trace_id) WHERE trace_id IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_traces_created_at ON traces(created_at);
+CREATE INDEX IF NOT EXISTS idx_traces_trace_id ON traces(trace_id);
+CREATE INDEX IF NOT EXISTS idx_traces_message_id ON traces(message_id);
+
+-- Notify listeners (transcript processor) when segments with an activation arrive
+-- Statement-level, so a multi-row webhook insert sends at most one notification,
+-- and ambient speech without an activation doesn't wake the processor at all
+CREATE OR REPLACE FUNCTION notify_new_transcripts() RETURNS trigger AS $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM new_rows WHERE activation) THEN
+        PERFORM pg_notify('new_transcripts', '');
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
 
+DROP TRIGGER IF EXISTS transcripts_notify_insert ON transcripts;
+CREATE TRIGGER transcripts_notify_insert
+    AFTER INSERT ON transcripts
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION notify_new_transcripts();
@@ -0,0 +1,111 @@
+-- Database schema for the embedded SQLite backend (see db_sqlite.py)
+-- Same tables and columns as schema.sql, minus Postgres-only features:
+-- no partitions (segment_id is UNIQUE on transcripts itself) and no NOTIFY trigger
+-- Timestamps are ISO-8601 text written by the app; BOOLEAN and JSON columns are
+-- converted back to Python values by the converters registered in db_sqlite.py
+
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY,
+    message_type TEXT NOT NULL CHECK (message_type IN ('user', 'ai')),
+    message_text TEXT NOT NULL,
+    tool_executions TEXT,
+    timestamp TIMESTAMP,
+    session_id TEXT
+);
+
+CREATE TABLE IF NOT EXISTS transcripts (
+    id INTEGER PRIMARY KEY,
+    segment_id TEXT NOT NULL UNIQUE,
+    text TEXT NOT NULL,
+    speaker TEXT,
+    speaker_id INTEGER,
+    is_user BOOLEAN DEFAULT 0,
+    start_time REAL,
+    end_time REAL,
+    session_id TEXT,
+    message_id INTEGER REFERENCES messages(id) ON DELETE SET NULL,
+    received_at TIMESTAMP NOT NULL,
+    processed BOOLEAN NOT NULL DEFAULT 0,
+    -- Set at ingest when the segment completes an activation phrase
+    activation BOOLEAN NOT NULL DEFAULT 0,
+    -- Claim / lease state for transcript processors (see db_sqlite.claim_transcript_batches)
+    attempts INTEGER NOT NULL DEFAULT 0,
+    claimed_by TEXT,
+    lease_expires_at TIMESTAMP,
+    next_attempt_at TIMESTAMP,
+    last_error TEXT,
+    dead_lettered_at TIMESTAMP,
+    -- Assigned by the webhook request that delivered the segment (see tracing.py)
+    trace_id TEXT
+);
+
+CREATE TABLE IF NOT EXISTS sessions (
+    id INTEGER PRIMARY KEY,
+    omi_session_id TEXT UNIQUE NOT NULL,
+    openai_conversation_id TEXT,
+    created_at TIMESTAMP,
+    last_used_at TIMESTAMP
+);
+
+-- Outgoing texts, delivered by a background worker (see outbox.py)
+-- status: pending -> sending -> sent | failed, or coalesced/duplicate when folded into another text
+CREATE TABLE IF NOT EXISTS sms_outbox (
+    id INTEGER PRIMARY KEY,
+    phone_number TEXT NOT NULL,
+    message TEXT NOT NULL,
+    source TEXT,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    claimed_by TEXT,
+    lease_expires_at TIMESTAMP,
+    next_attempt_at TIMESTAMP NOT NULL,
+    created_at TIMESTAMP NOT NULL,
+    sent_at TIMESTAMP,
+    text_id TEXT,
+    delivered_with INTEGER REFERENCES sms_outbox(id),
+    message_id INTEGER REFERENCES messages(id),
+    last_error TEXT,
+    trace_id TEXT,
+    send_latency_ms REAL,
+    -- Sent without waiting out the coalescing window (first part of a response)
+    immediate INTEGER NOT NULL DEFAULT 0
+);
+
+-- Per-batch stage timings and token usage (see tracing.py)
+CREATE TABLE IF NOT EXISTS traces (
+    id INTEGER PRIMARY KEY,
+    trace_id TEXT NOT NULL,
+    session_id TEXT,
+    message_id INTEGER REFERENCES messages(id) ON DELETE SET NULL,
+    outcome TEXT,
+    model TEXT,
+    input_tokens INTEGER,
+    output_tokens INTEGER,
+    total_tokens INTEGER,
+    llm_requests INTEGER,
+    web_searches INTEGER,
+    -- stage name -> milliseconds
+    stages JSON NOT NULL DEFAULT '{}',
+    received_at TIMESTAMP,
+    started_at TIMESTAMP,
+    created_at TIMESTAMP NOT NULL
+);
+
+-- Indexes for performance
+-- Partial indexes only cover the small unprocessed working set, not the whole history
+CREATE INDEX IF NOT EXISTS idx_transcripts_unprocessed ON transcripts(received_at) WHERE processed = 0;
+CREATE INDEX IF NOT EXISTS idx_transcripts_unprocessed_session ON transcripts(session_id, received_at) WHERE processed = 0;
+CREATE INDEX IF NOT EXISTS idx_transcripts_session_id ON transcripts(session_id);
+CREATE INDEX IF NOT EXISTS idx_transcripts_message_id ON transcripts(message_id);
+CREATE INDEX IF NOT EXISTS idx_transcripts_received_at ON transcripts(received_at);
+CREATE INDEX IF NOT EXISTS idx_transcripts_pending_activation ON transcripts(session_id) WHERE processed = 0 AND activation;
+CREATE INDEX IF NOT EXISTS idx_transcripts_dead_lettered ON transcripts(dead_lettered_at) WHERE dead_lettered_at IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_messages_timestamp_id ON messages(timestamp, id);
+CREATE INDEX IF NOT EXISTS idx_messages_session_timestamp_id ON messages(session_id, timestamp, id);
+CREATE INDEX IF NOT EXISTS idx_sms_outbox_pending ON sms_outbox(phone_number, id) WHERE status IN ('pending', 'sending');
+CREATE INDEX IF NOT EXISTS idx_sms_outbox_message_id ON sms_outbox(message_id);
+CREATE INDEX IF NOT EXISTS idx_sms_outbox_sent ON sms_outbox(phone_number, sent_at) WHERE status IN ('sent', 'coalesced');
+CREATE INDEX IF NOT EXISTS idx_sms_outbox_trace_id ON sms_outbox(trace_id) WHERE trace_id IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_traces_created_at ON traces(created_at);
+CREATE INDEX IF NOT EXISTS idx_traces_trace_id ON traces(trace_id);
+CREATE INDEX IF NOT EXISTS idx_traces_message_id ON traces(message_id);
@@ -0,0 +1,110 @@
+"""
+Recently stored segment ids, checked on the ingest path
+
+Omi re-sends overlapping segments across webhooks (and whole payloads on
+retries). Segments whose id this process has already seen stored are
+dropped before activation scanning and before any database work. The
+filter is a bounded LRU set: it only remembers ids after the database has
+confirmed them (inserted or already present), so a failed write is never
+filtered on retry. The transcripts unique constraint stays the source of
+truth; a miss (evicted id, or one stored by another process) just costs
+the usual ON CONFLICT DO NOTHING.
+"""
+
+import os
+import threading
+from collections import OrderedDict
+
+# Configuration
+SEEN_SEGMENTS_SIZE = int(os.getenv('SEEN_SEGMENTS_SIZE', '50000'))  # segment ids kept, 0 disables the filter
+
+_seen = OrderedDict()  # segment_id -> None, least recently seen first
+_lock = threading.Lock()
+_stats = {
+    'lookups': 0,
+    'hits': 0,
+    'remembered': 0,
+    'evictions': 0,
+    # Duplicates the database caught that the filter let through (too small, or stored by another process)
+    'missed_duplicates': 0,
+}
+
+def drop_seen(segments):
+    """
+    Split a payload's segments into unseen ones and known duplicates
+
+    Segments without an id are always kept (storage decides what to do
+    with them).
+
+    Args:
+        segments (list): Segment dicts from one webhook payload, in order
+
+    Returns:
+        tuple: (segments to store, list of dropped segment ids)
+    """
+    if SEEN_SEGMENTS_SIZE <= 0 or not segments:
+        return segments, []
+
+    kept = []
+    dropped = []
+    with _lock:
+        for segment in segments:
+            segment_id = segment.get('id')
+            if segment_id is None:
+                kept.append(segment)
+                continue
+            segment_id = str(segment_id)
+            if segment_id in _seen:
+                _seen.move_to_end(segment_id)
+                dropped.append(segment_id)
+            else:
+                kept.append(segment)
+        _stats['lookups'] += len(segments)
+        _stats['hits'] += len(dropped)
+
+    return kept, dropped
+
+def remember(result):
+    """
+    Record the segment ids of a successful save so later resends are dropped
+
+    Args:
+        result (dict): {'inserted': [segment ids], 'duplicates': [segment ids]}
+                       as returned by save_transcript_segments
+    """
+    if SEEN_SEGMENTS_SIZE <= 0 or not result:
+        return
+
+    evicted = 0
+    with _lock:
+        for segment_id in result['inserted'] + result['duplicates']:
+            _seen[segment_id] = None
+            _seen.move_to_end(segment_id)
+        while len(_seen) > SEEN_SEGMENTS_SIZE:
+            _seen.popitem(last=False)
+            evicted += 1
+        _stats['remembered'] += len(result['inserted']) + len(result['duplicates'])
+        _stats['missed_duplicates'] += len(result['duplicates'])
+        _stats['evictions'] += evicted
+
+def get_stats():
+    """
+    Get seen-segment filter statistics
+
+    hit_rate is the share of all incoming segments dropped by the filter;
+    duplicate_hit_rate is the share of duplicates caught before the database
+    (a low value with evictions > 0 means SEEN_SEGMENTS_SIZE is too small).
+
+    Returns:
+        dict: Size, capacity, counters and hit rates
+    """
+    with _lock:
+        stats = dict(_stats)
+        stats['size'] = len(_seen)
+
+    duplicates = stats['hits'] + stats['missed_duplicates']
+    stats['capacity'] = SEEN_SEGMENTS_SIZE
+    stats['hit_rate'] = round(stats['hits'] / stats['lookups'], 4) if stats['lookups'] else 0.0
+    stats['duplicate_hit_rate'] = round(stats['hits'] / duplicates, 4) if duplicates else 0.0
+
+    return stats
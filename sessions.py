@@ -3,21 +3,68 @@ Session management for Omi-Jarvis conversations
 
 Maps Omi device session IDs to OpenAI Conversation IDs for persistent conversation history.
 Uses OpenAI Conversations API for automatic context management.
+
+Mappings are cached in-process (LRU with a TTL) and written through on
+change, and last_used_at touches are coalesced and flushed in one batched
+UPDATE, so resolving a known session costs no database round trips.
 """
 
 import os
-import psycopg2
+import time
+import atexit
+import threading
+from collections import OrderedDict
+from datetime import datetime
 from agents.memory import OpenAIConversationsSession
 from dotenv import load_dotenv
+import log
+import storage
 
 load_dotenv()
 
-DATABASE_URL = os.getenv('DATABASE_URL')
+logger = log.get_logger('sessions')
+
+# Configuration
+SESSION_CACHE_SIZE = int(os.getenv('SESSION_CACHE_SIZE', '1024'))  # mappings kept in memory
+SESSION_CACHE_TTL = int(os.getenv('SESSION_CACHE_TTL', '3600'))  # seconds before a mapping is re-read
+SESSION_TOUCH_INTERVAL = int(os.getenv('SESSION_TOUCH_INTERVAL', '60'))  # seconds between last_used_at flushes
+
+_cache = OrderedDict()  # omi_session_id -> (openai_conversation_id, expires_at)
+_pending_touches = {}  # omi_session_id -> last use not yet written to sessions.last_used_at
+_cache_lock = threading.Lock()
+_cache_stats = {
+    'hits': 0,
+    'misses': 0,
+    'evictions': 0,
+    'writes': 0,
+    'touch_flushes': 0,
+    'touches_flushed': 0,
+}
+
+
+def _cache_get(omi_session_id: str):
+    """Look up a cached mapping, recording a hit or miss and a pending touch on hit"""
+    with _cache_lock:
+        entry = _cache.get(omi_session_id)
+        if entry is not None and entry[1] > time.monotonic():
+            _cache.move_to_end(omi_session_id)
+            _pending_touches[omi_session_id] = datetime.now()
+            _cache_stats['hits'] += 1
+            return entry[0]
+        if entry is not None:
+            del _cache[omi_session_id]
+        _cache_stats['misses'] += 1
+        return None
 
 
-def get_connection():
-    """Get PostgreSQL database connection"""
-    return psycopg2.connect(DATABASE_URL)
+def _cache_put(omi_session_id: str, openai_conversation_id: str):
+    """Cache a mapping, evicting the least recently used ones beyond SESSION_CACHE_SIZE"""
+    with _cache_lock:
+        _cache[omi_session_id] = (openai_conversation_id, time.monotonic() + SESSION_CACHE_TTL)
+        _cache.move_to_end(omi_session_id)
+        while len(_cache) > SESSION_CACHE_SIZE:
+            _cache.popitem(last=False)
+            _cache_stats['evictions'] += 1
 
 
 def get_session_mapping(omi_session_id: str):
@@ -30,28 +77,24 @@ def get_session_mapping(omi_session_id: str):
     Returns:
         str: OpenAI conversation_id if exists, None otherwise
     """
-    try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        
-        query = "SELECT openai_conversation_id FROM sessions WHERE omi_session_id = %s"
-        cursor.execute(query, (omi_session_id,))
-        result = cursor.fetchone()
-        
-        cursor.close()
-        conn.close()
-        
-        return result[0] if result else None
-        
-    except Exception as e:
-        print(f"ERROR getting session mapping: {str(e)}")
-        return None
+    cached = _cache_get(omi_session_id)
+    if cached is not None:
+        return cached
+    
+    conversation_id = storage.get().get_session_mapping(omi_session_id)
+    if conversation_id:
+        _cache_put(omi_session_id, conversation_id)
+        return conversation_id
+    return None
 
 
 def save_session_mapping(omi_session_id: str, openai_conversation_id: str):
     """
     Save or update Omi session -> OpenAI conversation mapping
     
+    Writes through the cache. If the mapping is already cached unchanged, only
+    a last_used_at touch is queued (see flush_session_touches).
+    
     Args:
         omi_session_id: Session ID from Omi device
         openai_conversation_id: OpenAI conversation ID
@@ -59,30 +102,22 @@ def save_session_mapping(omi_session_id: str, openai_conversation_id: str):
     Returns:
         bool: True if successful, False otherwise
     """
-    try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        
-        query = """
-            INSERT INTO sessions (omi_session_id, openai_conversation_id, last_used_at)
-            VALUES (%s, %s, CURRENT_TIMESTAMP)
-            ON CONFLICT (omi_session_id) 
-            DO UPDATE SET openai_conversation_id = EXCLUDED.openai_conversation_id,
-                          last_used_at = CURRENT_TIMESTAMP
-        """
-        
-        cursor.execute(query, (omi_session_id, openai_conversation_id))
-        conn.commit()
-        
-        cursor.close()
-        conn.close()
-        
-        print(f"Saved session mapping: {omi_session_id} -> {openai_conversation_id}")
-        return True
-        
-    except Exception as e:
-        print(f"ERROR saving session mapping: {str(e)}")
+    with _cache_lock:
+        entry = _cache.get(omi_session_id)
+        if entry is not None and entry[0] == openai_conversation_id and entry[1] > time.monotonic():
+            _pending_touches[omi_session_id] = datetime.now()
+            return True
+    
+    if not storage.get().save_session_mapping(omi_session_id, openai_conversation_id):
         return False
+    
+    _cache_put(omi_session_id, openai_conversation_id)
+    with _cache_lock:
+        _pending_touches.pop(omi_session_id, None)
+        _cache_stats['writes'] += 1
+    
+    logger.info('sessions.saved', omi_session_id=omi_session_id, conversation_id=openai_conversation_id)
+    return True
 
 
 def get_or_create_session(omi_session_id: str) -> OpenAIConversationsSession:
@@ -100,16 +135,16 @@ def get_or_create_session(omi_session_id: str) -> OpenAIConversationsSession:
     if not omi_session_id or omi_session_id.strip() == "":
         import uuid
         omi_session_id = f"unknown_{uuid.uuid4().hex[:8]}"
-        print(f"Warning: Empty session ID, using generated ID: {omi_session_id}")
+        logger.warning('sessions.empty_id', "Empty session ID, using a generated one", omi_session_id=omi_session_id)
     
     # Check database for existing conversation
     existing_conv_id = get_session_mapping(omi_session_id)
     
     if existing_conv_id:
-        print(f"Resuming conversation {existing_conv_id} for Omi session {omi_session_id}")
+        logger.debug('sessions.resumed', omi_session_id=omi_session_id, conversation_id=existing_conv_id)
         return OpenAIConversationsSession(conversation_id=existing_conv_id)
     else:
-        print(f"Creating new conversation for Omi session {omi_session_id}")
+        logger.info('sessions.created', omi_session_id=omi_session_id)
         # Create NEW conversation - OpenAI will generate the conversation_id
         return OpenAIConversationsSession()
 
@@ -136,14 +171,82 @@ def save_conversation_id_for_session(omi_session_id: str, session: OpenAIConvers
         if openai_conv_id:
             return save_session_mapping(omi_session_id, openai_conv_id)
         else:
-            print(f"Warning: Could not extract conversation ID from session for {omi_session_id}")
+            logger.warning('sessions.no_conversation_id', omi_session_id=omi_session_id)
             return False
             
     except Exception as e:
-        print(f"ERROR saving conversation ID for session {omi_session_id}: {str(e)}")
+        logger.error('sessions.save_failed', str(e), omi_session_id=omi_session_id)
         return False
 
 
+def flush_session_touches() -> int:
+    """
+    Write coalesced last_used_at touches to the database in one batched UPDATE
+    
+    Called periodically by the transcript processor (every SESSION_TOUCH_INTERVAL
+    seconds) and at shutdown. Touches are put back if the write fails.
+    
+    Returns:
+        int: Number of sessions touched
+    """
+    with _cache_lock:
+        if not _pending_touches:
+            return 0
+        touches = list(_pending_touches.items())
+        _pending_touches.clear()
+    
+    if storage.get().touch_sessions(touches) is None:
+        with _cache_lock:
+            for omi_session_id, used_at in touches:
+                newer = _pending_touches.get(omi_session_id)
+                if newer is None or newer < used_at:
+                    _pending_touches[omi_session_id] = used_at
+        return 0
+    
+    with _cache_lock:
+        _cache_stats['touch_flushes'] += 1
+        _cache_stats['touches_flushed'] += len(touches)
+    return len(touches)
+
+
+def invalidate_session(omi_session_id: str = None):
+    """
+    Drop a cached mapping, or the whole cache if no session ID is given
+    
+    Args:
+        omi_session_id: Session ID from Omi device, or None for all
+    """
+    with _cache_lock:
+        if omi_session_id is None:
+            _cache.clear()
+        else:
+            _cache.pop(omi_session_id, None)
+
+
+def get_cache_stats() -> dict:
+    """
+    Get session mapping cache statistics
+    
+    Returns:
+        dict: Hit/miss counters, hit rate, size and pending touches
+    """
+    with _cache_lock:
+        stats = dict(_cache_stats)
+        stats['size'] = len(_cache)
+        stats['pending_touches'] = len(_pending_touches)
+    
+    lookups = stats['hits'] + stats['misses']
+    stats['hit_rate'] = round(stats['hits'] / lookups, 4) if lookups else 0.0
+    stats['max_size'] = SESSION_CACHE_SIZE
+    stats['ttl_seconds'] = SESSION_CACHE_TTL
+    
+    return stats
+
+
+# Persist coalesced touches on interpreter / worker shutdown
+atexit.register(flush_session_touches)
+
+
 def get_session_count() -> int:
     """
     Get total number of tracked conversations
@@ -151,27 +254,13 @@ def get_session_count() -> int:
     Returns:
         int: Number of Omi sessions tracked
     """
-    try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute("SELECT COUNT(*) FROM sessions")
-        count = cursor.fetchone()[0]
-        
-        cursor.close()
-        conn.close()
-        
-        return count
-        
-    except Exception as e:
-        print(f"ERROR getting session count: {str(e)}")
-        return 0
+    return storage.get().get_session_count()
 
 
 if __name__ == "__main__":
     # Simple test
     print("=== Session Manager Test ===")
-    print("Testing OpenAI Conversations API integration with PostgreSQL...")
+    print("Testing OpenAI Conversations API integration with the storage backend...")
     
     # Test conversation creation
     test_session_id = "test_omi_session_123"
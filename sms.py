@@ -1,68 +1,230 @@
 """
 SMS module using Textbelt API
 Sends text messages with AI responses
+
+All texts go through one shared SmsClient, which keeps a pooled keep-alive
+HTTP session, bounds every request with connect/read timeouts and retries
+connection errors and 5xx responses with jittered backoff.
 """
 
 import os
+import time
+import random
+import threading
 import requests
+from requests.adapters import HTTPAdapter
 from dotenv import load_dotenv
+import log
+import metrics
 
 load_dotenv()
 
-def send_sms(message, phone_number=None):
+logger = log.get_logger('sms')
+
+# Configuration
+TEXTBELT_BASE_URL = os.getenv('TEXTBELT_BASE_URL', 'https://textbelt.com')  # point at a local stand-in for load tests
+SMS_CONNECT_TIMEOUT = float(os.getenv('SMS_CONNECT_TIMEOUT', '5'))  # seconds
+SMS_READ_TIMEOUT = float(os.getenv('SMS_READ_TIMEOUT', '15'))  # seconds
+SMS_MAX_RETRIES = int(os.getenv('SMS_MAX_RETRIES', '3'))  # retries after the first attempt
+SMS_RETRY_BASE_DELAY = float(os.getenv('SMS_RETRY_BASE_DELAY', '0.5'))  # seconds, doubles per retry
+SMS_POOL_SIZE = int(os.getenv('SMS_POOL_SIZE', '10'))  # keep-alive connections to Textbelt
+
+class SmsClient:
     """
-    Send an SMS using Textbelt API
+    Textbelt client with a pooled session, timeouts and retries
     
-    Args:
-        message (str): The message to send
-        phone_number (str, optional): Phone number to send to. 
-                                      If None, uses PHONE_NUMBER from env
+    Thread-safe; share one instance (see get_client()).
     
-    Returns:
-        dict: Response from Textbelt API, or None if error
+    Only failures where the text can't have been accepted are retried:
+    connection errors (including connect timeouts) and 5xx responses.
+    A read timeout may mean Textbelt already sent the text, so it is not
+    retried to avoid texting twice.
     """
-    try:
-        # Get configuration from environment
-        if phone_number is None:
-            phone_number = os.getenv('PHONE_NUMBER')
+    
+    def __init__(self, base_url=TEXTBELT_BASE_URL, api_key=None, phone_number=None,
+                 connect_timeout=SMS_CONNECT_TIMEOUT, read_timeout=SMS_READ_TIMEOUT,
+                 max_retries=SMS_MAX_RETRIES, retry_base_delay=SMS_RETRY_BASE_DELAY,
+                 pool_size=SMS_POOL_SIZE):
+        self.url = base_url.rstrip('/') + '/text'
+        self.api_key = api_key or os.getenv('TEXTBELT_API_KEY', 'textbelt')
+        self.phone_number = phone_number or os.getenv('PHONE_NUMBER')
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.retry_base_delay = retry_base_delay
+        
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            'sent': 0,
+            'failed': 0,
+            'retries': 0,
+            'latency_total_ms': 0.0,
+            'latency_max_ms': 0.0,
+            'last_latency_ms': 0.0,
+        }
+    
+    @property
+    def max_send_seconds(self):
+        """Longest a single send() can take: every attempt timing out plus the longest backoffs"""
+        attempts = self.max_retries + 1
+        backoff = self.retry_base_delay * (2 ** self.max_retries - 1)
+        return sum(self.timeout) * attempts + backoff
+    
+    def _backoff(self, retry):
+        """Full-jitter exponential backoff before the given retry (1-based)"""
+        time.sleep(random.uniform(0, self.retry_base_delay * 2 ** (retry - 1)))
+    
+    def _record(self, started, success, reason=None):
+        latency_ms = (time.monotonic() - started) * 1000
+        metrics.SMS_SEND_SECONDS.observe(latency_ms / 1000)
+        if not success:
+            metrics.SMS_SEND_FAILURES.inc(reason=reason or 'error')
+        with self._stats_lock:
+            self._stats['sent' if success else 'failed'] += 1
+            self._stats['latency_total_ms'] += latency_ms
+            self._stats['latency_max_ms'] = max(self._stats['latency_max_ms'], latency_ms)
+            self._stats['last_latency_ms'] = latency_ms
+        return latency_ms
+    
+    def send(self, message, phone_number=None):
+        """
+        Send an SMS
         
-        textbelt_key = os.getenv('TEXTBELT_API_KEY', 'textbelt')
+        Args:
+            message (str): The message to send
+            phone_number (str, optional): Phone number to send to.
+                                          If None, uses PHONE_NUMBER from env
         
+        Returns:
+            dict: Response from Textbelt API (with 'latency_ms' added), or None if error
+        """
+        phone_number = phone_number or self.phone_number
         if not phone_number:
-            print("ERROR: No phone number configured")
+            logger.error('sms.no_phone_number')
             return None
         
-        # Prepare the request
-        url = 'https://textbelt.com/text'
         data = {
             'phone': phone_number,
             'message': message,
-            'key': textbelt_key,
+            'key': self.api_key,
         }
         
-        print(f"Sending SMS to {phone_number}...")
-        
-        # Send the request
-        response = requests.post(url, data=data)
-        result = response.json()
+        logger.debug('sms.sending', phone_number=phone_number, length=len(message))
+        started = time.monotonic()
         
-        # Check if successful
-        if result.get('success'):
-            print(f"SMS sent successfully! Text ID: {result.get('textId')}")
-            print(f"Quota remaining: {result.get('quotaRemaining')}")
-            return result
-        else:
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                with self._stats_lock:
+                    self._stats['retries'] += 1
+                self._backoff(attempt)
+            
+            try:
+                response = self.session.post(self.url, data=data, timeout=self.timeout)
+            except requests.exceptions.ReadTimeout:
+                latency_ms = self._record(started, False, 'read_timeout')
+                logger.error('sms.read_timeout', "Not retrying, the text may have been sent", latency_ms=round(latency_ms))
+                return None
+            except requests.exceptions.ConnectionError as e:
+                logger.warning('sms.connection_error', str(e), attempt=attempt + 1, max_attempts=self.max_retries + 1)
+                continue
+            except Exception as e:
+                self._record(started, False, 'error')
+                logger.error('sms.failed', str(e))
+                return None
+            
+            if response.status_code >= 500:
+                logger.warning('sms.server_error', status=response.status_code, attempt=attempt + 1, max_attempts=self.max_retries + 1)
+                continue
+            
+            try:
+                result = response.json()
+            except ValueError:
+                self._record(started, False, 'invalid_response')
+                logger.error('sms.invalid_response', status=response.status_code)
+                return None
+            
+            latency_ms = self._record(started, bool(result.get('success')), 'rejected')
+            result['latency_ms'] = round(latency_ms, 2)
+            
+            # Check if successful
+            if result.get('success'):
+                logger.info('sms.sent', text_id=result.get('textId'), latency_ms=round(latency_ms),
+                            quota_remaining=result.get('quotaRemaining'))
+                return result
+            
             error = result.get('error', 'Unknown error')
-            print(f"ERROR sending SMS: {error}")
-            if 'quotaRemaining' in result:
-                print(f"Quota remaining: {result['quotaRemaining']}")
+            logger.error('sms.rejected', error, quota_remaining=result.get('quotaRemaining'))
             return None
-            
-    except Exception as e:
-        print(f"ERROR sending SMS: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        
+        self._record(started, False, 'retries_exhausted')
+        logger.error('sms.gave_up', attempts=self.max_retries + 1)
         return None
+    
+    def get_stats(self):
+        """
+        Get send statistics
+        
+        Returns:
+            dict: Sent/failed/retry counts and per-send latency
+        """
+        with self._stats_lock:
+            stats = dict(self._stats)
+        
+        sends = stats['sent'] + stats['failed']
+        stats['latency_avg_ms'] = round(stats['latency_total_ms'] / sends, 2) if sends else 0.0
+        stats['latency_max_ms'] = round(stats['latency_max_ms'], 2)
+        stats['last_latency_ms'] = round(stats['last_latency_ms'], 2)
+        stats['base_url'] = self.url
+        del stats['latency_total_ms']
+        
+        return stats
+    
+    def close(self):
+        """Close pooled connections"""
+        self.session.close()
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_client():
+    """Get the shared SMS client, creating it on first use"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = SmsClient()
+    return _client
+
+def send_sms(message, phone_number=None):
+    """
+    Send an SMS using Textbelt API (through the shared client)
+    
+    Args:
+        message (str): The message to send
+        phone_number (str, optional): Phone number to send to. 
+                                      If None, uses PHONE_NUMBER from env
+    
+    Returns:
+        dict: Response from Textbelt API, or None if error
+    """
+    try:
+        return get_client().send(message, phone_number)
+    except Exception:
+        logger.exception('sms.failed')
+        return None
+
+def get_stats():
+    """
+    Get statistics for the shared SMS client
+    
+    Returns:
+        dict: Sent/failed/retry counts and per-send latency
+    """
+    return get_client().get_stats()
 
 def test_sms():
     """
@@ -82,4 +244,3 @@ if __name__ == "__main__":
         print("SMS test successful!")
     else:
         print("SMS test failed!")
-
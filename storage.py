@@ -0,0 +1,164 @@
+"""
+Storage backend selection
+
+Everything the app persists goes through the operations listed in OPERATIONS.
+Each backend is a module implementing all of them as functions with the same
+signatures and return conventions (None / False / {} on error, logged):
+
+- db.py: PostgreSQL, for postgres:// and postgresql:// DATABASE_URLs
+- db_sqlite.py: embedded SQLite in WAL mode, for sqlite:/// URLs
+  (sqlite:///data/jarvis.db is relative, sqlite:////var/lib/jarvis.db absolute)
+
+Callers use get(), which imports the backend for DATABASE_URL on first use,
+so a SQLite deployment never imports psycopg2.
+"""
+
+import os
+import time
+import functools
+import importlib
+import threading
+from urllib.parse import urlparse
+from dotenv import load_dotenv
+import log
+import metrics
+import tracing
+
+load_dotenv()
+
+logger = log.get_logger('storage')
+
+# URL scheme -> backend module
+BACKENDS = {
+    'postgres': 'db',
+    'postgresql': 'db',
+    'sqlite': 'db_sqlite',
+}
+
+# The storage interface: functions every backend module provides
+OPERATIONS = (
+    # Setup and connections
+    'init_db', 'get_connection', 'get_pool_stats', 'listen', 'wait_for_notify',
+    # Transcripts
+    'save_transcript_segment', 'save_transcript_segments', 'get_unprocessed_transcripts',
+    'mark_transcripts_processed', 'claim_transcript_batches', 'complete_transcripts',
+    'release_transcripts', 'sweep_inactive_transcripts', 'ensure_transcript_partitions',
+    'drop_old_transcript_partitions', 'get_transcript_queue_stats',
+    # SMS outbox
+    'enqueue_sms', 'claim_sms_batches', 'extend_sms_lease', 'get_recently_sent_sms', 'complete_sms', 'release_sms',
+    'attach_sms_to_message', 'get_sms_outbox_stats',
+    # Traces
+    'save_trace', 'get_trace_stage_percentiles', 'get_trace',
+    # Messages
+    'save_message', 'get_conversation_history', 'get_all_messages', 'get_messages_page', 'iter_messages',
+    # Session mappings
+    'get_session_mapping', 'save_session_mapping', 'touch_sessions', 'get_session_count',
+)
+
+_backend = None
+_backend_lock = threading.Lock()
+
+def backend_name(url=None):
+    """
+    Get the backend module name for a database URL
+
+    Args:
+        url (str, optional): Database URL (default: DATABASE_URL); unset means Postgres
+
+    Returns:
+        str: Module name, e.g. 'db' or 'db_sqlite'
+
+    Raises:
+        ValueError: If the URL scheme has no backend
+    """
+    url = url if url is not None else os.getenv('DATABASE_URL', '')
+    scheme = urlparse(url).scheme.split('+')[0].lower() if url else 'postgresql'
+    if scheme not in BACKENDS:
+        raise ValueError(f"Unsupported DATABASE_URL scheme '{scheme}' (expected one of {', '.join(BACKENDS)})")
+    return BACKENDS[scheme]
+
+def load(url=None):
+    """
+    Import the backend module for a database URL and check it implements the interface
+
+    Args:
+        url (str, optional): Database URL (default: DATABASE_URL)
+
+    Returns:
+        module: Backend module
+
+    Raises:
+        ValueError: If the URL scheme has no backend
+        NotImplementedError: If the backend is missing operations
+    """
+    module = importlib.import_module(backend_name(url))
+    missing = [name for name in OPERATIONS if not callable(getattr(module, name, None))]
+    if missing:
+        raise NotImplementedError(f"Storage backend {module.__name__} is missing {', '.join(missing)}")
+    return module
+
+def get():
+    """Get the backend selected by DATABASE_URL, loading it on first use"""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = load()
+                logger.info('storage.backend', backend=_backend.__name__)
+    return _backend
+
+def timed_query(func):
+    """Record a storage function's run time in the per-function query histogram and the current trace's db stage"""
+    name = func.__name__
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - started
+            metrics.DB_QUERY_SECONDS.observe(elapsed, function=name)
+            tracing.add_stage('db', elapsed * 1000)
+
+    return wrapper
+
+def segment_rows(segments, session_id=None):
+    """
+    Turn a webhook payload's segments into transcripts rows
+
+    Drops segments without an id (segment_id is NOT NULL, so one bad row would
+    fail the whole batch) and repeats of an id within the payload.
+
+    Args:
+        segments (list): Segment dicts from Omi webhook (flagged with 'activation' at ingest)
+        session_id (str, optional): Session ID applied to segments that don't carry one
+
+    Returns:
+        list: (segment_id, text, speaker, speaker_id, is_user, start_time, end_time,
+               session_id, activation, trace_id) tuples in payload order
+    """
+    rows = []
+    seen = set()
+    for segment in segments:
+        segment_id = segment.get('id')
+        if segment_id is None:
+            logger.warning('transcripts.missing_id', "Skipping transcript segment without an id")
+            continue
+        segment_id = str(segment_id)
+        if segment_id in seen:
+            continue
+        seen.add(segment_id)
+        rows.append((
+            segment_id,
+            segment.get('text', ''),
+            segment.get('speaker', 'UNKNOWN'),
+            segment.get('speaker_id', 0),
+            segment.get('is_user', False),
+            segment.get('start', 0.0),
+            segment.get('end', 0.0),
+            segment.get('session_id', session_id),
+            bool(segment.get('activation', False)),
+            segment.get('trace_id')
+        ))
+    return rows
@@ -4,10 +4,14 @@ Uses @function_tool decorator from OpenAI Agents SDK
 """
 
 from agents import function_tool
-import sms
+import log
+import outbox
+import tracing
+
+logger = log.get_logger('tools')
 
 @function_tool
-def send_text_message(message: str) -> str:
+async def send_text_message(message: str) -> str:
     """
     Send an SMS text message to Braden's phone.
     Use this when you have information to share with him.
@@ -16,26 +20,12 @@ def send_text_message(message: str) -> str:
         message: The text message to send. Write naturally as if texting a friend.
     
     Returns:
-        Status message indicating success or failure
+        Status message with a handle for the text, which is delivered in the background
     """
-    print("\n" + "="*60)
-    print("📱 SEND TEXT MESSAGE TOOL EXECUTED")
-    print("="*60)
-    print(f"Message Content:")
-    print("-"*60)
-    print(message)
-    print("-"*60)
-    print(f"Message Length: {len(message)} characters")
-    print("="*60 + "\n")
-    
-    result = sms.send_sms(message)
+    # Queued and delivered in the background; the agent run doesn't wait for Textbelt
+    with tracing.stage('tool.send_text_message'):
+        handle = outbox.dispatch(message, source='tool')
     
-    if result and result.get('success'):
-        print(f"✅ Text sent successfully! Text ID: {result.get('textId')}")
-        print(f"   Quota Remaining: {result.get('quotaRemaining')}\n")
-        return "Text message sent successfully"
-    else:
-        error = result.get('error', 'Unknown error') if result else 'Failed'
-        print(f"❌ Text failed: {error}\n")
-        return f"Failed to send text: {error}"
-
+    logger.info('tools.send_text_message', handle=handle.id, length=len(message), trace_id=tracing.current_id())
+    logger.dump('tools.send_text_message.body', message, handle=handle.id)
+    return f"Text message dispatched for delivery (handle {handle.id})"
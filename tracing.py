@@ -0,0 +1,124 @@
+"""
+Per-batch tracing from segment arrival to SMS delivery
+
+The webhook stamps every segment with a trace ID. When the processor picks up
+an activated batch it adopts the trace ID of the activating segment, makes
+the trace current (a context variable, so it follows the batch into the
+agent's event loop, tool calls and worker threads) and accumulates stage
+timings into it. The finished trace is stored in the traces table next to
+its message; texts queued during the run carry the trace ID in sms_outbox,
+so delivery timings are joined in at query time (see db.get_trace_stage_percentiles).
+"""
+
+import os
+import time
+import uuid
+import threading
+import contextvars
+from contextlib import contextmanager
+
+# Configuration
+TRACING_ENABLED = os.getenv('TRACING_ENABLED', 'true').lower() == 'true'  # false skips writing traces rows
+
+# Trace of the batch being processed in the current thread / task
+current_trace = contextvars.ContextVar('current_trace', default=None)
+
+def new_id():
+    """
+    Generate a trace ID
+
+    Returns:
+        str: 16 hex characters
+    """
+    return uuid.uuid4().hex[:16]
+
+class Trace:
+    """
+    Stage timings and run attributes for one processed batch
+
+    Thread-safe: stages are recorded from the processor thread, the agent
+    event loop and worker threads at the same time.
+    """
+
+    def __init__(self, trace_id=None, session_id=None, received_at=None):
+        self.id = trace_id or new_id()
+        self.session_id = session_id
+        self.received_at = received_at  # arrival of the activating segment
+        self.started = time.monotonic()
+        self.stages = {}
+        self.attributes = {}
+        self._lock = threading.Lock()
+
+    def add(self, stage, elapsed_ms):
+        """Add elapsed milliseconds to a stage (repeated stages accumulate)"""
+        with self._lock:
+            self.stages[stage] = self.stages.get(stage, 0.0) + elapsed_ms
+
+    def set(self, **attributes):
+        """Record run attributes such as model and token usage"""
+        with self._lock:
+            self.attributes.update(attributes)
+
+    @contextmanager
+    def stage(self, name):
+        """Time a block into a stage"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, (time.perf_counter() - started) * 1000)
+
+    def elapsed_ms(self):
+        """Milliseconds since the trace was started"""
+        return (time.monotonic() - self.started) * 1000
+
+    def snapshot(self):
+        """
+        Get the recorded stages and attributes
+
+        Returns:
+            tuple: (stages dict rounded to 0.01 ms, attributes dict)
+        """
+        with self._lock:
+            return {k: round(v, 2) for k, v in self.stages.items()}, dict(self.attributes)
+
+@contextmanager
+def activate(trace):
+    """Make a trace current for the duration of a block"""
+    token = current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        current_trace.reset(token)
+
+def current_id():
+    """
+    Get the current trace's ID
+
+    Returns:
+        str: Trace ID, or None outside a traced batch
+    """
+    trace = current_trace.get()
+    return trace.id if trace is not None else None
+
+def set_attributes(**attributes):
+    """Record attributes on the current trace, if any"""
+    trace = current_trace.get()
+    if trace is not None:
+        trace.set(**attributes)
+
+def add_stage(name, elapsed_ms):
+    """Add elapsed milliseconds to a stage of the current trace, if any"""
+    trace = current_trace.get()
+    if trace is not None:
+        trace.add(name, elapsed_ms)
+
+@contextmanager
+def stage(name):
+    """Time a block into a stage of the current trace (no-op outside a traced batch)"""
+    trace = current_trace.get()
+    if trace is None:
+        yield
+        return
+    with trace.stage(name):
+        yield
@@ -1,125 +1,309 @@
+import os
 import time
+import uuid
+import socket
 import threading
-from datetime import datetime
-import db
+from concurrent.futures import ThreadPoolExecutor
+import log
+import metrics
+import tracing
+import storage
+import sessions
+import outbox
 import ai_handler
+import context_builder
 
 # Configuration
 POLL_INTERVAL = 10  # seconds
+PROCESSOR_MODE = os.getenv('PROCESSOR_MODE', 'notify').lower()  # 'notify' or 'poll'
+FALLBACK_POLL_INTERVAL = int(os.getenv('FALLBACK_POLL_INTERVAL', '60'))  # seconds, notify mode safety net
+PROCESSOR_CONCURRENCY = int(os.getenv('PROCESSOR_CONCURRENCY', '4'))  # sessions processed in parallel
+LEASE_SECONDS = int(os.getenv('PROCESSOR_LEASE_SECONDS', '300'))  # claim validity before another processor may take over
+MAX_ATTEMPTS = int(os.getenv('PROCESSOR_MAX_ATTEMPTS', '5'))  # attempts per batch before dead-lettering
+RETRY_BASE_DELAY = float(os.getenv('PROCESSOR_RETRY_BASE_DELAY', '5'))  # seconds, doubles per attempt
+RETRY_MAX_DELAY = float(os.getenv('PROCESSOR_RETRY_MAX_DELAY', '300'))  # seconds
+SWEEP_INTERVAL = int(os.getenv('SWEEP_INTERVAL', '30'))  # seconds between sweeps of non-activated rows
+SWEEP_GRACE_SECONDS = int(os.getenv('SWEEP_GRACE_SECONDS', '60'))  # ambient rows kept as context for late activations
+RETENTION_INTERVAL = int(os.getenv('RETENTION_INTERVAL', '21600'))  # seconds between partition maintenance runs
+TRANSCRIPT_RETENTION_MONTHS = int(os.getenv('TRANSCRIPT_RETENTION_MONTHS', '0'))  # 0 keeps transcripts forever
 RUNNING = False
 
-# Activation phrases (case-insensitive)
-ACTIVATION_PHRASES = [
-    "hey jarvis",
-    "hey, jarvis",
-    "hi jarvis",
-    "hi, jarvis",
-    "hello jarvis",
-    "hello, jarvis",
-    "okay jarvis",
-    "okay, jarvis",
-    "ok jarvis",
-    "ok, jarvis",
-]
+logger = log.get_logger('processor')
 
+# Identifies this processor's claims; unique per process so gunicorn workers
+# and other hosts can share the transcripts table safely
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+# Per-session dispatch state
+# The database lease guarantees a session has at most one batch in flight
+# across all processors, which keeps ordering within a session
+_executor = None
+_in_flight = set()  # session ids with a batch currently being processed here
+_dispatch_lock = threading.Lock()
+_last_sweep = 0.0
+_last_touch_flush = 0.0
+_last_retention = None
+
+def _get_executor():
+    """Get the session worker pool, creating it on first use"""
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=PROCESSOR_CONCURRENCY,
+            thread_name_prefix='session-worker'
+        )
+    return _executor
+
+@metrics.timed(metrics.PROCESSOR_CYCLE_SECONDS)
 def process_transcripts():
     """
     Main processing function that runs every POLL_INTERVAL seconds
-    Checks for unprocessed transcripts, batches them, and sends to AI
+    Claims unprocessed transcripts session by session, up to the number of
+    free workers, and dispatches each session's batch to the worker pool
     """
     try:
-        # Get unprocessed transcripts
-        transcripts = db.get_unprocessed_transcripts()
+        with _dispatch_lock:
+            free_workers = PROCESSOR_CONCURRENCY - len(_in_flight)
+            if free_workers <= 0:
+                return
+            
+            batches = storage.get().claim_transcript_batches(WORKER_ID, free_workers, LEASE_SECONDS, MAX_ATTEMPTS)
+            
+            if not batches:
+                logger.debug('processor.idle', "No new transcripts to process")
+                return
+            
+            for session_id, batch in batches.items():
+                _in_flight.add(session_id)
+                _get_executor().submit(_run_session_batch, session_id, batch)
         
-        if not transcripts:
-            print(f"[{datetime.now().strftime('%H:%M:%S')}] No new transcripts to process")
-            return
-        
-        print("\n" + "="*60)
-        print(f"PROCESSING {len(transcripts)} NEW TRANSCRIPT(S)")
-        print("="*60)
+    except Exception:
+        logger.exception('processor.dispatch_failed')
+
+def _start_trace(session_id, transcripts):
+    """Continue the trace of the batch's first activating segment (assigned by the webhook)"""
+    activating = next((t for t in transcripts if t.get('activation')), transcripts[0])
+    return tracing.Trace(activating.get('trace_id'), session_id, activating.get('received_at'))
+
+def _save_trace(trace, outcome):
+    """Store the trace of a batch that reached the agent"""
+    if not tracing.TRACING_ENABLED or outcome in ('empty', 'no_activation'):
+        return
+    elapsed_ms = trace.elapsed_ms()
+    trace.add('processing', elapsed_ms)
+    stages, attributes = trace.snapshot()
+    storage.get().save_trace(
+        trace.id, trace.session_id, outcome, stages, elapsed_ms,
+        message_id=attributes.get('message_id'), model=attributes.get('model'),
+        usage=attributes.get('usage'), web_searches=attributes.get('web_searches'),
+        received_at=trace.received_at
+    )
+
+def _run_session_batch(session_id, transcripts):
+    """
+    Worker pool entry point: process one session's batch, then release the session
+    """
+    try:
+        trace = _start_trace(session_id, transcripts)
+        with tracing.activate(trace), metrics.timed(metrics.PROCESSOR_BATCH_SECONDS):
+            outcome = process_session_batch(session_id, transcripts)
+        metrics.PROCESSOR_BATCHES.inc(outcome=outcome)
+        _save_trace(trace, outcome)
+    finally:
+        with _dispatch_lock:
+            _in_flight.discard(session_id)
         
-        # IMPORTANT: Mark as processed FIRST to prevent duplicate processing
-        # This prevents race conditions where new transcripts arrive during AI processing
-        transcript_ids = [t['id'] for t in transcripts]
-        db.mark_transcripts_processed(transcript_ids, None)
+        # A worker just freed up; pick up rows that arrived for this session
+        # (or other sessions) while it was busy
+        if RUNNING:
+            process_transcripts()
+
+def _retry_later(transcript_ids, error):
+    """Release a failed batch for retry (or dead-letter it after MAX_ATTEMPTS)"""
+    storage.get().release_transcripts(
+        transcript_ids, WORKER_ID, error,
+        MAX_ATTEMPTS, RETRY_BASE_DELAY, RETRY_MAX_DELAY
+    )
+
+def _squash(text):
+    """Collapse whitespace, so texted chunks compare equal to the text they were cut from"""
+    return ' '.join(text.split())
+
+def _text_response(text, label=None, immediate=False):
+    """Queue (part of) an AI response for texting to the user and log the outcome"""
+    sms_result = outbox.enqueue(text, source='response', immediate=immediate)
+    
+    if sms_result.get('success'):
+        logger.info('processor.response_texted', part=label, length=len(text),
+                    queued=sms_result.get('queued'), outbox_id=sms_result.get('outbox_id'),
+                    text_id=sms_result.get('textId'))
+    else:
+        logger.error('processor.response_text_failed', sms_result.get('error', 'Unknown error'), part=label)
+    
+    return sms_result
+
+def process_session_batch(session_id, transcripts):
+    """
+    Process a batch of claimed transcripts from a single session
+    Sends the batch to AI if any of its segments was flagged as an activation
+    
+    The batch stays leased to this processor until it is completed, or
+    released for retry if the AI call fails.
+    
+    Args:
+        session_id (str): Omi session ID the transcripts belong to
+        transcripts (list): The session's claimed transcripts, oldest first
         
-        # Format transcripts into user message
-        user_message = ai_handler.format_transcripts_for_ai(transcripts)
+    Returns:
+        str: Outcome - 'empty', 'no_activation', 'responded', 'partial', 'retry' or 'failed'
+    """
+    transcript_ids = [t['id'] for t in transcripts]
+    settled = False
+    
+    try:
+        logger.info('processor.batch_started', session_id=session_id, transcripts=len(transcripts),
+                    trace_id=tracing.current_id())
         
-        if not user_message.strip():
-            print("Warning: Transcripts formatted to empty message, skipping")
-            return
-        
-        # Check if message contains any activation phrase
-        user_message_lower = user_message.lower()
-        activated = False
-        detected_phrase = None
-        
-        for phrase in ACTIVATION_PHRASES:
-            if phrase in user_message_lower:
-                activated = True
-                detected_phrase = phrase
-                break
+        # Activation phrases are flagged at ingest (see activation.flag_activations)
+        activated = [t for t in transcripts if t.get('activation')]
         
         if not activated:
-            print(f"Skipping AI call - no activation phrase detected")
-            print(f"Transcript: {user_message[:100]}...")
-            # Already marked as processed at the start
-            return
+            logger.info('processor.no_activation', session_id=session_id)
+            # Claims normally require an activation and ambient rows reach the
+            # summary through the sweep (see run_maintenance); keep them anyway
+            context_builder.absorb(session_id, transcripts)
+            settled = storage.get().complete_transcripts(transcript_ids, WORKER_ID)
+            return 'no_activation'
         
-        print(f"Activation phrase '{detected_phrase}' detected!")
+        # Speech around the activations verbatim, older speech as a rolling summary
+        with tracing.stage('context'):
+            user_message = context_builder.build_prompt(session_id, transcripts)
+        
+        if not user_message.strip():
+            logger.warning('processor.empty_batch', session_id=session_id)
+            settled = storage.get().complete_transcripts(transcript_ids, WORKER_ID)
+            return 'empty'
         
-        # Get session ID from transcripts
-        session_id = transcripts[0].get('session_id', 'unknown') if transcripts else 'unknown'
+        logger.info('processor.activated', session_id=session_id, segments=len(activated),
+                    transcripts=len(transcripts), prompt_chars=len(user_message))
         
         # Send to Jarvis - SDK handles tools automatically!
-        ai_response = ai_handler.send_to_jarvis(user_message, session_id)
+        # In streaming mode the response is texted chunk by chunk as it is generated
+        # Texts sent for this response (tool texts and the response itself),
+        # attached to the AI message once it is saved
+        texts = []
+        streamed_chunks = []
+        stream_closed = False
+        stream_lock = threading.Lock()
+        on_chunk = None
+        if ai_handler.STREAM_RESPONSES:
+            def on_chunk(chunk):
+                with stream_lock:
+                    if stream_closed:
+                        # The run timed out and the batch was settled without this chunk
+                        logger.warning('processor.late_chunk_dropped', session_id=session_id, length=len(chunk))
+                        return
+                    streamed_chunks.append(chunk)
+                    # The first part skips the coalescing window so it isn't held back for the rest
+                    texts.append(_text_response(chunk, f"part {len(streamed_chunks)}",
+                                                immediate=len(streamed_chunks) == 1).get('outbox_id'))
+        
+        ai_response = ai_handler.send_to_jarvis(user_message, session_id, on_chunk=on_chunk, sent_texts=texts)
+        outcome = 'responded'
+        
+        # After a timeout the run may still be delivering chunks: close the stream
+        # first, so the retry-or-keep decision below sees every chunk that was texted
+        with stream_lock:
+            stream_closed = True
+        
+        if ai_response is None and streamed_chunks:
+            # Part of the answer already reached the user; retrying would text it twice
+            logger.error('processor.partial_response', "Agent run failed after streaming started, keeping the partial response",
+                         session_id=session_id, chunks=len(streamed_chunks))
+            ai_response = "\n".join(streamed_chunks)
+            outcome = 'partial'
+        elif ai_response is not None and streamed_chunks and _squash(" ".join(streamed_chunks)) != _squash(ai_response):
+            # Text written before a tool call was already texted: save what the user got
+            logger.info('processor.streamed_text_differs', session_id=session_id, chunks=len(streamed_chunks),
+                        response_chars=len(ai_response))
+            ai_response = "\n".join(streamed_chunks)
         
         if ai_response is None:
-            print("ERROR: Failed to get AI response, will retry next cycle")
-            return
+            logger.error('processor.no_response', "Releasing batch for retry", session_id=session_id)
+            _retry_later(transcript_ids, "Failed to get AI response")
+            settled = True
+            return 'retry'
+        
+        # From here on the AI has answered, so the batch must not be retried
+        settled = True
         
         # Save user message
-        user_message_id = db.save_message('user', user_message)
+        user_message_id = storage.get().save_message('user', user_message, session_id=session_id)
         
         if user_message_id is None:
-            print("ERROR: Failed to save user message")
-            return
+            logger.error('processor.save_failed', message_type='user', session_id=session_id)
         
-        # ALWAYS text the AI response to user
-        print("\n" + "="*60)
-        print("SENDING AI RESPONSE VIA SMS")
-        print("="*60)
-        print(f"Response: {ai_response[:100]}{'...' if len(ai_response) > 100 else ''}")
-        print("="*60 + "\n")
-        
-        import sms
-        sms_result = sms.send_sms(ai_response)
-        
-        if sms_result and sms_result.get('success'):
-            print(f"✅ AI response texted successfully! Text ID: {sms_result.get('textId')}")
-        else:
-            error = sms_result.get('error', 'Unknown error') if sms_result else 'Failed'
-            print(f"❌ Failed to text AI response: {error}")
+        # ALWAYS text the AI response to user (already done chunk by chunk when streaming)
+        if on_chunk is None:
+            texts.append(_text_response(ai_response, immediate=True).get('outbox_id'))
         
         # Save AI response (tool execution handled by SDK)
-        ai_message_id = db.save_message('ai', ai_response)
+        ai_message_id = storage.get().save_message('ai', ai_response, session_id=session_id)
         
         if ai_message_id is None:
-            print("ERROR: Failed to save AI message")
+            logger.error('processor.save_failed', message_type='ai', session_id=session_id)
+        else:
+            tracing.set_attributes(message_id=ai_message_id)
+            # Delivery status is then readable with the message (see GET /conversation)
+            outbox.attach(texts, ai_message_id)
         
-        # Update transcripts to link them to the user message
-        # (already marked as processed at the start)
-        db.mark_transcripts_processed(transcript_ids, user_message_id)
+        # Mark transcripts processed and link them to the user message
+        storage.get().complete_transcripts(transcript_ids, WORKER_ID, user_message_id)
         
-        print(f"Successfully processed {len(transcripts)} transcript(s)")
-        print("="*60 + "\n")
+        logger.info('processor.batch_completed', session_id=session_id, transcripts=len(transcripts),
+                    trace_id=tracing.current_id())
+        return outcome
         
     except Exception as e:
-        print(f"ERROR in process_transcripts: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception('processor.batch_failed', session_id=session_id)
+        
+        if not settled:
+            _retry_later(transcript_ids, str(e))
+        else:
+            storage.get().complete_transcripts(transcript_ids, WORKER_ID)
+        return 'failed'
+
+def run_maintenance():
+    """
+    Periodic housekeeping, run from the processor loop
+    Sweeps ambient transcripts that never got an activation every SWEEP_INTERVAL
+    seconds (folding them into their session's rolling summary), flushes coalesced session last_used_at touches every
+    SESSION_TOUCH_INTERVAL seconds, and every RETENTION_INTERVAL seconds creates
+    upcoming transcripts partitions and drops expired ones
+    """
+    global _last_sweep, _last_touch_flush, _last_retention
+    
+    now = time.monotonic()
+    
+    if now - _last_sweep >= SWEEP_INTERVAL:
+        _last_sweep = now
+        swept = storage.get().sweep_inactive_transcripts(SWEEP_GRACE_SECONDS)
+        # Ambient speech never reaches a claimed batch; it only feeds the rolling summary
+        for session_id, transcripts in swept.items():
+            try:
+                context_builder.absorb(session_id, transcripts)
+            except Exception:
+                logger.exception('processor.summary_failed', session_id=session_id)
+    
+    if now - _last_touch_flush >= sessions.SESSION_TOUCH_INTERVAL:
+        _last_touch_flush = now
+        sessions.flush_session_touches()
+    
+    if _last_retention is None or now - _last_retention >= RETENTION_INTERVAL:
+        _last_retention = now
+        storage.get().ensure_transcript_partitions()
+        if TRANSCRIPT_RETENTION_MONTHS > 0:
+            storage.get().drop_old_transcript_partitions(TRANSCRIPT_RETENTION_MONTHS)
 
 def polling_loop():
     """
@@ -127,23 +311,76 @@ def polling_loop():
     """
     global RUNNING
     
-    print("\n" + "="*60)
-    print("TRANSCRIPT PROCESSOR STARTED")
-    print(f"Polling every {POLL_INTERVAL} seconds for new transcripts")
-    print("="*60 + "\n")
+    logger.info('processor.started', mode='poll', poll_interval=POLL_INTERVAL)
     
     while RUNNING:
         try:
             process_transcripts()
+            run_maintenance()
+            time.sleep(POLL_INTERVAL)
+        except KeyboardInterrupt:
+            logger.info('processor.interrupted')
+            break
+        except Exception:
+            logger.exception('processor.loop_error')
             time.sleep(POLL_INTERVAL)
+    
+    logger.info('processor.stopped')
+
+def notify_loop():
+    """
+    Background loop driven by Postgres LISTEN/NOTIFY (or in-process wakeups on SQLite)
+    
+    Blocks on the new_transcripts channel and processes as soon as an insert
+    is signalled, with a slow fallback poll every FALLBACK_POLL_INTERVAL seconds
+    in case a notification is missed. If listening fails, degrades to polling
+    every POLL_INTERVAL seconds until the connection can be re-established.
+    """
+    global RUNNING
+    
+    logger.info('processor.started', mode='notify', channel=storage.get().NOTIFY_CHANNEL,
+                fallback_poll_interval=FALLBACK_POLL_INTERVAL)
+    
+    listen_conn = None
+    last_poll = 0.0
+    
+    while RUNNING:
+        try:
+            if listen_conn is None or listen_conn.closed:
+                listen_conn = storage.get().listen()
+                # Catch up on anything that arrived while we weren't listening
+                process_transcripts()
+                last_poll = time.monotonic()
+            
+            # Wake up at least every SWEEP_INTERVAL for housekeeping
+            notifications = storage.get().wait_for_notify(listen_conn, min(FALLBACK_POLL_INTERVAL, SWEEP_INTERVAL))
+            
+            if not RUNNING:
+                break
+            
+            if notifications or time.monotonic() - last_poll >= FALLBACK_POLL_INTERVAL:
+                process_transcripts()
+                last_poll = time.monotonic()
+            
+            run_maintenance()
         except KeyboardInterrupt:
-            print("\nTranscript processor interrupted")
+            logger.info('processor.interrupted')
             break
         except Exception as e:
-            print(f"ERROR in polling loop: {str(e)}")
+            logger.error('processor.listen_failed', f"{str(e)}, falling back to polling")
+            if listen_conn is not None:
+                try:
+                    listen_conn.close()
+                except Exception:
+                    pass
+                listen_conn = None
+            process_transcripts()
             time.sleep(POLL_INTERVAL)
     
-    print("\nTranscript processor stopped")
+    if listen_conn is not None:
+        listen_conn.close()
+    
+    logger.info('processor.stopped')
 
 def start_processor():
     """
@@ -152,13 +389,14 @@ def start_processor():
     global RUNNING
     
     if RUNNING:
-        print("Transcript processor already running")
+        logger.warning('processor.already_running')
         return
     
     RUNNING = True
     
-    # Start polling thread
-    thread = threading.Thread(target=polling_loop, daemon=True)
+    # Start processor thread
+    target = notify_loop if PROCESSOR_MODE == 'notify' else polling_loop
+    thread = threading.Thread(target=target, daemon=True)
     thread.start()
     
     return thread
@@ -167,9 +405,14 @@ def stop_processor():
     """
     Stop the background transcript processor
     """
-    global RUNNING
+    global RUNNING, _executor
     RUNNING = False
-    print("Stopping transcript processor...")
+    logger.info('processor.stopping')
+    
+    if _executor is not None:
+        # Let in-flight session batches finish in the background
+        _executor.shutdown(wait=False)
+        _executor = None
 
 def set_poll_interval(seconds):
     """
@@ -180,5 +423,5 @@ def set_poll_interval(seconds):
     """
     global POLL_INTERVAL
     POLL_INTERVAL = seconds
-    print(f"Poll interval set to {seconds} seconds")
+    logger.info('processor.poll_interval_set', seconds=seconds)
 
@@ -0,0 +1,395 @@
+"""
+Overlap-aware assembly of transcript segments into speaker turns
+
+Omi sends partial and overlapping segments ("what's the", then "what's the
+weather" under a new id), and batches arrive in received_at order rather
+than speech order. The assembler orders segments by start_time, collapses
+segments whose text is already contained in (or extended by) an overlapping
+segment of the same speaker, trims words repeated at the seam of two
+overlapping segments, and merges consecutive segments of one speaker into
+a single turn.
+
+State is kept per session, so a later batch extends the existing turns:
+a segment continuing the last speaker's turn joins it, a resent fragment
+collapses into what was already assembled, and a retried batch maps back
+onto the same turns instead of being assembled twice.
+"""
+
+import os
+import re
+import bisect
+import threading
+from collections import OrderedDict
+
+# Configuration
+TURN_GAP_SECONDS = float(os.getenv('TURN_GAP_SECONDS', '2'))  # longest pause inside one speaker turn
+TURN_MAX_CHARS = int(os.getenv('TURN_MAX_CHARS', '600'))  # longer monologues are split into several turns
+MAX_TURNS = 200  # turns remembered per session
+MAX_TRACKED_SESSIONS = 1024
+
+# Words that must repeat at the seam of two segments before they are trimmed
+# (only segments of one speaker that overlap in time are compared)
+MIN_SEAM_WORDS = 1
+
+_PUNCT_RE = re.compile(r"[^\w']+")
+
+class _Piece:
+    """
+    A collapsed segment: one or more Omi segments carrying the same speech
+
+    keys lists every segment folded into the piece; owners only those whose
+    text the piece carries (the segment that created it and those that
+    extended it). A piece belongs to the last batch that sent one of its
+    owners, and is flagged as an activation only for the batch whose owner
+    carried the activation, so a fragment resent in a later batch doesn't
+    bring an already answered turn back.
+    """
+
+    __slots__ = ('keys', 'owners', 'id', 'speaker', 'text', 'words', 'start', 'end',
+                 'activation', 'activation_batch', 'batch')
+
+    def __init__(self, key, transcript, start, end, batch):
+        self.keys = [key]
+        self.owners = {key}
+        self.id = transcript.get('id')
+        self.speaker = transcript.get('speaker') or 'UNKNOWN'
+        self.start = start
+        self.end = end
+        self.activation = bool(transcript.get('activation'))
+        self.activation_batch = batch if self.activation else None
+        self.batch = batch
+        self.set_text(' '.join((transcript.get('text') or '').split()))
+
+    def set_text(self, text):
+        self.text = text
+        self.words = [w for w in (_PUNCT_RE.sub('', t.lower()) for t in text.split()) if w]
+
+    def drop_words(self, count):
+        """Remove the first count words (punctuation-only tokens don't count)"""
+        tokens = self.text.split()
+        index = 0
+        while index < len(tokens) and count > 0:
+            if _PUNCT_RE.sub('', tokens[index].lower()):
+                count -= 1
+            index += 1
+        while index < len(tokens) and not _PUNCT_RE.sub('', tokens[index].lower()):
+            index += 1
+        self.set_text(' '.join(tokens[index:]))
+
+    def absorb(self, key, transcript, batch, owner=False):
+        """
+        Record that another segment's speech is carried by this piece
+
+        Only an owner moves the piece into the given batch; any other
+        segment is just recorded as seen.
+        """
+        if key not in self.keys:
+            self.keys.append(key)
+        if transcript.get('id') is not None and (self.id is None or transcript['id'] > self.id):
+            self.id = transcript['id']
+        if not owner:
+            return
+        self.owners.add(key)
+        self.batch = batch
+        if transcript.get('activation'):
+            self.activation = True
+            self.activation_batch = batch
+
+class _Turn:
+    """Consecutive pieces of one speaker, in start order"""
+
+    __slots__ = ('speaker', 'pieces', 'chars')
+
+    def __init__(self, piece):
+        self.speaker = piece.speaker
+        self.pieces = [piece]
+        self.chars = len(piece.text)
+
+    @property
+    def start(self):
+        return self.pieces[0].start
+
+    @property
+    def end(self):
+        return max(p.end for p in self.pieces)
+
+    def add(self, piece):
+        starts = [p.start for p in self.pieces]
+        self.pieces.insert(bisect.bisect_right(starts, piece.start), piece)
+        self.chars += len(piece.text) + 1
+
+def _contains(outer, inner):
+    """Whether the word list inner appears contiguously in outer"""
+    if not inner:
+        return True
+    if len(inner) > len(outer):
+        return False
+    return f" {' '.join(inner)} " in f" {' '.join(outer)} "
+
+def _seam(before, after):
+    """Number of leading words of after that repeat the trailing words of before"""
+    for size in range(min(len(before), len(after)), MIN_SEAM_WORDS - 1, -1):
+        if before[-size:] == after[:size]:
+            return size
+    return 0
+
+class TurnAssembler:
+    """
+    Incrementally assembles one session's segments into speaker turns
+
+    Not thread-safe on its own; the module-level assemble() serializes
+    access per session.
+    """
+
+    def __init__(self, max_turns=MAX_TURNS):
+        self.max_turns = max_turns
+        self.turns = []
+        self._pieces = {}  # segment key -> piece carrying its speech
+        self._batches = 0
+        self.stats = {'segments': 0, 'collapsed': 0, 'extended': 0, 'trimmed': 0, 'repeated': 0}
+
+    def add(self, transcripts):
+        """
+        Add a batch of segments and return the batch's view of the turns
+
+        Args:
+            transcripts (list): Transcript dicts (text, speaker, start_time,
+                                end_time, activation, id / segment_id), any order
+
+        Returns:
+            list: Turn dicts in speech order, with the same keys the
+                  formatting code reads from transcripts ('speaker', 'text',
+                  'start_time', 'end_time', 'activation', 'id'), plus
+                  'ids' (row ids of the turn's pieces) and 'segments'
+        """
+        self._batches += 1
+        batch = self._batches
+
+        timed = [t for t in transcripts if t.get('start_time') is not None]
+        untimed = [t for t in transcripts if t.get('start_time') is None]
+        for transcript in sorted(timed, key=lambda t: t['start_time']) + untimed:
+            self._add(transcript, batch)
+
+        view = list(self._view(batch))
+
+        # Only the most recent turns are needed to continue the next batch
+        while len(self.turns) > self.max_turns:
+            for piece in self.turns.pop(0).pieces:
+                for key in piece.keys:
+                    self._pieces.pop(key, None)
+
+        return view
+
+    def _add(self, transcript, batch):
+        self.stats['segments'] += 1
+        key = transcript.get('segment_id') or transcript.get('id')
+        if key is None:
+            key = ('anonymous', self.stats['segments'])
+
+        known = self._pieces.get(key)
+        if known is not None:
+            # Retried batch or a resent segment: it's already in the turns
+            self.stats['repeated'] += 1
+            known.absorb(key, transcript, batch, owner=key in known.owners)
+            return
+
+        if not (transcript.get('text') or '').strip():
+            return
+
+        start = transcript.get('start_time')
+        if start is None:
+            start = self.turns[-1].end if self.turns else 0.0
+        end = transcript.get('end_time')
+        if end is None or end < start:
+            end = start
+        piece = _Piece(key, transcript, start, end, batch)
+
+        if self._collapse(piece, transcript):
+            return
+        self._pieces[key] = piece
+        self._insert(piece)
+
+    def _overlapping(self, piece):
+        """
+        Pieces of the same speaker whose time span overlaps the new piece, latest first
+
+        Segments that only touch (one ends where the next starts) don't
+        overlap, so a repeated word spoken twice is kept twice.
+        """
+        for turn in reversed(self.turns):
+            if turn.end < piece.start - TURN_GAP_SECONDS:
+                break
+            if turn.speaker != piece.speaker:
+                continue
+            for other in reversed(turn.pieces):
+                if other.start < piece.end and piece.start < other.end:
+                    yield turn, other
+
+    def _collapse(self, piece, transcript):
+        """
+        Fold the new piece into an overlapping one of the same speaker
+
+        Returns:
+            bool: True if the piece was absorbed and needs no turn of its own
+        """
+        for turn, other in self._overlapping(piece):
+            if _contains(other.words, piece.words) and (other.activation or not piece.activation):
+                # A fragment of speech already assembled
+                self.stats['collapsed'] += 1
+                other.absorb(piece.keys[0], transcript, piece.batch)
+                self._pieces[piece.keys[0]] = other
+                return True
+
+            if _contains(piece.words, other.words):
+                # The new segment extends an earlier partial one
+                self.stats['extended'] += 1
+                turn.chars += len(piece.text) - len(other.text)
+                other.set_text(piece.text)
+                other.start = min(other.start, piece.start)
+                other.end = max(other.end, piece.end)
+                other.absorb(piece.keys[0], transcript, piece.batch, owner=True)
+                self._pieces[piece.keys[0]] = other
+                self._trim_seam(turn, other)
+                return True
+
+            seam = _seam(other.words, piece.words) if other.start <= piece.start else 0
+            if seam:
+                # Drop the words repeated from the end of the earlier segment
+                self.stats['trimmed'] += 1
+                piece.drop_words(seam)
+                if not piece.words:
+                    other.absorb(piece.keys[0], transcript, piece.batch)
+                    self._pieces[piece.keys[0]] = other
+                    return True
+        return False
+
+    def _trim_seam(self, turn, piece):
+        """Drop words an extended piece repeats from the overlapping piece before it"""
+        index = turn.pieces.index(piece)
+        if index == 0:
+            return
+        previous = turn.pieces[index - 1]
+        if previous.end <= piece.start:
+            return
+        seam = _seam(previous.words, piece.words)
+        if seam and seam < len(piece.words):
+            self.stats['trimmed'] += 1
+            chars = len(piece.text)
+            piece.drop_words(seam)
+            turn.chars += len(piece.text) - chars
+
+    def _insert(self, piece):
+        """Place a piece in the turn it continues, or start a new turn"""
+        turns = self.turns
+        index = len(turns) - 1
+        while index >= 0 and turns[index].start > piece.start:
+            index -= 1
+
+        if index >= 0:
+            turn = turns[index]
+            if (turn.speaker == piece.speaker and piece.start - turn.end <= TURN_GAP_SECONDS
+                    and turn.chars + len(piece.text) <= TURN_MAX_CHARS):
+                turn.add(piece)
+                return
+            if piece.start < turn.end and turn.speaker != piece.speaker:
+                # Lands inside another speaker's turn: split it around the new piece
+                later = [p for p in turn.pieces if p.start > piece.start]
+                if later:
+                    turn.pieces = [p for p in turn.pieces if p.start <= piece.start]
+                    turn.chars = sum(len(p.text) + 1 for p in turn.pieces)
+                    rest = _Turn(later[0])
+                    for p in later[1:]:
+                        rest.add(p)
+                    turns.insert(index + 1, rest)
+
+        following = turns[index + 1] if index + 1 < len(turns) else None
+        if (following is not None and following.speaker == piece.speaker
+                and following.start - piece.end <= TURN_GAP_SECONDS
+                and following.chars + len(piece.text) <= TURN_MAX_CHARS):
+            following.add(piece)
+            return
+
+        turns.insert(index + 1, _Turn(piece))
+
+    def _view(self, batch):
+        """Turns restricted to the pieces the given batch touched"""
+        for turn in self.turns:
+            pieces = [p for p in turn.pieces if p.batch == batch]
+            if not pieces:
+                continue
+            ids = [p.id for p in pieces if p.id is not None]
+            yield {
+                'speaker': turn.speaker,
+                'text': ' '.join(p.text for p in pieces),
+                'start_time': pieces[0].start,
+                'end_time': max(p.end for p in pieces),
+                'activation': any(p.activation_batch == batch for p in pieces),
+                'id': max(ids) if ids else None,
+                'ids': ids,
+                'segments': sum(len(p.keys) for p in pieces),
+            }
+
+_assemblers = OrderedDict()  # session_id -> TurnAssembler, least recently used first
+_assemblers_lock = threading.Lock()
+_stats_lock = threading.Lock()
+_stats = {
+    'batches': 0,
+    'segments_in': 0,
+    'turns_out': 0,
+    'collapsed': 0,
+    'extended': 0,
+    'trimmed': 0,
+    'repeated': 0,
+}
+
+def assemble(session_id, transcripts):
+    """
+    Assemble a session's batch into speaker turns, continuing its earlier batches
+
+    Args:
+        session_id (str): Omi session ID, or None for a one-off assembly with no kept state
+        transcripts (list): The batch's transcript dicts
+
+    Returns:
+        list: Turn dicts in speech order (see TurnAssembler.add)
+    """
+    with _assemblers_lock:
+        if session_id is None:
+            assembler = TurnAssembler()
+        else:
+            assembler = _assemblers.get(session_id)
+            if assembler is None:
+                assembler = _assemblers[session_id] = TurnAssembler()
+                while len(_assemblers) > MAX_TRACKED_SESSIONS:
+                    _assemblers.popitem(last=False)
+            else:
+                _assemblers.move_to_end(session_id)
+        before = dict(assembler.stats)
+        result = assembler.add(transcripts)
+        counts = {name: assembler.stats[name] - before[name] for name in ('collapsed', 'extended', 'trimmed', 'repeated')}
+
+    with _stats_lock:
+        _stats['batches'] += 1
+        _stats['segments_in'] += len(transcripts)
+        _stats['turns_out'] += len(result)
+        for name, count in counts.items():
+            _stats[name] += count
+
+    return result
+
+def get_stats():
+    """
+    Get turn assembly statistics
+
+    Returns:
+        dict: Segments in, turns out, overlapping segments collapsed/trimmed
+              and the average number of segments per turn
+    """
+    with _stats_lock:
+        stats = dict(_stats)
+    with _assemblers_lock:
+        stats['tracked_sessions'] = len(_assemblers)
+
+    stats['segments_per_turn'] = round(stats['segments_in'] / stats['turns_out'], 2) if stats['turns_out'] else 0.0
+
+    return stats